@@ -0,0 +1,94 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+
+from ..database import get_db
+from ..models.user import User
+from ..core.deps import get_current_superuser
+from ..services.result_cache_service import ResultCacheService
+from ..services.usage_service import UsageService, SCOPE_USER, SCOPE_TASK_TYPE
+from ..services.code_service import code_flights
+from ..services.deployment_service import guide_flights
+from ..services.image_service import analysis_flights
+from ..services.near_duplicate_service import near_duplicate_stats
+from ..utils.http_pool import upstream_pool
+from ..utils.api_client import bulkheads, hedge_routers, key_pools
+from ..utils.rate_limiter import rate_limiter
+from ..utils.upstream_timeout import timeout_stats
+from ..utils.latency_tracker import latency_tracker
+from ..utils.task_registry import task_registry
+from ..utils.revalidation import revalidator
+
+router = APIRouter(prefix="/admin", tags=["系统管理"])
+
+
+@router.get("/upstream-stats", summary="上游调用统计")
+async def get_upstream_stats(
+    current_user: User = Depends(get_current_superuser),
+    db: Session = Depends(get_db)
+):
+    """
+    获取上游连接池、并发隔离、API密钥、限流、超时、对冲、结果缓存、任务取消与过期结果刷新等运行统计信息
+    """
+    return {
+        "success": True,
+        "data": {
+            "pools": upstream_pool.stats(),
+            "bulkheads": {name: bulkhead.stats() for name, bulkhead in bulkheads.items()},
+            "rate_limits": rate_limiter.stats(),
+            "api_keys": {name: pool.stats() for name, pool in key_pools.items()},
+            "timeouts": timeout_stats(),
+            "hedging": {name: router.stats() for name, router in hedge_routers.items()},
+            "result_cache": ResultCacheService(db).stats(),
+            "single_flight": {flights.name: flights.stats() for flights in (code_flights, guide_flights, analysis_flights)},
+            "task_cancellation": task_registry.stats(),
+            "stale_revalidation": revalidator.stats(),
+            "near_duplicates": near_duplicate_stats()
+        },
+        "message": "上游统计获取成功"
+    }
+
+
+@router.get("/upstream-latency", summary="上游延迟分布")
+async def get_upstream_latency(
+    current_user: User = Depends(get_current_superuser)
+):
+    """
+    获取各上游端点与Dify工作流节点的滚动延迟分布，以及据此推导出的超时
+    """
+    return {
+        "success": True,
+        "data": latency_tracker.stats(),
+        "message": "上游延迟分布获取成功"
+    }
+
+
+@router.get("/usage/users", summary="按用户汇总上游用量")
+async def get_usage_by_user(
+    days: int = 30,
+    current_user: User = Depends(get_current_superuser),
+    db: Session = Depends(get_db)
+):
+    """
+    获取最近N天各用户的上游token用量、费用与平均耗时（读取按天汇总，按费用降序）
+    """
+    return {
+        "success": True,
+        "data": UsageService(db).aggregate(SCOPE_USER, days),
+        "message": "用户用量获取成功"
+    }
+
+
+@router.get("/usage/task-types", summary="按任务类型汇总上游用量")
+async def get_usage_by_task_type(
+    days: int = 30,
+    current_user: User = Depends(get_current_superuser),
+    db: Session = Depends(get_db)
+):
+    """
+    获取最近N天各任务类型的上游token用量、费用、平均首字延迟与平均耗时
+    """
+    return {
+        "success": True,
+        "data": UsageService(db).aggregate(SCOPE_TASK_TYPE, days),
+        "message": "任务类型用量获取成功"
+    }
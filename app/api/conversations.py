@@ -1,7 +1,6 @@
 import logging
 from typing import List
 from fastapi import APIRouter, Depends, UploadFile, File, Form, BackgroundTasks
-from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from ..database import get_db
@@ -10,7 +9,9 @@ from ..models.conversation import Conversation
 from ..schemas.conversation import ConversationCreate, Conversation as ConversationSchema, ConversationWithFiles
 from ..services.image_service import ImageService
 from ..core.deps import get_current_active_user, check_conversation_owner
-from ..core.exceptions import create_http_exception, NotFoundError, ValidationError
+from ..core.exceptions import create_http_exception, NotFoundError, ValidationError, UpstreamUnavailableError, TaskCancelledError
+from ..utils.api_client import ensure_upstream_available, BREAKER_DIFY_WORKFLOW
+from ..utils.streaming import CancellableStreamingResponse
 import json
 
 logger = logging.getLogger(__name__)
@@ -77,26 +78,39 @@ async def upload_image(
     conversation_id: int,
     image: UploadFile = File(...),
     text_input: str = Form(None),
+    use_cache: bool = Form(True),
     current_user: User = Depends(get_current_active_user),
     conversation: Conversation = Depends(check_conversation_owner),
     db: Session = Depends(get_db)
 ):
     """
     上传图片到指定会话
+    
+    相同图片与文本需求已分析过时直接返回缓存结果（cached），use_cache=false 时强制重新分析
     """
     try:
         image_service = ImageService(db)
         
         # 验证图片
-        image_service.validate_image(image)
+        image_info = await image_service.validate_image(image)
+        
+        # 上游熔断或排队已满时快速失败（有缓存结果或降级模式下有上次成功的结果时照常返回）
+        try:
+            ensure_upstream_available(BREAKER_DIFY_WORKFLOW)
+        except UpstreamUnavailableError:
+            if not image_service.has_cached_result(image_info["sha256"], text_input, use_cache):
+                raise
         
         async def generate_progress():
-            async for progress_data in image_service.process_image_analysis(
-                conversation, current_user, image, text_input
-            ):
-                yield f"data: {json.dumps(progress_data, ensure_ascii=False)}\n\n"
+            try:
+                async for progress_data in image_service.process_image_analysis(
+                    conversation, current_user, image, text_input, use_cache, image_info
+                ):
+                    yield f"data: {json.dumps(progress_data, ensure_ascii=False)}\n\n"
+            except TaskCancelledError as e:
+                yield f"data: {json.dumps({'status': 'cancelled', 'message': e.message}, ensure_ascii=False)}\n\n"
         
-        return StreamingResponse(
+        return CancellableStreamingResponse(
             generate_progress(),
             media_type="text/event-stream",
             headers={
@@ -108,6 +122,8 @@ async def upload_image(
             }
         )
     
+    except UpstreamUnavailableError as e:
+        raise create_http_exception(e)
     except Exception as e:
         logger.error(f"图片上传失败: {str(e)}", exc_info=True)
         raise create_http_exception(ValidationError(f"图片上传失败: {str(e)}"))
@@ -117,23 +133,34 @@ async def upload_image(
 async def analyze_text(
     conversation_id: int,
     text_input: str = Form(...),
+    use_cache: bool = Form(True),
     current_user: User = Depends(get_current_active_user),
     conversation: Conversation = Depends(check_conversation_owner),
     db: Session = Depends(get_db)
 ):
     """
-    仅分析文本输入
+    仅分析文本输入（相同文本已分析过时直接返回缓存结果，use_cache=false 时强制重新分析）
     """
     try:
         image_service = ImageService(db)
         
+        # 上游熔断或排队已满时快速失败（有缓存结果或降级模式下有上次成功的结果时照常返回）
+        try:
+            ensure_upstream_available(BREAKER_DIFY_WORKFLOW)
+        except UpstreamUnavailableError:
+            if not image_service.has_cached_result(None, text_input, use_cache):
+                raise
+        
         async def generate_progress():
-            async for progress_data in image_service.process_image_analysis(
-                conversation, current_user, None, text_input
-            ):
-                yield f"data: {json.dumps(progress_data, ensure_ascii=False)}\n\n"
+            try:
+                async for progress_data in image_service.process_image_analysis(
+                    conversation, current_user, None, text_input, use_cache
+                ):
+                    yield f"data: {json.dumps(progress_data, ensure_ascii=False)}\n\n"
+            except TaskCancelledError as e:
+                yield f"data: {json.dumps({'status': 'cancelled', 'message': e.message}, ensure_ascii=False)}\n\n"
         
-        return StreamingResponse(
+        return CancellableStreamingResponse(
             generate_progress(),
             media_type="text/event-stream",
             headers={
@@ -145,6 +172,8 @@ async def analyze_text(
             }
         )
     
+    except UpstreamUnavailableError as e:
+        raise create_http_exception(e)
     except Exception as e:
         logger.error(f"文本分析失败: {str(e)}", exc_info=True)
         raise create_http_exception(ValidationError(f"文本分析失败: {str(e)}"))
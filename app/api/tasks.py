@@ -1,6 +1,6 @@
-from typing import List
+from typing import List, Optional
 from fastapi import APIRouter, Depends, Form, BackgroundTasks
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 import json
 import os
@@ -8,6 +8,7 @@ import os
 from ..database import get_db
 from ..models.user import User
 from ..models.conversation import Conversation
+from ..models.task import Task as TaskModel
 from ..schemas.task import (
     Task, TaskCreate, BOMAnalysisRequest, 
     CodeGenerationRequest, DeploymentGuideRequest
@@ -15,8 +16,13 @@ from ..schemas.task import (
 from ..services.bom_service import BOMService
 from ..services.code_service import CodeService
 from ..services.deployment_service import DeploymentService
-from ..core.deps import get_current_active_user, check_conversation_owner
-from ..core.exceptions import create_http_exception, ValidationError, NotFoundError
+from ..services.usage_service import UsageService
+from ..core.deps import get_current_active_user, check_conversation_owner, check_task_owner
+from ..core.exceptions import create_http_exception, ValidationError, NotFoundError, UpstreamUnavailableError, TaskCancelledError
+from ..config import settings
+from ..utils.api_client import ensure_upstream_available, get_provider, BREAKER_DIFY_CHAT
+from ..utils.streaming import CancellableStreamingResponse
+from ..utils.task_registry import task_registry
 
 router = APIRouter(prefix="/tasks", tags=["任务管理"])
 
@@ -51,23 +57,44 @@ async def analyze_bom(
 @router.post("/conversations/{conversation_id}/code-generation", summary="代码生成")
 async def generate_code(
     conversation_id: int,
+    use_cache: bool = True,
+    replay_mode: Optional[str] = None,
+    query: Optional[str] = None,
     current_user: User = Depends(get_current_active_user),
     conversation: Conversation = Depends(check_conversation_owner),
     db: Session = Depends(get_db)
 ):
     """
     生成电路控制代码
+    
+    输入未变化时回放缓存结果，replay_mode 可选 burst（一次性）或 paced（按间隔）；
+    相同输入正在生成时直接共享该生成的输出（shared）；
+    query 为追加指令（如“改为树莓派版本”），复用此前的Dify会话上下文；
+    开启降级模式时上游不可用会返回上次成功的结果，事件中 stale 为 true
     """
     try:
         code_service = CodeService(db)
         
+        # 上游熔断或排队已满时快速失败（降级模式下有上次成功的结果时照常返回）
+        try:
+            ensure_upstream_available(BREAKER_DIFY_CHAT)
+        except UpstreamUnavailableError:
+            if not code_service.has_stale_result(conversation, query):
+                raise
+        
         async def generate_code_stream():
-            async for code_chunk in code_service.generate_code(conversation, current_user):
-                yield f"data: {json.dumps({'type': 'code', 'content': code_chunk}, ensure_ascii=False)}\n\n"
+            try:
+                async for code_chunk in code_service.generate_code(
+                    conversation, current_user, use_cache, replay_mode, query
+                ):
+                    yield f"data: {json.dumps({'type': 'code', 'content': code_chunk, 'stale': code_service.stale}, ensure_ascii=False)}\n\n"
+            except TaskCancelledError as e:
+                yield f"data: {json.dumps({'type': 'cancelled', 'message': e.message}, ensure_ascii=False)}\n\n"
+                return
             
-            yield f"data: {json.dumps({'type': 'completed', 'message': '代码生成完成'}, ensure_ascii=False)}\n\n"
+            yield f"data: {json.dumps({'type': 'completed', 'message': '代码生成完成', 'cached': code_service.cache_hit, 'shared': code_service.coalesced, 'stale': code_service.stale}, ensure_ascii=False)}\n\n"
         
-        return StreamingResponse(
+        return CancellableStreamingResponse(
             generate_code_stream(),
             media_type="text/event-stream",
             headers={
@@ -79,6 +106,8 @@ async def generate_code(
             }
         )
         
+    except UpstreamUnavailableError as e:
+        raise create_http_exception(e)
     except Exception as e:
         raise create_http_exception(ValidationError(f"代码生成失败: {str(e)}"))
 
@@ -86,23 +115,37 @@ async def generate_code(
 @router.post("/conversations/{conversation_id}/deployment-guide", summary="生成部署指南")
 async def generate_deployment_guide(
     conversation_id: int,
+    use_cache: bool = True,
+    replay_mode: Optional[str] = None,
     current_user: User = Depends(get_current_active_user),
     conversation: Conversation = Depends(check_conversation_owner),
     db: Session = Depends(get_db)
 ):
     """
     生成部署指南
+    
+    输入未变化时回放缓存结果，replay_mode 可选 burst（一次性）或 paced（按间隔）；
+    相同输入正在生成时直接共享该生成的输出（shared）
     """
     try:
         deployment_service = DeploymentService(db)
         
+        # 上游熔断或排队已满时快速失败（按配置的对话提供方检查）
+        ensure_upstream_available(get_provider(settings.chat_provider).endpoint)
+        
         async def generate_guide_stream():
-            async for guide_chunk in deployment_service.generate_deployment_guide(conversation, current_user):
-                yield f"data: {json.dumps({'type': 'guide', 'content': guide_chunk}, ensure_ascii=False)}\n\n"
+            try:
+                async for guide_chunk in deployment_service.generate_deployment_guide(
+                    conversation, current_user, use_cache, replay_mode
+                ):
+                    yield f"data: {json.dumps({'type': 'guide', 'content': guide_chunk}, ensure_ascii=False)}\n\n"
+            except TaskCancelledError as e:
+                yield f"data: {json.dumps({'type': 'cancelled', 'message': e.message}, ensure_ascii=False)}\n\n"
+                return
             
-            yield f"data: {json.dumps({'type': 'completed', 'message': '部署指南生成完成'}, ensure_ascii=False)}\n\n"
+            yield f"data: {json.dumps({'type': 'completed', 'message': '部署指南生成完成', 'cached': deployment_service.cache_hit, 'shared': deployment_service.coalesced}, ensure_ascii=False)}\n\n"
         
-        return StreamingResponse(
+        return CancellableStreamingResponse(
             generate_guide_stream(),
             media_type="text/event-stream",
             headers={
@@ -114,10 +157,77 @@ async def generate_deployment_guide(
             }
         )
         
+    except UpstreamUnavailableError as e:
+        raise create_http_exception(e)
     except Exception as e:
         raise create_http_exception(ValidationError(f"部署指南生成失败: {str(e)}"))
 
 
+@router.post("/{task_id}/cancel", summary="取消任务")
+async def cancel_task(
+    task_id: int,
+    task: TaskModel = Depends(check_task_owner),
+    db: Session = Depends(get_db)
+):
+    """
+    取消运行中的任务，上游生成随之中止
+    """
+    if task.status not in ("pending", "running"):
+        raise create_http_exception(ValidationError(f"任务当前状态为 {task.status}，无法取消"))
+    
+    # 先写入数据库，任务不在本进程时由所在worker轮询发现（条件更新，任务恰好已结束时不覆盖）
+    updated = db.query(TaskModel).filter(
+        TaskModel.id == task_id,
+        TaskModel.status.in_(("pending", "running"))
+    ).update({"status": "cancelled", "error_message": "任务已被用户取消"}, synchronize_session=False)
+    db.commit()
+    if not updated:
+        db.refresh(task)
+        raise create_http_exception(ValidationError(f"任务当前状态为 {task.status}，无法取消"))
+    
+    cancelled_here = task_registry.cancel(task_id)
+    
+    return {
+        "success": True,
+        "data": {"task_id": task_id, "status": "cancelled", "local": cancelled_here},
+        "message": "任务已取消"
+    }
+
+
+@router.get("/{task_id}/usage", summary="获取任务用量")
+async def get_task_usage(
+    task_id: int,
+    task: TaskModel = Depends(check_task_owner),
+    db: Session = Depends(get_db)
+):
+    """
+    获取任务的上游token用量、首字延迟、总耗时与估算费用
+    """
+    usage = UsageService(db).get_task_usage(task_id)
+    if not usage:
+        raise create_http_exception(NotFoundError("该任务没有上游用量记录"))
+    
+    return {
+        "success": True,
+        "data": {
+            "task_id": task_id,
+            "task_type": usage.task_type,
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "total_tokens": usage.total_tokens,
+            "ttft_ms": usage.ttft_ms,
+            "duration_ms": usage.duration_ms,
+            "cost": usage.cost,
+            "estimated": usage.estimated,
+            "calls": [
+                dict(zip(("endpoint", "model", "prompt_tokens", "completion_tokens", "ttft_ms", "duration_ms"), call))
+                for call in usage.calls or []
+            ]
+        },
+        "message": "任务用量获取成功"
+    }
+
+
 @router.post("/conversations/{conversation_id}/text-to-speech", summary="文本转语音")
 async def text_to_speech(
     conversation_id: int,
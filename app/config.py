@@ -19,17 +19,133 @@ class Settings:
     api_key_dify: str = ""
     code_api_key_dify: str = ""
     code_api_url_dify: str = "https://genshinimpact.site/v1/chat-messages"
+    dify_upload_dedupe: bool = True  # 相同图片复用已上传的Dify文件ID
+    dify_file_retention_seconds: int = 86400  # 与Dify上传文件保留期保持一致
+    dify_workflow_version: str = "1"  # 修改图片分析工作流后更新，使已缓存的分析结果失效
       # 阿里云API配置
     alibaba_base_url: str = "https://dashscope.aliyuncs.com/compatible-mode/v1"
     alibaba_api_key: str = ""
+    alibaba_model: str = "qwen-max"
+    alibaba_fallback_model: str = "qwen-plus"  # 部署指南对冲请求使用的备用模型（留空关闭）
+    code_fallback_model: str = "qwen-plus"  # 代码生成对冲到备用提供方时使用的模型（留空关闭）
+    
+    # 大模型提供方配置（dify / dashscope / local）
+    chat_provider: str = "dashscope"  # 部署指南使用的提供方
+    fallback_provider: str = "dashscope"  # 对冲请求使用的提供方
+    local_llm_base_url: str = ""  # OpenAI兼容的本地服务地址，如 http://localhost:8000/v1（留空不启用）
+    local_llm_api_key: str = ""
+    local_llm_model: str = ""
+    
+    # 上游用量计费：模型（或端点名）的单价，单位为元/千token，格式 "模型:输入:输出,..."
+    model_prices: str = "qwen-max:0.0024:0.0096,qwen-plus:0.0008:0.002,qwen-turbo:0.0003:0.0006"
+    
+    # 对冲请求配置：首个分块超过延迟仍未到达时向备用模型发出第二个请求
+    hedge_enabled: bool = True
+    hedge_delay_seconds: float = 10.0
+    hedge_max_ratio: float = 0.1  # 滑动窗口内对冲请求占比上限
+    hedge_window_seconds: float = 300.0
+    
+    # API密钥池配置：上述密钥均可用逗号分隔配置多个（同一上游应用），按负载或轮询选择
+    api_key_selection: str = "least_loaded"  # least_loaded 或 round_robin
+    api_key_auth_quarantine_seconds: float = 3600.0  # 401/403 的密钥隔离时长
+    api_key_quota_quarantine_seconds: float = 60.0  # 429 的密钥隔离时长（上游给出Retry-After时以其为准）
     
     # Redis配置
     redis_url: Optional[str] = None
     
+    # 上游HTTP连接池配置
+    http2_enabled: bool = True
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_keepalive_expiry: float = 30.0
+    
+    # 上游熔断器配置
+    breaker_failure_rate_threshold: float = 0.5
+    breaker_slow_call_seconds: float = 30.0
+    breaker_slow_call_rate_threshold: float = 0.8
+    breaker_window_seconds: int = 60
+    breaker_minimum_calls: int = 5
+    breaker_open_seconds: int = 30
+    breaker_half_open_probes: int = 2
+    
+    # 上游分阶段超时配置（秒）：建连、首个事件、事件间空闲、总时长、文件上传
+    upstream_connect_timeout: float = 10.0
+    upstream_first_event_timeout: float = 60.0
+    upstream_idle_timeout: float = 30.0
+    upstream_total_timeout: float = 300.0
+    upstream_upload_timeout: float = 60.0
+    # 按端点覆盖，格式：端点:建连:首个事件:空闲:总时长（留空表示使用默认值）
+    upstream_timeout_overrides: str = ""
+    
+    # 自适应超时配置：按最近的上游延迟分布（端点首个事件/总时长、工作流节点耗时）推导超时与对冲截止时间
+    adaptive_timeouts_enabled: bool = True
+    adaptive_timeout_percentile: float = 99.0
+    adaptive_timeout_multiplier: float = 2.0
+    adaptive_timeout_min_seconds: float = 5.0  # 推导超时的下限（可低于上面的固定超时）
+    adaptive_timeout_max_seconds: float = 900.0  # 推导超时的上限
+    adaptive_timeout_max_growth: float = 1.5  # 每个样本窗口内推导超时最多增长的倍数
+    adaptive_timeout_min_samples: int = 20  # 样本不足时使用上面的固定超时
+    adaptive_hedge_percentile: float = 95.0
+    adaptive_hedge_min_seconds: float = 1.0
+    latency_window_size: int = 500  # 每个端点/节点保留的最近样本数
+    
+    # 任务取消配置：其他worker发起的取消通过轮询数据库发现（秒，0表示关闭）
+    task_cancel_poll_seconds: float = 2.0
+    
+    # 上游并发隔离配置
+    bulkhead_dify_max_concurrent: int = 10
+    bulkhead_dashscope_max_concurrent: int = 10
+    bulkhead_local_max_concurrent: int = 4
+    bulkhead_max_queue: int = 20
+    bulkhead_max_queue_seconds: float = 15.0
+    
+    # 上游限流配置（跨worker共享，配置redis_url时使用Redis，否则使用本地SQLite）
+    rate_limit_enabled: bool = True
+    # 格式：请求类别:每分钟请求数:每分钟token数（0表示不限制），每个API密钥独立计算
+    rate_limit_rules: str = "dify_upload:60:0,dify_workflow:30:0,dify_chat:60:100000,dashscope:60:100000"
+    rate_limit_store_path: str = "rate_limit.db"
+    rate_limit_max_wait_seconds: float = 10.0
+    rate_limit_redis_retry_seconds: float = 30.0  # Redis不可用后回退本地存储的时长
+    
+    # 生成结果缓存配置（代码生成/部署指南）
+    result_cache_enabled: bool = True
+    result_cache_max_bytes: int = 52428800  # 50MB
+    result_cache_ttl_seconds: int = 604800  # 7天
+    result_cache_replay_mode: str = "burst"  # burst: 一次性回放, paced: 按间隔回放
+    result_cache_replay_interval: float = 0.02
+    
+    # 降级模式（可选）：上游不可用时先返回相同输入上次成功的结果（标记为过期），恢复后在后台刷新
+    stale_while_revalidate_enabled: bool = False
+    stale_max_age_seconds: int = 2592000  # 过期结果在缓存有效期之后仍可返回的时长（30天）
+    stale_refresh_poll_seconds: float = 10.0
+    stale_refresh_max_wait_seconds: float = 600.0
+    
+    # 提示词压缩配置（代码生成/部署指南的需求文档与BOM，预算为估算token数，0表示不截断）
+    prompt_compaction_enabled: bool = True
+    prompt_token_budget: int = 6000
+    
     # 文件配置
     upload_dir: str = "uploads"
     max_file_size: int = 10485760  # 10MB
     
+    # 图片预处理配置：上传到Dify前按EXIF校正方向、缩小到最长边并重新压缩
+    # 默认关闭：开启后不再边写盘边流式上传原图，而是写盘后读回、重新编码再上传
+    image_preprocess_enabled: bool = False
+    image_max_edge: int = 2048
+    image_jpeg_quality: int = 85
+    image_preprocess_max_concurrent: int = 2  # 同时进行预处理的线程数上限
+    
+    # 图片校验配置：先按文件头识别格式与尺寸，完整性校验在线程池中执行
+    image_max_pixels: int = 89478485  # 与Pillow默认的解压炸弹阈值一致
+    image_deep_verify: bool = True
+    image_verify_max_concurrent: int = 2
+    
+    # 相似图片检测：按感知哈希（dHash）在用户其他会话中查找同一电路板的照片
+    near_duplicate_enabled: bool = True
+    near_duplicate_max_distance: int = 6  # 64位哈希的汉明距离上限
+    near_duplicate_mode: str = "offer"  # offer: 先推送历史结果再继续分析, reuse: 文本需求相同时直接复用
+    near_duplicate_index_max_images: int = 50000  # 进程内BK树索引的指纹总数上限（超出时淘汰最久未查询的用户）
+    
     # 日志配置
     log_level: str = "INFO"
     
@@ -53,15 +169,110 @@ class Settings:
         self.api_key_dify = os.getenv("API_KEY_DIFY", self.api_key_dify)
         self.code_api_key_dify = os.getenv("CODE_API_KEY_DIFY", self.code_api_key_dify)
         self.code_api_url_dify = os.getenv("CODE_API_URL_DIFY", self.code_api_url_dify)
+        self.dify_upload_dedupe = os.getenv("DIFY_UPLOAD_DEDUPE", "true").lower() == "true"
+        self.dify_file_retention_seconds = int(os.getenv("DIFY_FILE_RETENTION_SECONDS", self.dify_file_retention_seconds))
+        self.dify_workflow_version = os.getenv("DIFY_WORKFLOW_VERSION", self.dify_workflow_version)
         
         self.alibaba_base_url = os.getenv("ALIBABA_BASE_URL", self.alibaba_base_url)
         self.alibaba_api_key = os.getenv("ALIBABA_API_KEY", self.alibaba_api_key)
+        self.alibaba_model = os.getenv("ALIBABA_MODEL", self.alibaba_model)
+        self.alibaba_fallback_model = os.getenv("ALIBABA_FALLBACK_MODEL", self.alibaba_fallback_model)
+        self.code_fallback_model = os.getenv("CODE_FALLBACK_MODEL", self.code_fallback_model)
+        
+        self.chat_provider = os.getenv("CHAT_PROVIDER", self.chat_provider)
+        self.fallback_provider = os.getenv("FALLBACK_PROVIDER", self.fallback_provider)
+        self.local_llm_base_url = os.getenv("LOCAL_LLM_BASE_URL", self.local_llm_base_url)
+        self.local_llm_api_key = os.getenv("LOCAL_LLM_API_KEY", self.local_llm_api_key)
+        self.local_llm_model = os.getenv("LOCAL_LLM_MODEL", self.local_llm_model)
+        self.model_prices = os.getenv("MODEL_PRICES", self.model_prices)
+        
+        self.hedge_enabled = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+        self.hedge_delay_seconds = float(os.getenv("HEDGE_DELAY_SECONDS", self.hedge_delay_seconds))
+        self.hedge_max_ratio = float(os.getenv("HEDGE_MAX_RATIO", self.hedge_max_ratio))
+        self.hedge_window_seconds = float(os.getenv("HEDGE_WINDOW_SECONDS", self.hedge_window_seconds))
+        
+        self.api_key_selection = os.getenv("API_KEY_SELECTION", self.api_key_selection)
+        self.api_key_auth_quarantine_seconds = float(os.getenv("API_KEY_AUTH_QUARANTINE_SECONDS", self.api_key_auth_quarantine_seconds))
+        self.api_key_quota_quarantine_seconds = float(os.getenv("API_KEY_QUOTA_QUARANTINE_SECONDS", self.api_key_quota_quarantine_seconds))
         
         self.redis_url = os.getenv("REDIS_URL", self.redis_url)
         
+        self.http2_enabled = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+        self.http_max_connections = int(os.getenv("HTTP_MAX_CONNECTIONS", self.http_max_connections))
+        self.http_max_keepalive_connections = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", self.http_max_keepalive_connections))
+        self.http_keepalive_expiry = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", self.http_keepalive_expiry))
+        
+        self.breaker_failure_rate_threshold = float(os.getenv("BREAKER_FAILURE_RATE_THRESHOLD", self.breaker_failure_rate_threshold))
+        self.breaker_slow_call_seconds = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", self.breaker_slow_call_seconds))
+        self.breaker_slow_call_rate_threshold = float(os.getenv("BREAKER_SLOW_CALL_RATE_THRESHOLD", self.breaker_slow_call_rate_threshold))
+        self.breaker_window_seconds = int(os.getenv("BREAKER_WINDOW_SECONDS", self.breaker_window_seconds))
+        self.breaker_minimum_calls = int(os.getenv("BREAKER_MINIMUM_CALLS", self.breaker_minimum_calls))
+        self.breaker_open_seconds = int(os.getenv("BREAKER_OPEN_SECONDS", self.breaker_open_seconds))
+        self.breaker_half_open_probes = int(os.getenv("BREAKER_HALF_OPEN_PROBES", self.breaker_half_open_probes))
+        
+        self.upstream_connect_timeout = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", self.upstream_connect_timeout))
+        self.upstream_first_event_timeout = float(os.getenv("UPSTREAM_FIRST_EVENT_TIMEOUT", self.upstream_first_event_timeout))
+        self.upstream_idle_timeout = float(os.getenv("UPSTREAM_IDLE_TIMEOUT", self.upstream_idle_timeout))
+        self.upstream_total_timeout = float(os.getenv("UPSTREAM_TOTAL_TIMEOUT", self.upstream_total_timeout))
+        self.upstream_upload_timeout = float(os.getenv("UPSTREAM_UPLOAD_TIMEOUT", self.upstream_upload_timeout))
+        self.upstream_timeout_overrides = os.getenv("UPSTREAM_TIMEOUT_OVERRIDES", self.upstream_timeout_overrides)
+        
+        self.adaptive_timeouts_enabled = os.getenv("ADAPTIVE_TIMEOUTS_ENABLED", "true").lower() == "true"
+        self.adaptive_timeout_percentile = float(os.getenv("ADAPTIVE_TIMEOUT_PERCENTILE", self.adaptive_timeout_percentile))
+        self.adaptive_timeout_multiplier = float(os.getenv("ADAPTIVE_TIMEOUT_MULTIPLIER", self.adaptive_timeout_multiplier))
+        self.adaptive_timeout_min_seconds = float(os.getenv("ADAPTIVE_TIMEOUT_MIN_SECONDS", self.adaptive_timeout_min_seconds))
+        self.adaptive_timeout_max_seconds = float(os.getenv("ADAPTIVE_TIMEOUT_MAX_SECONDS", self.adaptive_timeout_max_seconds))
+        self.adaptive_timeout_max_growth = float(os.getenv("ADAPTIVE_TIMEOUT_MAX_GROWTH", self.adaptive_timeout_max_growth))
+        self.adaptive_timeout_min_samples = int(os.getenv("ADAPTIVE_TIMEOUT_MIN_SAMPLES", self.adaptive_timeout_min_samples))
+        self.adaptive_hedge_percentile = float(os.getenv("ADAPTIVE_HEDGE_PERCENTILE", self.adaptive_hedge_percentile))
+        self.adaptive_hedge_min_seconds = float(os.getenv("ADAPTIVE_HEDGE_MIN_SECONDS", self.adaptive_hedge_min_seconds))
+        self.latency_window_size = int(os.getenv("LATENCY_WINDOW_SIZE", self.latency_window_size))
+        
+        self.task_cancel_poll_seconds = float(os.getenv("TASK_CANCEL_POLL_SECONDS", self.task_cancel_poll_seconds))
+        
+        self.bulkhead_dify_max_concurrent = int(os.getenv("BULKHEAD_DIFY_MAX_CONCURRENT", self.bulkhead_dify_max_concurrent))
+        self.bulkhead_dashscope_max_concurrent = int(os.getenv("BULKHEAD_DASHSCOPE_MAX_CONCURRENT", self.bulkhead_dashscope_max_concurrent))
+        self.bulkhead_local_max_concurrent = int(os.getenv("BULKHEAD_LOCAL_MAX_CONCURRENT", self.bulkhead_local_max_concurrent))
+        self.bulkhead_max_queue = int(os.getenv("BULKHEAD_MAX_QUEUE", self.bulkhead_max_queue))
+        self.bulkhead_max_queue_seconds = float(os.getenv("BULKHEAD_MAX_QUEUE_SECONDS", self.bulkhead_max_queue_seconds))
+        
+        self.rate_limit_enabled = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+        self.rate_limit_rules = os.getenv("RATE_LIMIT_RULES", self.rate_limit_rules)
+        self.rate_limit_store_path = os.getenv("RATE_LIMIT_STORE_PATH", self.rate_limit_store_path)
+        self.rate_limit_max_wait_seconds = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", self.rate_limit_max_wait_seconds))
+        self.rate_limit_redis_retry_seconds = float(os.getenv("RATE_LIMIT_REDIS_RETRY_SECONDS", self.rate_limit_redis_retry_seconds))
+        
+        self.result_cache_enabled = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+        self.result_cache_max_bytes = int(os.getenv("RESULT_CACHE_MAX_BYTES", self.result_cache_max_bytes))
+        self.result_cache_ttl_seconds = int(os.getenv("RESULT_CACHE_TTL_SECONDS", self.result_cache_ttl_seconds))
+        self.result_cache_replay_mode = os.getenv("RESULT_CACHE_REPLAY_MODE", self.result_cache_replay_mode)
+        self.result_cache_replay_interval = float(os.getenv("RESULT_CACHE_REPLAY_INTERVAL", self.result_cache_replay_interval))
+        
+        self.stale_while_revalidate_enabled = os.getenv("STALE_WHILE_REVALIDATE_ENABLED", "false").lower() == "true"
+        self.stale_max_age_seconds = int(os.getenv("STALE_MAX_AGE_SECONDS", self.stale_max_age_seconds))
+        self.stale_refresh_poll_seconds = float(os.getenv("STALE_REFRESH_POLL_SECONDS", self.stale_refresh_poll_seconds))
+        self.stale_refresh_max_wait_seconds = float(os.getenv("STALE_REFRESH_MAX_WAIT_SECONDS", self.stale_refresh_max_wait_seconds))
+        
+        self.prompt_compaction_enabled = os.getenv("PROMPT_COMPACTION_ENABLED", "true").lower() == "true"
+        self.prompt_token_budget = int(os.getenv("PROMPT_TOKEN_BUDGET", self.prompt_token_budget))
+        
         self.upload_dir = os.getenv("UPLOAD_DIR", self.upload_dir)
         self.max_file_size = int(os.getenv("MAX_FILE_SIZE", self.max_file_size))
         
+        self.image_preprocess_enabled = os.getenv("IMAGE_PREPROCESS_ENABLED", "false").lower() == "true"
+        self.image_max_edge = int(os.getenv("IMAGE_MAX_EDGE", self.image_max_edge))
+        self.image_jpeg_quality = int(os.getenv("IMAGE_JPEG_QUALITY", self.image_jpeg_quality))
+        self.image_preprocess_max_concurrent = int(os.getenv("IMAGE_PREPROCESS_MAX_CONCURRENT", self.image_preprocess_max_concurrent))
+        
+        self.image_max_pixels = int(os.getenv("IMAGE_MAX_PIXELS", self.image_max_pixels))
+        self.image_deep_verify = os.getenv("IMAGE_DEEP_VERIFY", "true").lower() == "true"
+        self.image_verify_max_concurrent = int(os.getenv("IMAGE_VERIFY_MAX_CONCURRENT", self.image_verify_max_concurrent))
+        
+        self.near_duplicate_enabled = os.getenv("NEAR_DUPLICATE_ENABLED", "true").lower() == "true"
+        self.near_duplicate_max_distance = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", self.near_duplicate_max_distance))
+        self.near_duplicate_mode = os.getenv("NEAR_DUPLICATE_MODE", self.near_duplicate_mode)
+        self.near_duplicate_index_max_images = int(os.getenv("NEAR_DUPLICATE_INDEX_MAX_IMAGES", self.near_duplicate_index_max_images))
+        
         self.log_level = os.getenv("LOG_LEVEL", self.log_level)
         self.debug = os.getenv("DEBUG", "false").lower() == "true"
     
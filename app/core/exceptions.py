@@ -1,3 +1,4 @@
+from typing import Optional
 from fastapi import HTTPException, status
 
 
@@ -41,8 +42,25 @@ class FileUploadError(PCBToolException):
 
 class ExternalAPIError(PCBToolException):
     """外部API调用错误"""
-    def __init__(self, message: str = "外部API调用失败"):
+    def __init__(self, message: str = "外部API调用失败", upstream_status: Optional[int] = None):
         super().__init__(message, status.HTTP_502_BAD_GATEWAY)
+        self.upstream_status = upstream_status
+
+
+class UpstreamUnavailableError(ExternalAPIError):
+    """上游服务暂不可用（熔断中），客户端应稍后重试"""
+    def __init__(self, message: str = "上游服务暂不可用", retry_after: Optional[int] = None):
+        PCBToolException.__init__(self, message, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.upstream_status = None
+        self.retry_after = retry_after
+
+
+class UpstreamTimeoutError(ExternalAPIError):
+    """上游调用超时，phase 标明超时阶段（connect / first_event / idle / total）"""
+    def __init__(self, message: str = "上游服务响应超时", phase: str = "total"):
+        PCBToolException.__init__(self, message, status.HTTP_504_GATEWAY_TIMEOUT)
+        self.upstream_status = None
+        self.phase = phase
 
 
 class TaskError(PCBToolException):
@@ -51,9 +69,17 @@ class TaskError(PCBToolException):
         super().__init__(message, status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class TaskCancelledError(TaskError):
+    """任务已被取消（客户端断开或用户主动取消）"""
+    def __init__(self, message: str = "任务已取消"):
+        super().__init__(message)
+
+
 def create_http_exception(exc: PCBToolException) -> HTTPException:
     """将自定义异常转换为HTTPException"""
+    retry_after = getattr(exc, "retry_after", None)
     return HTTPException(
         status_code=exc.status_code,
-        detail=exc.message
+        detail=exc.message,
+        headers={"Retry-After": str(retry_after)} if retry_after else None
     )
@@ -9,7 +9,10 @@ from pathlib import Path
 
 from .config import settings
 from .database import create_tables
-from .api import auth, conversations, tasks
+from .api import auth, conversations, tasks, admin
+from .utils.http_pool import upstream_pool
+from .utils.api_client import circuit_breakers
+from .utils.task_registry import task_registry
 from .core.exceptions import PCBToolException, create_http_exception
 
 # 配置日志
@@ -36,10 +39,18 @@ async def lifespan(app: FastAPI):
     # 确保上传目录存在
     Path(settings.upload_dir).mkdir(parents=True, exist_ok=True)
     
+    # 创建上游共享连接池
+    await upstream_pool.startup()
+    
+    # 启动跨worker任务取消轮询
+    task_registry.start()
+    
     yield
     
     # 应用关闭时的清理工作
     logger.info("应用正在关闭...")
+    await task_registry.stop()
+    await upstream_pool.aclose()
 
 
 # 创建FastAPI应用
@@ -67,9 +78,11 @@ app.add_middleware(
 async def pcb_tool_exception_handler(request: Request, exc: PCBToolException):
     """处理自定义异常"""
     logger.error(f"PCBTool异常: {exc.message}")
+    retry_after = getattr(exc, "retry_after", None)
     return JSONResponse(
         status_code=exc.status_code,
-        content={"detail": exc.message, "type": type(exc).__name__}
+        content={"detail": exc.message, "type": type(exc).__name__},
+        headers={"Retry-After": str(retry_after)} if retry_after else None
     )
 
 
@@ -79,7 +92,8 @@ async def http_exception_handler(request: Request, exc: HTTPException):
     logger.error(f"HTTP异常: {exc.detail}")
     return JSONResponse(
         status_code=exc.status_code,
-        content={"detail": exc.detail}
+        content={"detail": exc.detail},
+        headers=getattr(exc, "headers", None)
     )
 
 
@@ -97,6 +111,7 @@ async def general_exception_handler(request: Request, exc: Exception):
 app.include_router(auth.router)
 app.include_router(conversations.router)
 app.include_router(tasks.router)
+app.include_router(admin.router)
 
 
 @app.get("/", summary="根路径")
@@ -112,10 +127,13 @@ async def root():
 @app.get("/health", summary="健康检查")
 async def health_check():
     """健康检查端点"""
+    breakers = {name: breaker.snapshot() for name, breaker in circuit_breakers.items()}
+    degraded = any(b["state"] != "closed" for b in breakers.values())
     return {
-        "status": "healthy",
+        "status": "degraded" if degraded else "healthy",
         "version": settings.app_version,
-        "timestamp": "2025-06-10T20:51:00"
+        "timestamp": "2025-06-10T20:51:00",
+        "upstreams": breakers
     }
 
 
@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, String, DateTime, Float
+from sqlalchemy.sql import func
+from ..database import Base
+
+
+class DifyFileUpload(Base):
+    __tablename__ = "dify_file_uploads"
+
+    id = Column(Integer, primary_key=True, index=True)
+    sha256 = Column(String(64), nullable=False, index=True)  # 上传文件内容哈希
+    dify_user = Column(String(100), nullable=False)  # 上传时使用的Dify用户标识
+    app_key = Column(String(20), nullable=False)  # API密钥指纹，文件归属于对应的Dify应用
+    upload_file_id = Column(String(100), nullable=False)
+
+    # Unix时间戳，与Dify文件保留期一致
+    expires_at = Column(Float, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
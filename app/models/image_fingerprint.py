@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
+from sqlalchemy.sql import func
+from ..database import Base
+
+
+class ImageFingerprint(Base):
+    __tablename__ = "image_fingerprints"
+    __table_args__ = (
+        Index("ix_image_fingerprints_user_id_id", "user_id", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False)
+    task_id = Column(Integer, ForeignKey("tasks.id"), nullable=False)  # 对该图片与文本需求完成分析的任务，复用其result_data
+    sha256 = Column(String(64), nullable=False)
+    dhash = Column(String(16), nullable=False)  # 64位差值哈希（十六进制）
+    prompt_hash = Column(String(64), nullable=False)  # 规范化文本需求的sha256，相同时才直接复用结果
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
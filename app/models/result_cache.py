@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, String, DateTime, JSON, Float
+from sqlalchemy.sql import func
+from ..database import Base
+
+
+class ResultCacheEntry(Base):
+    __tablename__ = "result_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String(64), unique=True, index=True, nullable=False)  # 输入与模型参数的sha256
+    namespace = Column(String(50), nullable=False, index=True)  # code_generation, deployment_guide
+
+    # 原始输出分块，命中时按相同SSE格式回放
+    chunks = Column(JSON, nullable=False)
+    size_bytes = Column(Integer, nullable=False, default=0)
+    hit_count = Column(Integer, default=0)
+
+    # Unix时间戳，便于跨数据库比较与LRU淘汰
+    last_accessed = Column(Float, nullable=False, index=True)
+    expires_at = Column(Float, nullable=False)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
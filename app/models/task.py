@@ -11,7 +11,7 @@ class Task(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False)
     task_type = Column(String(50), nullable=False)  # image_analysis, bom_analysis, code_generation, deployment
-    status = Column(String(20), default="pending")  # pending, running, completed, failed
+    status = Column(String(20), default="pending")  # pending, running, completed, failed, cancelled
     progress = Column(Float, default=0.0)
     
     # 输入数据
@@ -0,0 +1,50 @@
+from sqlalchemy import Column, Integer, String, DateTime, JSON, Float, Boolean, ForeignKey, UniqueConstraint, Index
+from sqlalchemy.sql import func
+from ..database import Base
+
+
+class TaskUsage(Base):
+    __tablename__ = "task_usage"
+
+    id = Column(Integer, primary_key=True, index=True)
+    task_id = Column(Integer, ForeignKey("tasks.id"), unique=True, nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    task_type = Column(String(50), nullable=False)
+
+    # 任务内所有上游调用（含对冲请求）的合计
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    total_tokens = Column(Integer, nullable=False, default=0)
+    ttft_ms = Column(Integer)
+    duration_ms = Column(Integer, nullable=False, default=0)
+    cost = Column(Float, nullable=False, default=0.0)
+    estimated = Column(Boolean, nullable=False, default=False)  # 上游未返回用量时按文本估算
+
+    # 各次上游调用明细 [[端点, 模型, 输入, 输出, 首字ms, 耗时ms], ...]
+    calls = Column(JSON)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class UsageRollup(Base):
+    """按天累加的用量汇总（scope为user或task_type），聚合查询只读汇总行"""
+
+    __tablename__ = "usage_rollups"
+    __table_args__ = (
+        UniqueConstraint("scope", "scope_key", "day", name="uq_usage_rollups_scope_key_day"),
+        Index("ix_usage_rollups_scope_day", "scope", "day"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    scope = Column(String(20), nullable=False)
+    scope_key = Column(String(50), nullable=False)
+    day = Column(String(10), nullable=False)  # UTC日期 YYYY-MM-DD
+
+    tasks = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    total_tokens = Column(Integer, nullable=False, default=0)
+    cost = Column(Float, nullable=False, default=0.0)
+    duration_ms = Column(Integer, nullable=False, default=0)
+    ttft_ms = Column(Integer, nullable=False, default=0)
+    ttft_count = Column(Integer, nullable=False, default=0)  # 有首字延迟的任务数（用于求平均）
@@ -1,10 +1,20 @@
-from typing import Dict, Any, AsyncGenerator
+import asyncio
+import time
+from typing import Dict, Any, AsyncGenerator, Optional
 from sqlalchemy.orm import Session
+from ..database import SessionLocal
 from ..models.conversation import Conversation
 from ..models.task import Task
 from ..models.user import User
-from ..utils.api_client import dify_client
-from ..core.exceptions import TaskError
+from ..utils.api_client import dify_client, circuit_breakers, BREAKER_DIFY_CHAT
+from ..utils.single_flight import SingleFlight, Flight
+from ..utils.task_registry import task_registry, finish_task
+from ..utils.prompt_compaction import compact_prompt_inputs
+from ..utils.revalidation import revalidator
+from ..utils.usage_meter import UsageMeter
+from ..core.exceptions import TaskError, ExternalAPIError
+from .result_cache_service import ResultCacheService
+from .usage_service import UsageService
 
 
 class CodeService:
@@ -12,67 +22,224 @@ class CodeService:
     
     def __init__(self, db: Session):
         self.db = db
+        self.cache_hit = False
+        self.coalesced = False
+        self.stale = False
     
     async def generate_code(
         self,
         conversation: Conversation,
-        user: User
+        user: User,
+        use_cache: bool = True,
+        replay_mode: Optional[str] = None,
+        query: Optional[str] = None
     ) -> AsyncGenerator[str, None]:
-        """生成电路代码"""
+        """生成电路代码（输入未变化时回放缓存结果，相同输入的并发请求共享同一次生成）
+
+        query 为追加指令（如“改为树莓派版本”），会话已有Dify上下文时只发送该指令
+        """
+        cache_key = self._cache_key(conversation.results or {}, query)
         
-        # 创建任务记录
-        task = Task(
-            user_id=user.id,
-            conversation_id=conversation.id,
-            task_type="code_generation",
-            status="running",
-            input_data={}
+        # 是否使用缓存与回放方式不同的请求产生的输出不同，不能合并到同一次生成
+        flight, started = code_flights.join(
+            (conversation.id, cache_key, use_cache, replay_mode),
+            lambda flight: self._produce(flight, conversation.id, user.id, use_cache, replay_mode, query)
         )
-        self.db.add(task)
-        self.db.commit()
-        self.db.refresh(task)
+        self.coalesced = not started
         
+        async for code_chunk in flight.subscribe():
+            self.stale = flight.info.get("stale", False)
+            yield code_chunk
+        self.cache_hit = flight.info.get("cache_hit", False)
+    
+    def has_stale_result(self, conversation: Conversation, query: Optional[str] = None) -> bool:
+        """降级模式下是否有相同输入上次成功的结果可返回"""
+        cache_key = self._cache_key(conversation.results or {}, query)
+        return ResultCacheService(self.db).get_stale("code_generation", cache_key) is not None
+    
+    @staticmethod
+    async def _revalidate(conversation_id: int, user_id: int, query: Optional[str], cache_key: str):
+        """上游恢复后在后台重新生成，刷新缓存与会话结果（使用独立数据库会话，不依赖发起请求）"""
+        db = SessionLocal()
         try:
-            # 检查是否有必要的数据
-            if not conversation.results:
-                raise TaskError("未找到会话数据，请先进行图片分析")
-            
-            requirement_document = conversation.results.get("需求文档", "")
-            bom_data = conversation.results.get("BOM文件", "")
-            
-            if not requirement_document and not bom_data:
-                raise TaskError("缺少需求文档或BOM数据")
-            
-            # 生成代码
-            full_code = ""
-            
-            async for code_chunk in dify_client.generate_code(
-                requirement_document=requirement_document,
-                bom_csv=bom_data,
-                user_id=str(user.id),
-                conversation_id=str(conversation.id)
-            ):
-                full_code += code_chunk
-                yield code_chunk
-            
-            # 更新任务状态
-            task.status = "completed"
-            task.progress = 100.0
-            task.result_data = {"generated_code": full_code}
-            self.db.commit()
-            
-            # 更新会话结果
-            if not conversation.results:
-                conversation.results = {}
-            conversation.results["generated_code"] = full_code
-            self.db.commit()
+            service = CodeService(db)
+            flight, _ = code_flights.join(
+                (conversation_id, cache_key, False, None),
+                lambda flight: service._produce(flight, conversation_id, user_id, False, None, query, allow_stale=False)
+            )
+            async for _ in flight.subscribe():
+                pass
+        finally:
+            db.close()
+    
+    @staticmethod
+    def _context_hash(results: Dict[str, Any]) -> str:
+        """Dify会话上下文（需求文档与BOM）的摘要，上下文变化后不能再复用旧会话"""
+        return ResultCacheService.make_key(
+            "dify_context",
+            {"requirement_document": results.get("需求文档", ""), "bom_csv": results.get("BOM文件", "")},
+            dify_client.code_generation_params()
+        )
+    
+    @classmethod
+    def _reusable_conversation(cls, results: Dict[str, Any]) -> Optional[str]:
+        """上下文未变化时返回可复用的Dify会话ID"""
+        if results.get("dify_context_hash") != cls._context_hash(results):
+            return None
+        return results.get("dify_conversation_id")
+    
+    @classmethod
+    def _cache_key(cls, results: Dict[str, Any], query: Optional[str]) -> str:
+        inputs = {"requirement_document": results.get("需求文档", ""), "bom_csv": results.get("BOM文件", "")}
+        if query:
+            # 追加指令的结果依赖所在的Dify会话
+            inputs["query"] = query
+            inputs["conversation"] = cls._reusable_conversation(results)
+        return ResultCacheService.make_key("code_generation", inputs, dify_client.code_generation_params())
+    
+    async def _produce(
+        self,
+        flight: Flight,
+        conversation_id: int,
+        user_id: int,
+        use_cache: bool,
+        replay_mode: Optional[str],
+        query: Optional[str],
+        allow_stale: bool = True
+    ) -> AsyncGenerator[str, None]:
+        """实际执行代码生成（独立数据库会话，不受发起请求断开影响）"""
+        db = SessionLocal()
+        usage = UsageMeter()
+        try:
+            # 创建任务记录
+            task = Task(
+                user_id=user_id,
+                conversation_id=conversation_id,
+                task_type="code_generation",
+                status="running",
+                input_data={}
+            )
+            db.add(task)
+            db.commit()
+            db.refresh(task)
+            flight.info["task_id"] = task.id
+            task_registry.register(task.id, flight.cancel)
             
-        except Exception as e:
-            # 更新任务状态为失败
-            task.status = "failed"
-            task.error_message = str(e)
-            self.db.commit()
-            raise TaskError(f"代码生成失败: {str(e)}")
+            try:
+                # 检查是否有必要的数据
+                conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+                if not conversation or not conversation.results:
+                    raise TaskError("未找到会话数据，请先进行图片分析")
+                
+                requirement_document = conversation.results.get("需求文档", "")
+                bom_data = conversation.results.get("BOM文件", "")
+                
+                if not requirement_document and not bom_data:
+                    raise TaskError("缺少需求文档或BOM数据")
+                
+                # 查询结果缓存
+                cache_service = ResultCacheService(db)
+                cache_key = self._cache_key(conversation.results, query)
+                cached_chunks = cache_service.get("code_generation", cache_key) if use_cache else None
+                cache_hit = flight.info["cache_hit"] = cached_chunks is not None
+                
+                prompt = None
+                route_info = {}
+                session = {}
+                if cache_hit:
+                    code_stream = cache_service.replay(cached_chunks, replay_mode)
+                else:
+                    # 压缩需求文档与BOM，减少输入token与首字延迟
+                    prompt = compact_prompt_inputs(requirement_document, bom_data)
+                    code_stream = dify_client.generate_code(
+                        requirement_document=prompt.requirement,
+                        bom_csv=prompt.bom,
+                        user_id=str(user_id),
+                        conversation_id=self._reusable_conversation(conversation.results),
+                        route_info=route_info,
+                        query=query,
+                        session=session,
+                        usage=usage
+                    )
+                
+                # 生成代码
+                chunks = []
+                stale = False
+                started = time.perf_counter()
+                first_chunk_ms = None
+                try:
+                    async for code_chunk in code_stream:
+                        if first_chunk_ms is None:
+                            first_chunk_ms = round((time.perf_counter() - started) * 1000, 2)
+                        chunks.append(code_chunk)
+                        yield code_chunk
+                except ExternalAPIError:
+                    stale_chunks = cache_service.get_stale("code_generation", cache_key) if allow_stale and not chunks else None
+                    if not stale_chunks:
+                        raise
+                    # 上游不可用：先返回上次成功的结果（标记为过期），熔断器放行后在后台刷新
+                    stale = flight.info["stale"] = True
+                    cache_service.mark_stale_served("code_generation")
+                    revalidator.schedule(
+                        ("code_generation", conversation_id, cache_key),
+                        circuit_breakers[BREAKER_DIFY_CHAT],
+                        lambda: CodeService._revalidate(conversation_id, user_id, query, cache_key)
+                    )
+                    chunks = stale_chunks
+                    for code_chunk in chunks:
+                        yield code_chunk
+                full_code = "".join(chunks)
+                
+                # 更新任务状态（已被取消时不覆盖，也不再写入缓存与会话结果）
+                finished = finish_task(
+                    db,
+                    task,
+                    status="completed",
+                    progress=100.0,
+                    input_data={
+                        "cache_hit": cache_hit,
+                        "stale": stale,
+                        # 压缩前后的token数与耗时，首个分块延迟用于对比压缩开启前后的效果
+                        "prompt": prompt.stats if prompt else None,
+                        "first_chunk_ms": first_chunk_ms,
+                        # 胜出路由（primary/fallback）与是否发出对冲请求
+                        "routing": route_info or None,
+                        # 是否复用了Dify会话上下文（只发送本次指令）
+                        "context_reused": session.get("context_reused", False),
+                        "duration_ms": round((time.perf_counter() - started) * 1000, 2)
+                    },
+                    result_data={"generated_code": full_code}
+                )
+                if not finished:
+                    return
+                
+                # 缓存键按主路由参数生成，备用模型胜出时的结果不写入缓存
+                if not cache_hit and not stale and route_info.get("route") == "primary":
+                    cache_service.put("code_generation", cache_key, chunks)
+                
+                # 更新会话结果（整体赋值，JSON列原地修改不会被持久化）
+                updates = {"generated_code": full_code}
+                if route_info.get("route") == "primary" and session.get("conversation_id"):
+                    # 记录Dify会话ID，后续追加指令时复用上游上下文
+                    updates["dify_conversation_id"] = session["conversation_id"]
+                    updates["dify_context_hash"] = self._context_hash(conversation.results)
+                conversation.results = {**conversation.results, **updates}
+                db.commit()
+                
+            except asyncio.CancelledError:
+                # 所有订阅者断开或用户主动取消，上游流随之关闭
+                finish_task(db, task, status="cancelled", error_message="任务已取消")
+                raise
+            except Exception as e:
+                # 更新任务状态为失败
+                finish_task(db, task, status="failed", error_message=str(e))
+                raise TaskError(f"代码生成失败: {str(e)}")
+        finally:
+            if "task_id" in flight.info:
+                task_registry.unregister(flight.info["task_id"])
+                # 记录本次任务的上游token用量、耗时与费用
+                UsageService(db).record(task, usage)
+            db.close()
     
     def get_code_template(self, code_type: str = "arduino") -> str:
         """获取代码模板"""
@@ -183,3 +350,7 @@ if __name__ == "__main__":
                 
         except Exception:
             return code
+
+
+# 进行中的代码生成（按 会话 + 输入哈希 合并）
+code_flights = SingleFlight("code_generation")
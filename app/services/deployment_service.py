@@ -1,14 +1,22 @@
-from typing import Dict, Any, AsyncGenerator
+import asyncio
+from typing import Dict, Any, AsyncGenerator, Optional
 from sqlalchemy.orm import Session
 import os
 from gtts import gTTS
 import glob
 import time
+from ..database import SessionLocal
 from ..models.conversation import Conversation
 from ..models.task import Task
 from ..models.user import User
 from ..utils.api_client import alibaba_client
+from ..utils.single_flight import SingleFlight, Flight
+from ..utils.task_registry import task_registry, finish_task
+from ..utils.prompt_compaction import compact_prompt_inputs
+from ..utils.usage_meter import UsageMeter
 from ..core.exceptions import TaskError
+from .result_cache_service import ResultCacheService
+from .usage_service import UsageService
 
 
 class DeploymentService:
@@ -16,65 +24,151 @@ class DeploymentService:
     
     def __init__(self, db: Session):
         self.db = db
+        self.cache_hit = False
+        self.coalesced = False
     
     async def generate_deployment_guide(
         self,
         conversation: Conversation,
-        user: User
+        user: User,
+        use_cache: bool = True,
+        replay_mode: Optional[str] = None
     ) -> AsyncGenerator[str, None]:
-        """生成部署指南"""
+        """生成部署指南（输入未变化时回放缓存结果，相同输入的并发请求共享同一次生成）"""
+        results = conversation.results or {}
+        cache_key = ResultCacheService.make_key(
+            "deployment_guide",
+            {"requirement_doc": results.get("需求文档", ""), "bom_data": results.get("BOM文件", "")},
+            alibaba_client.deployment_guide_params()
+        )
         
-        # 创建任务记录
-        task = Task(
-            user_id=user.id,
-            conversation_id=conversation.id,
-            task_type="deployment_guide",
-            status="running",
-            input_data={}
+        # 是否使用缓存与回放方式不同的请求产生的输出不同，不能合并到同一次生成
+        flight, started = guide_flights.join(
+            (conversation.id, cache_key, use_cache, replay_mode),
+            lambda flight: self._produce(flight, conversation.id, user.id, use_cache, replay_mode)
         )
-        self.db.add(task)
-        self.db.commit()
-        self.db.refresh(task)
+        self.coalesced = not started
         
+        async for guide_chunk in flight.subscribe():
+            yield guide_chunk
+        self.cache_hit = flight.info.get("cache_hit", False)
+    
+    async def _produce(
+        self,
+        flight: Flight,
+        conversation_id: int,
+        user_id: int,
+        use_cache: bool,
+        replay_mode: Optional[str]
+    ) -> AsyncGenerator[str, None]:
+        """实际执行部署指南生成（独立数据库会话，不受发起请求断开影响）"""
+        db = SessionLocal()
+        usage = UsageMeter()
         try:
-            # 检查是否有必要的数据
-            if not conversation.results:
-                raise TaskError("未找到会话数据，请先进行图片分析")
-            
-            requirement_doc = conversation.results.get("需求文档", "")
-            bom_data = conversation.results.get("BOM文件", "")
-            
-            if not requirement_doc and not bom_data:
-                raise TaskError("缺少需求文档或BOM数据")
-            
-            # 生成部署指南
-            full_guide = ""
+            # 创建任务记录
+            task = Task(
+                user_id=user_id,
+                conversation_id=conversation_id,
+                task_type="deployment_guide",
+                status="running",
+                input_data={}
+            )
+            db.add(task)
+            db.commit()
+            db.refresh(task)
+            flight.info["task_id"] = task.id
+            task_registry.register(task.id, flight.cancel)
             
-            async for guide_chunk in alibaba_client.generate_deployment_guide(
-                requirement_doc=requirement_doc,
-                bom_data=bom_data
-            ):
-                full_guide += guide_chunk
-                yield guide_chunk
-            
-            # 更新任务状态
-            task.status = "completed"
-            task.progress = 100.0
-            task.result_data = {"deployment_guide": full_guide}
-            self.db.commit()
-            
-            # 更新会话结果
-            if not conversation.results:
-                conversation.results = {}
-            conversation.results["deployment_guide"] = full_guide
-            self.db.commit()
-            
-        except Exception as e:
-            # 更新任务状态为失败
-            task.status = "failed"
-            task.error_message = str(e)
-            self.db.commit()
-            raise TaskError(f"部署指南生成失败: {str(e)}")
+            try:
+                # 检查是否有必要的数据
+                conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+                if not conversation or not conversation.results:
+                    raise TaskError("未找到会话数据，请先进行图片分析")
+                
+                requirement_doc = conversation.results.get("需求文档", "")
+                bom_data = conversation.results.get("BOM文件", "")
+                
+                if not requirement_doc and not bom_data:
+                    raise TaskError("缺少需求文档或BOM数据")
+                
+                # 查询结果缓存
+                cache_service = ResultCacheService(db)
+                cache_key = cache_service.make_key(
+                    "deployment_guide",
+                    {"requirement_doc": requirement_doc, "bom_data": bom_data},
+                    alibaba_client.deployment_guide_params()
+                )
+                cached_chunks = cache_service.get("deployment_guide", cache_key) if use_cache else None
+                cache_hit = flight.info["cache_hit"] = cached_chunks is not None
+                
+                prompt = None
+                route_info = {}
+                if cache_hit:
+                    guide_stream = cache_service.replay(cached_chunks, replay_mode)
+                else:
+                    # 压缩需求文档与BOM，减少输入token与首字延迟
+                    prompt = compact_prompt_inputs(requirement_doc, bom_data)
+                    guide_stream = alibaba_client.generate_deployment_guide(
+                        requirement_doc=prompt.requirement,
+                        bom_data=prompt.bom,
+                        user_id=str(user_id),
+                        route_info=route_info,
+                        usage=usage
+                    )
+                
+                # 生成部署指南
+                chunks = []
+                started = time.perf_counter()
+                first_chunk_ms = None
+                async for guide_chunk in guide_stream:
+                    if first_chunk_ms is None:
+                        first_chunk_ms = round((time.perf_counter() - started) * 1000, 2)
+                    chunks.append(guide_chunk)
+                    yield guide_chunk
+                full_guide = "".join(chunks)
+                
+                # 更新任务状态（已被取消时不覆盖，也不再写入缓存与会话结果）
+                finished = finish_task(
+                    db,
+                    task,
+                    status="completed",
+                    progress=100.0,
+                    input_data={
+                        "cache_hit": cache_hit,
+                        # 压缩前后的token数与耗时，首个分块延迟用于对比压缩开启前后的效果
+                        "prompt": prompt.stats if prompt else None,
+                        "first_chunk_ms": first_chunk_ms,
+                        # 胜出路由（primary/fallback）与是否发出对冲请求
+                        "routing": route_info or None,
+                        "duration_ms": round((time.perf_counter() - started) * 1000, 2)
+                    },
+                    result_data={"deployment_guide": full_guide}
+                )
+                if not finished:
+                    return
+                
+                # 缓存键按主路由参数生成，备用模型胜出时的结果不写入缓存
+                if not cache_hit and route_info.get("route") == "primary":
+                    cache_service.put("deployment_guide", cache_key, chunks)
+                
+                # 更新会话结果（整体赋值，JSON列原地修改不会被持久化）
+                conversation.results = {**conversation.results, "deployment_guide": full_guide}
+                db.commit()
+                
+            except asyncio.CancelledError:
+                # 所有订阅者断开或用户主动取消，上游流随之关闭
+                finish_task(db, task, status="cancelled", error_message="任务已取消")
+                raise
+            except Exception as e:
+                # 更新任务状态为失败
+                finish_task(db, task, status="failed", error_message=str(e))
+                raise TaskError(f"部署指南生成失败: {str(e)}")
+        finally:
+            if "task_id" in flight.info:
+                task_registry.unregister(flight.info["task_id"])
+                # 记录本次任务的上游token用量、耗时与费用
+                UsageService(db).record(task, usage)
+            db.close()
     
     def text_to_speech(self, text: str, user_id: int) -> str:
         """文本转语音"""
@@ -258,3 +352,7 @@ class DeploymentService:
             "checklist": checklist,
             "created_at": time.time()
         }
+
+
+# 进行中的部署指南生成（按 会话 + 输入哈希 合并）
+guide_flights = SingleFlight("deployment_guide")
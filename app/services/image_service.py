@@ -1,14 +1,31 @@
 import asyncio
-from typing import Dict, Any, AsyncGenerator
+import hashlib
+import json
+import logging
+import time
+from typing import Dict, Any, AsyncGenerator, Optional, Tuple
 from sqlalchemy.orm import Session
-from PIL import Image
+from ..config import settings
+from ..database import SessionLocal
 from ..models.user import User
-from ..models.conversation import Conversation
+from ..models.conversation import Conversation, ConversationFile
 from ..models.task import Task
+from ..models.dify_file import DifyFileUpload
 from ..schemas.task import TaskCreate, TaskUpdate
-from ..utils.api_client import dify_client
-from ..utils.file_utils import save_upload_file
-from ..core.exceptions import TaskError, FileUploadError
+from ..utils.api_client import dify_client, circuit_breakers, BREAKER_DIFY_WORKFLOW
+from ..utils.file_utils import tee_upload_file, get_file_type, SavedUpload
+from ..utils.image_preprocess import preprocess_image, discard_preprocessed
+from ..utils.image_validation import validate_image_upload
+from ..utils.single_flight import SingleFlight, Flight
+from ..utils.task_registry import task_registry, finish_task
+from ..utils.revalidation import revalidator
+from ..utils.usage_meter import UsageMeter
+from ..core.exceptions import TaskError, FileUploadError, ExternalAPIError
+from .result_cache_service import ResultCacheService
+from .usage_service import UsageService
+from .near_duplicate_service import NearDuplicateService
+
+logger = logging.getLogger(__name__)
 
 
 class ImageService:
@@ -22,9 +39,54 @@ class ImageService:
         conversation: Conversation,
         user: User,
         image_file,
-        text_input: str = None
+        text_input: str = None,
+        use_cache: bool = True,
+        image_info: Optional[Dict[str, Any]] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """处理图片分析任务（在独立任务中执行，客户端断开或主动取消时中止上游调用）
+
+        相同图片与文本需求已分析过时直接返回缓存结果，use_cache 为False时强制重新分析；
+        image_info 为 validate_image 的返回值（sha256与感知哈希），避免重复读取上传内容
+        """
+        flight = analysis_flights.start(
+            lambda flight: self._produce(flight, conversation.id, user.id, image_file, text_input, use_cache, image_info)
+        )
+        async for progress_data in flight.subscribe():
+            yield progress_data
+    
+    async def _produce(
+        self,
+        flight: Flight,
+        conversation_id: int,
+        user_id: int,
+        image_file,
+        text_input: str = None,
+        use_cache: bool = True,
+        image_info: Optional[Dict[str, Any]] = None
     ) -> AsyncGenerator[Dict[str, Any], None]:
-        """处理图片分析任务"""
+        """使用独立数据库会话执行分析，不受发起请求结束影响"""
+        db = SessionLocal()
+        try:
+            conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+            user = db.query(User).filter(User.id == user_id).first()
+            async for progress_data in ImageService(db)._analyze(
+                flight, conversation, user, image_file, text_input, use_cache, image_info
+            ):
+                yield progress_data
+        finally:
+            db.close()
+    
+    async def _analyze(
+        self,
+        flight: Flight,
+        conversation: Conversation,
+        user: User,
+        image_file,
+        text_input: str = None,
+        use_cache: bool = True,
+        image_info: Optional[Dict[str, Any]] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """执行图片分析工作流"""
         
         # 创建任务记录
         task = Task(
@@ -39,72 +101,195 @@ class ImageService:
         self.db.add(task)
         self.db.commit()
         self.db.refresh(task)
+        task_registry.register(task.id, flight.cancel)
         
+        image_hash = None
+        file_path = None
+        usage = UsageMeter()
         try:
             # 保存上传的图片
+            image_id = None
+            reused_upload = False
             if image_file:
-                file_path, filename = await save_upload_file(
-                    image_file, user.id, conversation.id
+                # 校验时已在同一次读取中计算sha256与感知哈希：查找已缓存的分析结果，相同图片复用仍有效的Dify文件ID
+                if image_info is None:
+                    image_info = await self.validate_image(image_file)
+                image_hash = image_info["sha256"]
+            
+            # 相同图片与文本需求已分析过时直接返回结果，不再运行工作流
+            cache_service = ResultCacheService(self.db)
+            cache_key = self.analysis_key(image_hash, text_input)
+            cached_chunks = cache_service.get("image_analysis", cache_key) if use_cache else None
+            if cached_chunks is not None:
+                results = json.loads(cached_chunks[0])
+                if not await self._complete_early(task, conversation, user, image_file, results, {
+                    "image_sha256": image_hash, "cache_hit": True
+                }):
+                    return
+                yield {
+                    "type": "completed",
+                    "message": "处理完成（相同图片与需求已分析过，直接返回结果）",
+                    "task_id": task.id,
+                    "results": results,
+                    "cached": True
+                }
+                return
+            
+            # 按感知哈希查找用户其他会话中同一电路板的照片（换角度、换构图重新拍摄）
+            value_hash = None
+            prompt_hash = self.prompt_hash(text_input)
+            if image_file and settings.near_duplicate_enabled:
+                value_hash = image_info.get("dhash")
+                if value_hash is not None:
+                    near_duplicates = NearDuplicateService(self.db)
+                    match = near_duplicates.find(user.id, value_hash, conversation.id) if use_cache else None
+                    if match:
+                        near_duplicate = {
+                            "conversation_id": match["conversation_id"],
+                            "title": match["title"],
+                            "distance": match["distance"]
+                        }
+                        if settings.near_duplicate_mode == "reuse" and match["prompt_hash"] == prompt_hash:
+                            # 文本需求相同：直接复用历史结果，不再运行工作流
+                            near_duplicates.mark("reused")
+                            if not await self._complete_early(task, conversation, user, image_file, match["results"], {
+                                "image_sha256": image_hash, "near_duplicate": near_duplicate
+                            }):
+                                return
+                            yield {
+                                "type": "completed",
+                                "message": f"处理完成（与会话「{match['title']}」中的图片相似，直接复用其分析结果）",
+                                "task_id": task.id,
+                                "results": match["results"],
+                                "near_duplicate": near_duplicate
+                            }
+                            return
+                        
+                        # 先推送历史结果供立即使用，再继续分析
+                        near_duplicates.mark("offered")
+                        task.input_data = {**task.input_data, "near_duplicate": near_duplicate}
+                        self.db.commit()
+                        yield {
+                            "type": "near_duplicate",
+                            "message": f"发现与会话「{match['title']}」相似的图片，可先使用其分析结果，正在重新分析...",
+                            "task_id": task.id,
+                            "results": match["results"],
+                            "near_duplicate": near_duplicate
+                        }
+            
+            if image_file:
+                dify_user = str(user.id)
+                if settings.dify_upload_dedupe:
+                    image_id = self._find_dify_file(image_hash, dify_user)
+                    reused_upload = image_id is not None
+                
+                # 单次读取上传内容：边写磁盘边流式上传到Dify（复用文件ID或需要预处理时只写磁盘）
+                upload_sink = None
+                if not reused_upload and not settings.image_preprocess_enabled:
+                    async def upload_sink(chunks, filename):
+                        return await dify_client.upload_file_stream(
+                            chunks, filename, image_file.content_type, dify_user, image_file.size
+                        )
+                
+                saved, uploaded_id = await tee_upload_file(
+                    image_file, user.id, conversation.id, upload_sink, image_hash
                 )
+                file_path = saved.file_path
+                self._record_upload(task, conversation, image_file, saved)
                 
-                # 上传到Dify
-                image_id = await dify_client.upload_file(file_path, str(user.id))
-                if not image_id:
-                    raise TaskError("图片上传到Dify失败")
+                preprocess = None
+                if not reused_upload and settings.image_preprocess_enabled:
+                    # 校正方向、缩小并重新压缩后再上传（在线程池中执行）
+                    image_id, preprocess = await self._upload_preprocessed(file_path, image_hash, dify_user)
+                elif not reused_upload:
+                    if not uploaded_id:
+                        raise TaskError("图片上传到Dify失败")
+                    image_id = uploaded_id
+                    self._remember_dify_file(image_hash, dify_user, image_id)
                 
-                inputs = {
-                    "image": {
-                        "transfer_method": "local_file",
-                        "upload_file_id": image_id,
-                        "type": "image"
-                    }
+                task.input_data = {
+                    **task.input_data,
+                    "upload_reused": reused_upload,
+                    # 预处理前后的字节数、尺寸与耗时
+                    "preprocess": preprocess
                 }
-            else:
-                inputs = {}
-            
-            if text_input:
-                inputs["text_in"] = text_input
+                self.db.commit()
             
             # 处理工作流
             results = {"BOM文件": "", "需求文档": ""}
             
-            async for event_data in dify_client.process_workflow(inputs, str(user.id)):
-                event_type = event_data.get("event")
-                
-                if event_type == "node_started":
-                    title = event_data.get('data', {}).get('title', '未知节点')
-                    yield {
-                        "type": "progress",
-                        "message": f"▷ 正在处理节点：{title}",
-                        "task_id": task.id
+            while True:
+                inputs = {}
+                if image_id:
+                    inputs["image"] = {
+                        "transfer_method": "local_file",
+                        "upload_file_id": image_id,
+                        "type": "image"
                     }
+                if text_input:
+                    inputs["text_in"] = text_input
                 
-                elif event_type == "node_finished":
-                    data = event_data.get('data', {})
-                    status = data.get('status', 'unknown')
-                    elapsed_time = data.get('elapsed_time', 0)
-                    status_icon = "✓" if status == "succeeded" else "✗"
+                workflow_started = False
+                try:
+                    async for event_data in dify_client.process_workflow(inputs, str(user.id), usage):
+                        workflow_started = True
+                        event_type = event_data.get("event")
+                        
+                        if event_type == "node_started":
+                            title = event_data.get('data', {}).get('title', '未知节点')
+                            yield {
+                                "type": "progress",
+                                "message": f"▷ 正在处理节点：{title}",
+                                "task_id": task.id
+                            }
+                        
+                        elif event_type == "node_finished":
+                            data = event_data.get('data', {})
+                            status = data.get('status', 'unknown')
+                            elapsed_time = data.get('elapsed_time', 0)
+                            status_icon = "✓" if status == "succeeded" else "✗"
+                            yield {
+                                "type": "progress",
+                                "message": f"{status_icon} 节点状态：{status} | 耗时：{elapsed_time:.1f}s",
+                                "task_id": task.id
+                            }
+                        
+                        elif event_type == "workflow_finished":
+                            outputs = event_data.get("data", {}).get("outputs", {})
+                            results.update({k: v or "" for k, v in outputs.items()})
+                    break
+                
+                except ExternalAPIError as e:
+                    # 复用的文件ID可能已被Dify清理（工作流启动即返回400/404），重新上传后重试一次
+                    if not reused_upload or workflow_started or e.upstream_status not in (400, 404):
+                        raise
+                    logger.info(f"复用的Dify文件 {image_id} 可能已失效，重新上传")
+                    self._forget_dify_file(image_hash, dify_user)
+                    image_id, _ = await self._upload_preprocessed(file_path, image_hash, dify_user)
+                    reused_upload = False
                     yield {
                         "type": "progress",
-                        "message": f"{status_icon} 节点状态：{status} | 耗时：{elapsed_time:.1f}s",
+                        "message": "▷ 已缓存的图片文件失效，已重新上传",
                         "task_id": task.id
                     }
-                
-                elif event_type == "workflow_finished":
-                    outputs = event_data.get("data", {}).get("outputs", {})
-                    results.update({k: v or "" for k, v in outputs.items()})
             
-            # 更新任务状态
-            task.status = "completed"
-            task.progress = 100.0
-            task.result_data = results
-            self.db.commit()
+            # 更新任务状态（已被取消时不覆盖，也不再写入会话结果与缓存）
+            if not finish_task(self.db, task, status="completed", progress=100.0, result_data=results):
+                return
             
             # 更新会话结果
-            conversation.results = conversation.results or {}
-            conversation.results.update(results)
+            conversation.results = {**(conversation.results or {}), **results}
             self.db.commit()
             
+            # 分析成功后才记录感知哈希，相似图片复用的是本任务的结果（失败或取消的分析不会成为匹配目标）
+            if value_hash is not None:
+                NearDuplicateService(self.db).record(
+                    user.id, conversation.id, task.id, image_hash, value_hash, prompt_hash
+                )
+            
+            # 缓存本次结果：相同输入再次分析时直接返回，上游不可用时也可作为过期结果返回
+            cache_service.put("image_analysis", cache_key, [json.dumps(results, ensure_ascii=False)])
+            
             yield {
                 "type": "completed",
                 "message": "处理完成",
@@ -112,11 +297,54 @@ class ImageService:
                 "results": results
             }
             
+        except asyncio.CancelledError:
+            # 客户端断开或用户主动取消，上游流随之关闭
+            finish_task(self.db, task, status="cancelled", error_message="任务已取消")
+            raise
         except Exception as e:
+            stale_results = self._stale_results(image_hash, text_input) if isinstance(e, ExternalAPIError) else None
+            if stale_results is not None:
+                # 上游不可用：返回上次成功的结果（标记为过期），熔断器放行后在后台刷新
+                logger.info(f"上游不可用，返回上次的分析结果: {str(e)}")
+                if image_file and file_path is None:
+                    try:
+                        saved, _ = await tee_upload_file(image_file, user.id, conversation.id, sha256=image_hash)
+                        file_path = saved.file_path
+                        self._record_upload(task, conversation, image_file, saved)
+                    except FileUploadError:
+                        file_path = None
+                if file_path or not image_file:
+                    revalidator.schedule(
+                        ("image_analysis", conversation.id, self.analysis_key(image_hash, text_input)),
+                        circuit_breakers[BREAKER_DIFY_WORKFLOW],
+                        lambda: ImageService._refresh_analysis(
+                            conversation.id, user.id, file_path, image_hash, text_input
+                        )
+                    )
+                
+                if not finish_task(
+                    self.db,
+                    task,
+                    status="completed",
+                    progress=100.0,
+                    input_data={**task.input_data, "stale": True},
+                    result_data=stale_results
+                ):
+                    return
+                conversation.results = {**(conversation.results or {}), **stale_results}
+                self.db.commit()
+                
+                yield {
+                    "type": "completed",
+                    "message": "上游服务暂不可用，返回上次的分析结果",
+                    "task_id": task.id,
+                    "results": stale_results,
+                    "stale": True
+                }
+                return
+            
             # 更新任务状态为失败
-            task.status = "failed"
-            task.error_message = str(e)
-            self.db.commit()
+            finish_task(self.db, task, status="failed", error_message=str(e))
             
             yield {
                 "type": "error",
@@ -124,24 +352,191 @@ class ImageService:
                 "task_id": task.id
             }
             raise TaskError(f"图片分析失败: {str(e)}")
+        finally:
+            task_registry.unregister(task.id)
+            # 记录本次任务的上游token用量、耗时与费用
+            UsageService(self.db).record(task, usage)
+    
+    async def _complete_early(
+        self,
+        task: Task,
+        conversation: Conversation,
+        user: User,
+        image_file,
+        results: Dict[str, Any],
+        input_data: Dict[str, Any]
+    ) -> bool:
+        """不运行工作流直接以已有结果完成任务（仍保存原图，会话中的上传记录保持完整），任务已被取消时返回False"""
+        if image_file:
+            saved, _ = await tee_upload_file(image_file, user.id, conversation.id, sha256=input_data.get("image_sha256"))
+            self._record_upload(task, conversation, image_file, saved)
+        if not finish_task(
+            self.db,
+            task,
+            status="completed",
+            progress=100.0,
+            input_data={**task.input_data, **input_data},
+            result_data=results
+        ):
+            return False
+        conversation.results = {**(conversation.results or {}), **results}
+        self.db.commit()
+        return True
+    
+    def _record_upload(self, task: Task, conversation: Conversation, image_file, saved: SavedUpload):
+        """记录已保存的上传图片：会话文件记录（路径与大小），任务输入中记录sha256与大小"""
+        self.db.add(ConversationFile(
+            conversation_id=conversation.id,
+            filename=saved.filename,
+            original_name=image_file.filename or saved.filename,
+            file_path=saved.file_path,
+            file_type=get_file_type(saved.filename),
+            file_size=saved.size
+        ))
+        task.input_data = {**task.input_data, "image_sha256": saved.sha256, "image_size": saved.size}
+        self.db.commit()
+    
+    @staticmethod
+    def normalize_text(text_input: Optional[str]) -> str:
+        """规范化文本需求（合并空白）"""
+        return " ".join((text_input or "").split())
+    
+    @classmethod
+    def prompt_hash(cls, text_input: Optional[str]) -> str:
+        return hashlib.sha256(cls.normalize_text(text_input).encode("utf-8")).hexdigest()
+    
+    @staticmethod
+    def analysis_key(image_hash: Optional[str], text_input: Optional[str]) -> str:
+        """图片分析结果的缓存键（图片哈希、规范化后的文本需求、工作流应用与版本）"""
+        return ResultCacheService.make_key(
+            "image_analysis",
+            {"image_sha256": image_hash, "text_input": ImageService.normalize_text(text_input)},
+            {
+                "endpoint": dify_client.api_url,
+                "app": dify_client.api_keys.fingerprint,
+                "workflow_version": settings.dify_workflow_version
+            }
+        )
+    
+    def _stale_results(self, image_hash: Optional[str], text_input: Optional[str]) -> Optional[Dict[str, Any]]:
+        """降级模式下相同输入上次成功的分析结果"""
+        cache_service = ResultCacheService(self.db)
+        chunks = cache_service.get_stale("image_analysis", self.analysis_key(image_hash, text_input))
+        if not chunks:
+            return None
+        cache_service.mark_stale_served("image_analysis")
+        return json.loads(chunks[0])
+    
+    def has_cached_result(self, image_hash: Optional[str], text_input: Optional[str], use_cache: bool = True) -> bool:
+        """上游不可用时是否有可直接返回的结果（未过期的缓存，或降级模式下上次成功的结果）"""
+        if not settings.result_cache_enabled:
+            return False
+        cache_key = self.analysis_key(image_hash, text_input)
+        cache_service = ResultCacheService(self.db)
+        if use_cache and cache_service.exists(cache_key):
+            return True
+        return cache_service.get_stale("image_analysis", cache_key) is not None
     
-    def validate_image(self, image_file) -> bool:
-        """验证图片文件"""
+    @staticmethod
+    async def _refresh_analysis(
+        conversation_id: int,
+        user_id: int,
+        file_path: Optional[str],
+        image_hash: Optional[str],
+        text_input: Optional[str]
+    ):
+        """上游恢复后在后台重新分析，刷新缓存与会话结果"""
+        db = SessionLocal()
         try:
-            # 检查文件类型
-            if not image_file.content_type.startswith('image/'):
-                raise FileUploadError("请上传图片文件")
-            
-            # 尝试打开图片验证格式
-            image = Image.open(image_file.file)
-            image.verify()
+            inputs = {}
+            if file_path:
+                image_id, _ = await ImageService(db)._upload_preprocessed(file_path, image_hash, str(user_id))
+                inputs["image"] = {
+                    "transfer_method": "local_file",
+                    "upload_file_id": image_id,
+                    "type": "image"
+                }
+            if text_input:
+                inputs["text_in"] = text_input
             
-            # 重置文件指针
-            image_file.file.seek(0)
-            return True
+            results = {"BOM文件": "", "需求文档": ""}
+            async for event_data in dify_client.process_workflow(inputs, str(user_id)):
+                if event_data.get("event") == "workflow_finished":
+                    outputs = event_data.get("data", {}).get("outputs", {})
+                    results.update({k: v or "" for k, v in outputs.items()})
             
-        except Exception as e:
-            raise FileUploadError(f"无效的图片文件: {str(e)}")
+            ResultCacheService(db).put(
+                "image_analysis",
+                ImageService.analysis_key(image_hash, text_input),
+                [json.dumps(results, ensure_ascii=False)]
+            )
+            conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+            if conversation:
+                conversation.results = {**(conversation.results or {}), **results}
+                db.commit()
+        finally:
+            db.close()
+    
+    def _find_dify_file(self, image_hash: str, dify_user: str) -> Optional[str]:
+        """查找相同图片仍有效的Dify文件ID"""
+        record = self.db.query(DifyFileUpload).filter(
+            DifyFileUpload.sha256 == image_hash,
+            DifyFileUpload.dify_user == dify_user,
+            DifyFileUpload.app_key == dify_client.api_keys.fingerprint,
+            DifyFileUpload.expires_at > time.time()
+        ).order_by(DifyFileUpload.expires_at.desc()).first()
+        return record.upload_file_id if record else None
+    
+    def _remember_dify_file(self, image_hash: str, dify_user: str, image_id: str):
+        """记录图片哈希与Dify文件ID的映射"""
+        if not settings.dify_upload_dedupe:
+            return
+        self.db.add(DifyFileUpload(
+            sha256=image_hash,
+            dify_user=dify_user,
+            app_key=dify_client.api_keys.fingerprint,
+            upload_file_id=image_id,
+            expires_at=time.time() + settings.dify_file_retention_seconds
+        ))
+        self.db.commit()
+    
+    async def _upload_to_dify(self, file_path: str, image_hash: str, dify_user: str) -> str:
+        """从磁盘重新上传图片到Dify并记录映射"""
+        image_id = await dify_client.upload_file(file_path, dify_user)
+        if not image_id:
+            raise TaskError("图片上传到Dify失败")
+        self._remember_dify_file(image_hash, dify_user, image_id)
+        return image_id
+    
+    async def _upload_preprocessed(
+        self,
+        file_path: str,
+        image_hash: str,
+        dify_user: str
+    ) -> Tuple[str, Dict[str, Any]]:
+        """预处理后上传到Dify（未开启预处理时上传原图），上传后删除预处理生成的文件"""
+        upload_path, preprocess = await preprocess_image(file_path)
+        try:
+            image_id = await self._upload_to_dify(upload_path, image_hash, dify_user)
+        finally:
+            discard_preprocessed(upload_path, file_path)
+        return image_id, preprocess
+    
+    def _forget_dify_file(self, image_hash: str, dify_user: str):
+        """删除失效的文件ID映射（仅限当前Dify应用，其他应用上传的同一图片仍然有效）"""
+        self.db.query(DifyFileUpload).filter(
+            DifyFileUpload.sha256 == image_hash,
+            DifyFileUpload.dify_user == dify_user,
+            DifyFileUpload.app_key == dify_client.api_keys.fingerprint
+        ).delete(synchronize_session=False)
+        self.db.commit()
+    
+    async def validate_image(self, image_file) -> Dict[str, Any]:
+        """验证图片文件（先解析文件头，读取与完整性校验在线程池中执行）
+
+        返回格式、尺寸、sha256与大小，开启相似图片检测时同时返回感知哈希
+        """
+        return await validate_image_upload(image_file, with_dhash=settings.near_duplicate_enabled)
     
     def get_task_progress(self, task_id: int, user_id: int) -> Dict[str, Any]:
         """获取任务进度"""
@@ -160,3 +555,7 @@ class ImageService:
             "result_data": task.result_data,
             "error_message": task.error_message
         }
+
+
+# 进行中的图片分析（每次请求独立，用于断开与取消时中止上游调用）
+analysis_flights = SingleFlight("image_analysis")
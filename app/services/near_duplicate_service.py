@@ -0,0 +1,153 @@
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+from sqlalchemy.orm import Session
+from ..config import settings
+from ..models.conversation import Conversation
+from ..models.image_fingerprint import ImageFingerprint
+from ..models.task import Task
+from ..utils.perceptual_hash import BKTree, hash_to_hex, hex_to_hash
+
+# 进程内按用户缓存的BK树与已载入的最大指纹ID（查询时按自增ID增量补齐其他worker写入的指纹）
+# 按最近查询顺序排列，指纹总数超过上限时淘汰最久未查询的用户
+_trees: "OrderedDict[int, Tuple[BKTree, int]]" = OrderedDict()
+
+# 进程内查找统计
+_stats = {"lookups": 0, "matches": 0, "reused": 0, "offered": 0, "evicted": 0}
+
+
+class NearDuplicateService:
+    """按感知哈希查找用户其他会话中的相似图片（同一电路板换角度、换构图重新拍摄）"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _load(self, user_id: int, tree: BKTree, last_id: int, limit: Optional[int] = None) -> int:
+        """载入ID大于last_id的指纹，指定limit时只载入最新的limit条，返回已载入的最大ID"""
+        query = self.db.query(
+            ImageFingerprint.id,
+            ImageFingerprint.dhash,
+            ImageFingerprint.conversation_id,
+            ImageFingerprint.task_id,
+            ImageFingerprint.prompt_hash
+        ).filter(
+            ImageFingerprint.user_id == user_id,
+            ImageFingerprint.id > last_id
+        )
+        if limit is None:
+            rows = query.order_by(ImageFingerprint.id.asc()).all()
+        else:
+            rows = list(reversed(query.order_by(ImageFingerprint.id.desc()).limit(limit).all()))
+
+        for fingerprint_id, dhash, conversation_id, task_id, prompt_hash in rows:
+            tree.add(hex_to_hash(dhash), (conversation_id, task_id, prompt_hash))
+            last_id = fingerprint_id
+        return last_id
+
+    def _tree(self, user_id: int) -> BKTree:
+        max_images = settings.near_duplicate_index_max_images
+        entry = _trees.pop(user_id, None)
+        if entry is None:
+            tree = BKTree()
+            last_id = self._load(user_id, tree, 0, max_images)
+        else:
+            tree, last_id = entry
+            last_id = self._load(user_id, tree, last_id)
+            if len(tree) > max_images:
+                # BK树不支持删除：单个用户超出上限时只重新载入最新的指纹
+                tree = BKTree()
+                last_id = self._load(user_id, tree, 0, max_images)
+        _trees[user_id] = (tree, last_id)
+
+        total = sum(len(cached) for cached, _ in _trees.values())
+        while total > max_images and len(_trees) > 1:
+            _, (evicted, _) = _trees.popitem(last=False)
+            total -= len(evicted)
+            _stats["evicted"] += 1
+        return tree
+
+    def find(self, user_id: int, value_hash: int, exclude_conversation_id: int) -> Optional[Dict[str, Any]]:
+        """查找距离最近的其他会话中已完成分析的图片，返回当时对该图片与文本需求产生的结果"""
+        if not settings.near_duplicate_enabled:
+            return None
+        _stats["lookups"] += 1
+
+        matches = self._tree(user_id).search(value_hash, settings.near_duplicate_max_distance)
+        for distance, (conversation_id, task_id, prompt_hash) in matches:
+            if conversation_id == exclude_conversation_id:
+                continue
+            # 结果取自产生该指纹的任务，不受会话之后编辑或重新生成的影响
+            task = self.db.query(Task).filter(
+                Task.id == task_id,
+                Task.user_id == user_id,
+                Task.status == "completed"
+            ).first()
+            results = (task.result_data or {}) if task else {}
+            if not results.get("BOM文件") and not results.get("需求文档"):
+                continue
+            conversation = self.db.query(Conversation).filter(
+                Conversation.id == conversation_id,
+                Conversation.user_id == user_id
+            ).first()
+            if conversation is None:
+                continue
+
+            _stats["matches"] += 1
+            return {
+                "conversation_id": conversation_id,
+                "title": conversation.title,
+                "distance": distance,
+                "prompt_hash": prompt_hash,
+                "results": {
+                    "BOM文件": results.get("BOM文件", ""),
+                    "需求文档": results.get("需求文档", "")
+                }
+            }
+        return None
+
+    def record(
+        self,
+        user_id: int,
+        conversation_id: int,
+        task_id: int,
+        sha256: str,
+        value_hash: int,
+        prompt_hash: str
+    ):
+        """分析完成后记录图片的感知哈希与产生结果的任务（同一会话中相同图片与文本需求只记录一次）"""
+        if not settings.near_duplicate_enabled:
+            return
+        exists = self.db.query(ImageFingerprint.id).filter(
+            ImageFingerprint.user_id == user_id,
+            ImageFingerprint.conversation_id == conversation_id,
+            ImageFingerprint.sha256 == sha256,
+            ImageFingerprint.prompt_hash == prompt_hash
+        ).first()
+        if exists:
+            return
+        self.db.add(ImageFingerprint(
+            user_id=user_id,
+            conversation_id=conversation_id,
+            task_id=task_id,
+            sha256=sha256,
+            dhash=hash_to_hex(value_hash),
+            prompt_hash=prompt_hash
+        ))
+        self.db.commit()
+
+    @staticmethod
+    def mark(outcome: str):
+        """记录相似结果的使用方式（reused / offered）"""
+        _stats[outcome] += 1
+
+
+def near_duplicate_stats() -> Dict[str, Any]:
+    """相似图片查找统计"""
+    return {
+        "enabled": settings.near_duplicate_enabled,
+        "mode": settings.near_duplicate_mode,
+        "max_distance": settings.near_duplicate_max_distance,
+        "index_max_images": settings.near_duplicate_index_max_images,
+        "indexed_users": len(_trees),
+        "indexed_images": sum(len(tree) for tree, _ in _trees.values()),
+        **_stats
+    }
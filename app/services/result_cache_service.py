@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Dict, Any, List, Optional, AsyncGenerator
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from ..config import settings
+from ..models.result_cache import ResultCacheEntry
+
+logger = logging.getLogger(__name__)
+
+# 进程内命中统计（按命名空间）
+_cache_stats: Dict[str, Dict[str, int]] = {}
+
+
+def _count(namespace: str, field: str):
+    stats = _cache_stats.setdefault(namespace, {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "stale_served": 0})
+    stats[field] += 1
+
+
+class ResultCacheService:
+    """内容寻址的生成结果缓存服务"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    @staticmethod
+    def make_key(namespace: str, inputs: Dict[str, Any], params: Dict[str, Any]) -> str:
+        """根据输入内容与模型参数计算缓存键"""
+        payload = json.dumps(
+            {"namespace": namespace, "inputs": inputs, "params": params},
+            ensure_ascii=False,
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, namespace: str, cache_key: str) -> Optional[List[str]]:
+        """查询未过期的缓存结果，命中时刷新LRU时间"""
+        if not settings.result_cache_enabled:
+            return None
+
+        entry = self.db.query(ResultCacheEntry).filter(
+            ResultCacheEntry.cache_key == cache_key
+        ).first()
+
+        now = time.time()
+        if not entry or entry.expires_at < now:
+            _count(namespace, "misses")
+            return None
+
+        entry.last_accessed = now
+        entry.hit_count = (entry.hit_count or 0) + 1
+        self.db.commit()
+        _count(namespace, "hits")
+        return list(entry.chunks)
+
+    def exists(self, cache_key: str) -> bool:
+        """是否有未过期的缓存结果（不计入命中统计，不刷新LRU时间）"""
+        if not settings.result_cache_enabled:
+            return False
+        return self.db.query(ResultCacheEntry.id).filter(
+            ResultCacheEntry.cache_key == cache_key,
+            ResultCacheEntry.expires_at >= time.time()
+        ).first() is not None
+
+    def get_stale(self, namespace: str, cache_key: str) -> Optional[List[str]]:
+        """降级模式下查询上次成功的结果（忽略缓存有效期，超过过期保留时长的除外）"""
+        if not settings.result_cache_enabled or not settings.stale_while_revalidate_enabled:
+            return None
+
+        entry = self.db.query(ResultCacheEntry).filter(
+            ResultCacheEntry.cache_key == cache_key,
+            ResultCacheEntry.expires_at + settings.stale_max_age_seconds >= time.time()
+        ).first()
+        return list(entry.chunks) if entry else None
+
+    def mark_stale_served(self, namespace: str):
+        """记录一次返回过期结果"""
+        _count(namespace, "stale_served")
+
+    def put(self, namespace: str, cache_key: str, chunks: List[str]):
+        """写入缓存并按总大小执行LRU淘汰"""
+        if not settings.result_cache_enabled or not chunks:
+            return
+
+        now = time.time()
+        size_bytes = sum(len(chunk.encode("utf-8")) for chunk in chunks)
+        if size_bytes > settings.result_cache_max_bytes:
+            return
+
+        entry = self.db.query(ResultCacheEntry).filter(
+            ResultCacheEntry.cache_key == cache_key
+        ).first()
+        if not entry:
+            entry = ResultCacheEntry(cache_key=cache_key, namespace=namespace)
+            self.db.add(entry)
+
+        entry.chunks = chunks
+        entry.size_bytes = size_bytes
+        entry.last_accessed = now
+        entry.expires_at = now + settings.result_cache_ttl_seconds
+
+        try:
+            self.db.commit()
+        except IntegrityError:
+            # 并发写入同一键，保留先写入的结果
+            self.db.rollback()
+            return
+
+        _count(namespace, "stores")
+        self._evict()
+
+    def _evict(self):
+        """总大小超过上限时淘汰最久未访问的条目"""
+        total = self.db.query(func.coalesce(func.sum(ResultCacheEntry.size_bytes), 0)).scalar()
+        if total <= settings.result_cache_max_bytes:
+            return
+
+        oldest = self.db.query(
+            ResultCacheEntry.id, ResultCacheEntry.namespace, ResultCacheEntry.size_bytes
+        ).order_by(ResultCacheEntry.last_accessed.asc())
+
+        evict_ids = []
+        for entry_id, namespace, size_bytes in oldest:
+            if total <= settings.result_cache_max_bytes:
+                break
+            evict_ids.append(entry_id)
+            total -= size_bytes
+            _count(namespace, "evictions")
+
+        if evict_ids:
+            self.db.query(ResultCacheEntry).filter(
+                ResultCacheEntry.id.in_(evict_ids)
+            ).delete(synchronize_session=False)
+            self.db.commit()
+
+    @staticmethod
+    async def replay(chunks: List[str], mode: Optional[str] = None) -> AsyncGenerator[str, None]:
+        """回放缓存的输出分块（burst一次性输出，paced按固定间隔输出）"""
+        mode = mode or settings.result_cache_replay_mode
+        for chunk in chunks:
+            yield chunk
+            if mode == "paced":
+                await asyncio.sleep(settings.result_cache_replay_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计"""
+        rows = self.db.query(
+            ResultCacheEntry.namespace,
+            func.count(ResultCacheEntry.id),
+            func.coalesce(func.sum(ResultCacheEntry.size_bytes), 0)
+        ).group_by(ResultCacheEntry.namespace).all()
+
+        return {
+            "enabled": settings.result_cache_enabled,
+            "max_bytes": settings.result_cache_max_bytes,
+            "namespaces": {
+                namespace: {"entries": count, "bytes": size}
+                for namespace, count, size in rows
+            },
+            "counters": _cache_stats
+        }
@@ -0,0 +1,128 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from ..models.task import Task
+from ..models.usage import TaskUsage, UsageRollup
+from ..utils.usage_meter import UsageMeter
+
+logger = logging.getLogger(__name__)
+
+# 汇总维度
+SCOPE_USER = "user"
+SCOPE_TASK_TYPE = "task_type"
+
+# 汇总行中累加的字段
+_ROLLUP_FIELDS = ("prompt_tokens", "completion_tokens", "total_tokens", "cost", "duration_ms")
+
+
+class UsageService:
+    """上游用量记录与按用户、任务类型的汇总服务"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def record(self, task: Task, meter: UsageMeter):
+        """保存任务的上游用量并累加到当天的汇总行（没有上游调用时不记录）"""
+        if not meter.calls:
+            return
+        summary = meter.summary()
+        try:
+            self.db.add(TaskUsage(
+                task_id=task.id,
+                user_id=task.user_id,
+                task_type=task.task_type,
+                prompt_tokens=summary["prompt_tokens"],
+                completion_tokens=summary["completion_tokens"],
+                total_tokens=summary["total_tokens"],
+                ttft_ms=summary["ttft_ms"],
+                duration_ms=summary["duration_ms"],
+                cost=summary["cost"],
+                estimated=summary["estimated"],
+                calls=[
+                    [c["endpoint"], c["model"], c["prompt_tokens"], c["completion_tokens"], c["ttft_ms"], c["duration_ms"]]
+                    for c in (call.to_dict() for call in meter.calls)
+                ]
+            ))
+            self.db.commit()
+        except IntegrityError:
+            # 同一任务已记录过
+            self.db.rollback()
+            return
+
+        day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        for scope, scope_key in ((SCOPE_USER, str(task.user_id)), (SCOPE_TASK_TYPE, task.task_type)):
+            self._accumulate(scope, scope_key, day, summary)
+
+    def _accumulate(self, scope: str, scope_key: str, day: str, summary: Dict[str, Any]):
+        """原子累加汇总行，不存在时插入（并发插入冲突时改为累加）"""
+        increments = {
+            UsageRollup.tasks: UsageRollup.tasks + 1,
+            **{getattr(UsageRollup, field): getattr(UsageRollup, field) + summary[field] for field in _ROLLUP_FIELDS}
+        }
+        if summary["ttft_ms"] is not None:
+            increments[UsageRollup.ttft_ms] = UsageRollup.ttft_ms + summary["ttft_ms"]
+            increments[UsageRollup.ttft_count] = UsageRollup.ttft_count + 1
+
+        rollup = self.db.query(UsageRollup).filter(
+            UsageRollup.scope == scope,
+            UsageRollup.scope_key == scope_key,
+            UsageRollup.day == day
+        )
+        for _ in range(2):
+            if rollup.update(increments, synchronize_session=False):
+                self.db.commit()
+                return
+            try:
+                self.db.add(UsageRollup(
+                    scope=scope,
+                    scope_key=scope_key,
+                    day=day,
+                    tasks=1,
+                    ttft_ms=summary["ttft_ms"] or 0,
+                    ttft_count=1 if summary["ttft_ms"] is not None else 0,
+                    **{field: summary[field] for field in _ROLLUP_FIELDS}
+                ))
+                self.db.commit()
+                return
+            except IntegrityError:
+                self.db.rollback()
+        logger.warning(f"用量汇总写入失败: {scope}={scope_key} {day}")
+
+    def aggregate(self, scope: str, days: int = 30, scope_key: Optional[str] = None) -> List[Dict[str, Any]]:
+        """最近N天按维度汇总（按费用降序）"""
+        since = (datetime.now(timezone.utc) - timedelta(days=max(days, 1) - 1)).strftime("%Y-%m-%d")
+        query = self.db.query(
+            UsageRollup.scope_key,
+            func.sum(UsageRollup.tasks),
+            func.sum(UsageRollup.prompt_tokens),
+            func.sum(UsageRollup.completion_tokens),
+            func.sum(UsageRollup.total_tokens),
+            func.sum(UsageRollup.cost),
+            func.sum(UsageRollup.duration_ms),
+            func.sum(UsageRollup.ttft_ms),
+            func.sum(UsageRollup.ttft_count)
+        ).filter(UsageRollup.scope == scope, UsageRollup.day >= since)
+        if scope_key is not None:
+            query = query.filter(UsageRollup.scope_key == scope_key)
+
+        rows = query.group_by(UsageRollup.scope_key).order_by(func.sum(UsageRollup.cost).desc()).all()
+        return [
+            {
+                scope: key,
+                "tasks": tasks,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": total_tokens,
+                "cost": round(cost or 0.0, 6),
+                "avg_duration_ms": round(duration_ms / tasks) if tasks else None,
+                "avg_ttft_ms": round(ttft_ms / ttft_count) if ttft_count else None
+            }
+            for key, tasks, prompt_tokens, completion_tokens, total_tokens, cost, duration_ms, ttft_ms, ttft_count in rows
+        ]
+
+    def get_task_usage(self, task_id: int) -> Optional[TaskUsage]:
+        """单个任务的用量记录"""
+        return self.db.query(TaskUsage).filter(TaskUsage.task_id == task_id).first()
@@ -1,49 +1,265 @@
 import httpx
 import json
-from typing import Dict, Any, Optional, AsyncGenerator
+import logging
+import uuid
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional, AsyncGenerator, AsyncIterator
 from ..config import settings
-from ..core.exceptions import ExternalAPIError
+from ..core.exceptions import ExternalAPIError, UpstreamUnavailableError, UpstreamTimeoutError
+from .http_pool import upstream_pool, UPSTREAM_DIFY, UPSTREAM_DASHSCOPE, UPSTREAM_LOCAL
+from .circuit_breaker import CircuitBreaker, BreakerCall, create_breaker
+from .bulkhead import Bulkhead
+from .rate_limiter import rate_limiter
+from .token_utils import estimate_tokens
+from .prompt_compaction import compaction_params
+from .upstream_timeout import TimeoutBudget
+from .hedging import HedgedRouter
+from .latency_tracker import latency_tracker, METRIC_NODE
+from .key_pool import ApiKeyPool, create_key_pool
+from .llm_provider import LLMProvider, WorkflowProvider
+from .usage_meter import UsageMeter
 
+logger = logging.getLogger(__name__)
 
-class DifyAPIClient:
-    """Dify API客户端"""
+# 熔断器名称：Dify工作流（含文件上传）、Dify对话、阿里云DashScope、OpenAI兼容的本地服务
+BREAKER_DIFY_WORKFLOW = "dify_workflow"
+BREAKER_DIFY_CHAT = "dify_chat"
+BREAKER_DASHSCOPE = "dashscope"
+BREAKER_LOCAL_LLM = "local_llm"
+
+# 各上游端点独立的熔断器
+circuit_breakers: Dict[str, CircuitBreaker] = {
+    name: create_breaker(name)
+    for name in (BREAKER_DIFY_WORKFLOW, BREAKER_DIFY_CHAT, BREAKER_DASHSCOPE, BREAKER_LOCAL_LLM)
+}
+
+# 端点所属上游（并发隔离按上游划分）
+ENDPOINT_UPSTREAMS = {
+    BREAKER_DIFY_WORKFLOW: UPSTREAM_DIFY,
+    BREAKER_DIFY_CHAT: UPSTREAM_DIFY,
+    BREAKER_DASHSCOPE: UPSTREAM_DASHSCOPE,
+    BREAKER_LOCAL_LLM: UPSTREAM_LOCAL
+}
+
+# 各上游的并发隔离舱
+bulkheads: Dict[str, Bulkhead] = {
+    UPSTREAM_DIFY: Bulkhead(
+        UPSTREAM_DIFY,
+        settings.bulkhead_dify_max_concurrent,
+        settings.bulkhead_max_queue,
+        settings.bulkhead_max_queue_seconds
+    ),
+    UPSTREAM_DASHSCOPE: Bulkhead(
+        UPSTREAM_DASHSCOPE,
+        settings.bulkhead_dashscope_max_concurrent,
+        settings.bulkhead_max_queue,
+        settings.bulkhead_max_queue_seconds
+    ),
+    UPSTREAM_LOCAL: Bulkhead(
+        UPSTREAM_LOCAL,
+        settings.bulkhead_local_max_concurrent,
+        settings.bulkhead_max_queue,
+        settings.bulkhead_max_queue_seconds
+    )
+}
+
+
+# 代码生成的默认指令
+DEFAULT_CODE_QUERY = "请根据需求文档和BOM列表生成相应的代码"
+
+# 各上游应用的API密钥池
+key_pools: Dict[str, ApiKeyPool] = {
+    "dify": create_key_pool("dify", settings.api_key_dify),
+    "dify_code": create_key_pool("dify_code", settings.code_api_key_dify),
+    "dashscope": create_key_pool("dashscope", settings.alibaba_api_key),
+    "local": create_key_pool("local", settings.local_llm_api_key)
+}
+
+# 文本生成的对冲路由（代码生成与部署指南均对冲到备用提供方的备用模型）
+hedge_routers: Dict[str, HedgedRouter] = {
+    name: HedgedRouter(
+        name,
+        settings.hedge_delay_seconds,
+        settings.hedge_max_ratio,
+        settings.hedge_window_seconds
+    )
+    for name in ("code_generation", "deployment_guide")
+}
+
+
+def ensure_upstream_available(endpoint: str):
+    """打开SSE响应前快速检查熔断状态与排队容量"""
+    circuit_breakers[endpoint].ensure_available()
+    bulkheads[ENDPOINT_UPSTREAMS[endpoint]].ensure_capacity()
+
+
+async def raise_for_status(response: httpx.Response):
+    """上游返回错误状态时先读取响应体再抛出（流式响应默认不读取）"""
+    if response.is_error:
+        await response.aread()
+        response.raise_for_status()
+
+
+def describe_http_error(e: httpx.HTTPError) -> str:
+    """拼接HTTP错误说明，状态错误时附带上游返回的错误信息"""
+    if isinstance(e, httpx.HTTPStatusError):
+        return f"{str(e)} {e.response.text[:200]}"
+    return str(e)
+
+
+def upstream_status(e: httpx.HTTPError) -> Optional[int]:
+    """提取上游HTTP状态码"""
+    return e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+
+
+@asynccontextmanager
+async def upstream_call(
+    endpoint: str,
+    key_pool: ApiKeyPool,
+    request_class: Optional[str] = None,
+    tokens: int = 0
+) -> AsyncIterator[BreakerCall]:
+    """受熔断器、限流与并发隔离保护的一次上游调用，密钥从密钥池中选择（call.api_key）"""
+    breaker = circuit_breakers[endpoint]
+    breaker.ensure_available()
+    with key_pool.lease() as api_key:
+        await rate_limiter.acquire(api_key, request_class or endpoint, tokens)
+        async with bulkheads[ENDPOINT_UPSTREAMS[endpoint]].slot():
+            with breaker.guard() as call:
+                call.api_key = api_key
+                yield call
+
+
+class DifyAPIClient(WorkflowProvider):
+    """Dify API客户端（工作流、文件上传与对话应用）"""
+    
+    name = "dify"
+    endpoint = BREAKER_DIFY_CHAT
     
     def __init__(self):
         self.api_url = settings.api_url_dify
         self.upload_url = settings.upload_url_dify
-        self.api_key = settings.api_key_dify
-        self.code_api_key = settings.code_api_key_dify
+        self.api_keys = key_pools["dify"]
+        self.code_api_keys = key_pools["dify_code"]
         self.code_api_url = settings.code_api_url_dify
     
+    @staticmethod
+    def _upload_budget() -> TimeoutBudget:
+        return TimeoutBudget("dify_upload", total=settings.upstream_upload_timeout)
+    
+    def params(self) -> Dict[str, Any]:
+        """影响对话应用输出的参数（模型由Dify应用自身配置）"""
+        return {"endpoint": self.code_api_url, "app": self.code_api_keys.fingerprint}
+    
+    def code_generation_params(self) -> Dict[str, Any]:
+        """影响代码生成结果的参数（用于结果缓存键）"""
+        return {**self.params(), **compaction_params()}
+    
+    def stream_chat(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        usage: Optional[UsageMeter] = None,
+        *,
+        user_id: str,
+        inputs: Optional[Dict[str, str]] = None
+    ) -> AsyncIterator[str]:
+        """通过对话应用进行单轮对话（model由Dify应用决定，忽略传入值），inputs 中的需求文档与BOM作为应用变量发送"""
+        inputs = inputs or {}
+        return self._request_code(
+            inputs.get("requirement_document", ""),
+            inputs.get("bom_list", ""),
+            user_id,
+            None,
+            prompt,
+            {},
+            usage
+        )
+    
     async def upload_file(self, file_path: str, user_id: str) -> Optional[str]:
         """上传文件到Dify"""
         try:
-            async with httpx.AsyncClient() as client:
+            async with upstream_call(BREAKER_DIFY_WORKFLOW, self.api_keys, "dify_upload") as call:
+                client = upstream_pool.get(UPSTREAM_DIFY)
                 with open(file_path, "rb") as f:
                     files = {"file": f}
                     data = {"user": user_id}
-                    headers = {"Authorization": f"Bearer {self.api_key}"}
+                    headers = {"Authorization": f"Bearer {call.api_key}"}
                     
-                    response = await client.post(
+                    response = await self._upload_budget().request(
+                        client,
+                        "POST",
                         self.upload_url,
                         headers=headers,
                         files=files,
-                        data=data,
-                        timeout=60.0
+                        data=data
                     )
                     response.raise_for_status()
                     return response.json().get("id")
+        except (UpstreamUnavailableError, UpstreamTimeoutError):
+            raise
         except Exception as e:
             raise ExternalAPIError(f"文件上传失败: {str(e)}")
     
+    async def upload_file_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        filename: str,
+        content_type: Optional[str],
+        user_id: str,
+        size: Optional[int] = None
+    ) -> Optional[str]:
+        """流式上传文件到Dify（边读边发，不在内存中保留完整文件）"""
+        boundary = uuid.uuid4().hex
+        safe_name = filename.replace('"', "%22").replace("\r", "").replace("\n", "")
+        head = (
+            f"--{boundary}\r\n"
+            'Content-Disposition: form-data; name="user"\r\n\r\n'
+            f"{user_id}\r\n"
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{safe_name}"\r\n'
+            f"Content-Type: {content_type or 'application/octet-stream'}\r\n\r\n"
+        ).encode("utf-8")
+        tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+        
+        async def body() -> AsyncIterator[bytes]:
+            yield head
+            async for chunk in chunks:
+                yield chunk
+            yield tail
+        
+        headers = {
+            "Content-Type": f"multipart/form-data; boundary={boundary}"
+        }
+        if size is not None:
+            # 已知文件大小时给出Content-Length，避免分块传输编码
+            headers["Content-Length"] = str(len(head) + size + len(tail))
+        
+        try:
+            async with upstream_call(BREAKER_DIFY_WORKFLOW, self.api_keys, "dify_upload") as call:
+                client = upstream_pool.get(UPSTREAM_DIFY)
+                response = await self._upload_budget().request(
+                    client,
+                    "POST",
+                    self.upload_url,
+                    headers={**headers, "Authorization": f"Bearer {call.api_key}"},
+                    content=body()
+                )
+                response.raise_for_status()
+                return response.json().get("id")
+        except (UpstreamUnavailableError, UpstreamTimeoutError):
+            raise
+        except Exception as e:
+            raise ExternalAPIError(f"文件上传失败: {describe_http_error(e)}", upstream_status(e))
+    
     async def process_workflow(
         self,
         inputs: Dict[str, Any],
-        user_id: str
+        user_id: str,
+        usage: Optional[UsageMeter] = None
     ) -> AsyncGenerator[Dict[str, Any], None]:
-        """处理工作流（流式响应）"""
+        """处理工作流（流式响应），usage 中记录本次调用的token用量与耗时"""
         headers = {
-            "Authorization": f"Bearer {self.api_key}",
             "Accept": "text/event-stream",
             "Content-Type": "application/json"
         }
@@ -53,155 +269,394 @@ class DifyAPIClient:
             "response_mode": "streaming",
             "user": user_id
         }
+        record = (usage or UsageMeter()).start(
+            BREAKER_DIFY_WORKFLOW,
+            prompt_estimate=sum(estimate_tokens(v) for v in inputs.values() if isinstance(v, str))
+        )
         
         try:
-            async with httpx.AsyncClient() as client:
-                async with client.stream(
+            async with upstream_call(BREAKER_DIFY_WORKFLOW, self.api_keys) as call:
+                client = upstream_pool.get(UPSTREAM_DIFY)
+                budget = TimeoutBudget(BREAKER_DIFY_WORKFLOW)
+                async with budget.stream(
+                    client,
                     "POST",
                     self.api_url,
-                    headers=headers,
-                    json=payload,
-                    timeout=120.0
+                    headers={**headers, "Authorization": f"Bearer {call.api_key}"},
+                    json=payload
                 ) as response:
-                    response.raise_for_status()
+                    await raise_for_status(response)
                     
-                    async for line in response.aiter_lines():
-                        if not line or line == ": ping":
+                    async for event in budget.iter_sse(response):
+                        try:
+                            event_data = event.json()
+                        except json.JSONDecodeError:
                             continue
+                        call.mark_responsive()
                         
-                        if line.startswith("data:"):
-                            json_str = line[5:].strip()
-                            if json_str:
-                                try:
-                                    event_data = json.loads(json_str)
-                                    yield event_data
-                                except json.JSONDecodeError:
-                                    continue
+                        # 按节点历史耗时设置完成截止时间，并记录本次耗时
+                        event_type = event_data.get("event")
+                        node = event_data.get("data") or {}
+                        if event_type == "node_started":
+                            budget.expect(
+                                latency_tracker.timeout(BREAKER_DIFY_WORKFLOW, METRIC_NODE, node.get("title", "")),
+                                node.get("title", "")
+                            )
+                        elif event_type == "node_finished":
+                            budget.expect(None)
+                            if isinstance(node.get("elapsed_time"), (int, float)):
+                                latency_tracker.record(
+                                    BREAKER_DIFY_WORKFLOW, METRIC_NODE, node["elapsed_time"], node.get("title", "")
+                                )
+                        elif event_type == "text_chunk":
+                            record.add_output(node.get("text") or "")
+                        elif event_type == "workflow_finished":
+                            # 工作流只返回合计token数
+                            outputs = node.get("outputs") or {}
+                            if record.first_token_at is None:
+                                record.add_output("".join(v for v in outputs.values() if isinstance(v, str)))
+                            if isinstance(node.get("total_tokens"), int):
+                                record.report(total_tokens=node["total_tokens"])
+                        yield event_data
         except httpx.HTTPError as e:
-            raise ExternalAPIError(f"工作流处理失败: {str(e)}")
+            raise ExternalAPIError(f"工作流处理失败: {describe_http_error(e)}", upstream_status(e))
+        finally:
+            record.finish()
     
-    async def generate_code(
+    def generate_code(
         self,
         requirement_document: str,
         bom_csv: str,
         user_id: str,
-        conversation_id: Optional[str] = None
+        conversation_id: Optional[str] = None,
+        route_info: Optional[Dict[str, Any]] = None,
+        query: Optional[str] = None,
+        session: Optional[Dict[str, Any]] = None,
+        usage: Optional[UsageMeter] = None
+    ) -> AsyncIterator[str]:
+        """生成代码（流式响应），Dify首个分块过慢时对冲到备用提供方
+
+        conversation_id 为此前Dify返回的会话ID时只发送本次query，复用上游已有的上下文；
+        session 中记录本次Dify返回的会话ID，usage 中记录各路调用的用量。
+        """
+        query = query or DEFAULT_CODE_QUERY
+        fallback = None
+        if settings.hedge_enabled and settings.code_fallback_model:
+            # 备用模型没有Dify会话上下文，始终携带完整的需求文档与BOM
+            prompt = f"""【代码生成提示】
+基于以下需求文档：
+{requirement_document}
+
+以及BOM列表：
+{bom_csv}
+
+{query}。"""
+            fallback = lambda: get_provider(settings.fallback_provider).stream_chat(
+                prompt,
+                settings.code_fallback_model,
+                usage,
+                user_id=user_id,
+                inputs={"requirement_document": requirement_document, "bom_list": bom_csv}
+            )
+        
+        return hedge_routers["code_generation"].stream(
+            lambda: self._stream_code(requirement_document, bom_csv, user_id, conversation_id, query, session, usage),
+            fallback,
+            route_info,
+            latency_tracker.hedge_delay(BREAKER_DIFY_CHAT, settings.hedge_delay_seconds)
+        )
+    
+    async def _stream_code(
+        self,
+        requirement_document: str,
+        bom_csv: str,
+        user_id: str,
+        conversation_id: Optional[str],
+        query: str,
+        session: Optional[Dict[str, Any]],
+        usage: Optional[UsageMeter] = None
     ) -> AsyncGenerator[str, None]:
-        """生成代码（流式响应）"""
+        """调用Dify对话应用生成代码，复用的会话已失效时改为携带完整上下文新建会话"""
+        session = session if session is not None else {}
+        yielded = False
+        try:
+            async for answer in self._request_code(
+                requirement_document, bom_csv, user_id, conversation_id, query, session, usage
+            ):
+                yielded = True
+                yield answer
+        except ExternalAPIError as e:
+            if not conversation_id or yielded or e.upstream_status not in (400, 404):
+                raise
+            logger.info(f"Dify会话 {conversation_id} 已失效，携带完整上下文重新生成")
+            async for answer in self._request_code(
+                requirement_document, bom_csv, user_id, None, query, session, usage
+            ):
+                yield answer
+    
+    async def _request_code(
+        self,
+        requirement_document: str,
+        bom_csv: str,
+        user_id: str,
+        conversation_id: Optional[str],
+        query: str,
+        session: Dict[str, Any],
+        usage: Optional[UsageMeter] = None
+    ) -> AsyncGenerator[str, None]:
+        """调用Dify对话应用（已有会话时不再发送需求文档与BOM）"""
         headers = {
-            "Authorization": f"Bearer {self.code_api_key}",
             "Content-Type": "application/json"
         }
         
-        payload = {
-            "inputs": {
+        if conversation_id:
+            inputs = {}
+            tokens = estimate_tokens(query)
+        else:
+            inputs = {
                 "requirement_document": requirement_document,
                 "bom_list": bom_csv
-            },
-            "query": "请根据需求文档和BOM列表生成相应的代码",
+            }
+            tokens = estimate_tokens(requirement_document) + estimate_tokens(bom_csv) + estimate_tokens(query)
+        session["context_reused"] = bool(conversation_id)
+        
+        payload = {
+            "inputs": inputs,
+            "query": query,
             "response_mode": "streaming",
             "user": user_id,
             "conversation_id": conversation_id or ""
         }
+        record = (usage or UsageMeter()).start(BREAKER_DIFY_CHAT, prompt_estimate=tokens)
         
         try:
-            async with httpx.AsyncClient() as client:
-                async with client.stream(
+            async with upstream_call(
+                BREAKER_DIFY_CHAT,
+                self.code_api_keys,
+                tokens=tokens
+            ) as call:
+                client = upstream_pool.get(UPSTREAM_DIFY)
+                budget = TimeoutBudget(BREAKER_DIFY_CHAT)
+                async with budget.stream(
+                    client,
                     "POST",
                     self.code_api_url,
-                    headers=headers,
-                    json=payload,
-                    timeout=120.0
+                    headers={**headers, "Authorization": f"Bearer {call.api_key}"},
+                    json=payload
                 ) as response:
-                    response.raise_for_status()
+                    await raise_for_status(response)
                     
-                    async for line in response.aiter_lines():
-                        if line and line.startswith('data:'):
-                            json_str = line.split('data: ')[1]
-                            try:
-                                event_data = json.loads(json_str)
-                                event_type = event_data.get('event')
-                                
-                                if event_type in ['message', 'agent_message']:
-                                    answer = event_data.get('answer', '')
-                                    if answer:
-                                        yield answer
-                                elif event_type == 'message_end':
-                                    break
-                                elif event_type == 'error':
-                                    raise ExternalAPIError(f"API错误: {event_data.get('message')}")
-                            except json.JSONDecodeError:
-                                continue
+                    async for event in budget.iter_sse(response):
+                        try:
+                            event_data = event.json()
+                        except json.JSONDecodeError:
+                            continue
+                        event_type = event_data.get('event')
+                        
+                        if event_type in ['message', 'agent_message']:
+                            answer = event_data.get('answer', '')
+                            if answer:
+                                call.mark_responsive()
+                                record.add_output(answer)
+                                yield answer
+                        elif event_type == 'message_end':
+                            # 记录Dify会话ID，后续生成可复用上游上下文
+                            if event_data.get('conversation_id'):
+                                session["conversation_id"] = event_data['conversation_id']
+                            reported = (event_data.get('metadata') or {}).get('usage') or {}
+                            record.report(
+                                reported.get('prompt_tokens'),
+                                reported.get('completion_tokens'),
+                                reported.get('total_tokens')
+                            )
+                            break
+                        elif event_type == 'error':
+                            raise ExternalAPIError(
+                                f"API错误: {event_data.get('message')}",
+                                event_data.get('status')
+                            )
         except httpx.HTTPError as e:
-            raise ExternalAPIError(f"代码生成失败: {str(e)}")
+            raise ExternalAPIError(f"代码生成失败: {describe_http_error(e)}", upstream_status(e))
+        finally:
+            record.finish()
 
 
-class AlibabaAPIClient:
-    """阿里云API客户端"""
+class OpenAICompatibleProvider(LLMProvider):
+    """OpenAI兼容的对话补全接口（/chat/completions），适用于DashScope兼容模式及vLLM、Ollama等本地服务"""
     
-    def __init__(self):
-        self.base_url = settings.alibaba_base_url
-        self.api_key = settings.alibaba_api_key
+    def __init__(
+        self,
+        name: str,
+        label: str,
+        base_url: str,
+        api_keys: ApiKeyPool,
+        endpoint: str,
+        model: str
+    ):
+        self.name = name
+        self.label = label
+        self.base_url = base_url.rstrip("/")
+        self.api_keys = api_keys
+        self.endpoint = endpoint
+        self.generation_params = {
+            "model": model,
+            "temperature": 0.3,
+            "top_p": 0.7,
+            "max_tokens": 4096
+        }
+    
+    def params(self) -> Dict[str, Any]:
+        """影响生成结果的参数（用于结果缓存键）"""
+        return {"endpoint": self.base_url, **self.generation_params}
     
-    async def generate_deployment_guide(
+    @staticmethod
+    def _auth_headers(api_key: Optional[str]) -> Dict[str, str]:
+        """本地服务通常不需要密钥，未配置时不发送Authorization"""
+        return {"Authorization": f"Bearer {api_key}"} if api_key else {}
+    
+    async def stream_chat(
         self,
-        requirement_doc: str,
-        bom_data: str
+        prompt: str,
+        model: Optional[str] = None,
+        usage: Optional[UsageMeter] = None,
+        *,
+        user_id: str,
+        inputs: Optional[Dict[str, str]] = None
     ) -> AsyncGenerator[str, None]:
-        """生成部署指南"""
+        """单轮对话补全（流式响应），model为空时使用默认模型，usage 中记录本次调用的用量
+
+        inputs 已包含在提示词中，不单独发送；user_id 作为OpenAI的user字段发送
+        """
         headers = {
-            "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
         
-        prompt = f"""【部署指南生成提示】
-基于以下需求文档：
-{requirement_doc}
-
-以及BOM数据：
-{bom_data}
-
-请生成500字左右的详细部署指南，说明部署步骤、环境要求及注意事项，并尽量优化部署方案和提示细节。"""
-        
         payload = {
-            "model": "qwen-max",
+            **self.generation_params,
+            "model": model or self.generation_params["model"],
             "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.3,
-            "top_p": 0.7,
-            "max_tokens": 4096,
-            "stream": True
+            "user": user_id,
+            "stream": True,
+            # 最后一个分块返回usage
+            "stream_options": {"include_usage": True}
         }
+        record = (usage or UsageMeter()).start(self.endpoint, payload["model"], estimate_tokens(prompt))
         
         try:
-            async with httpx.AsyncClient() as client:
-                async with client.stream(
+            async with upstream_call(self.endpoint, self.api_keys, tokens=estimate_tokens(prompt)) as call:
+                client = upstream_pool.get(ENDPOINT_UPSTREAMS[self.endpoint])
+                budget = TimeoutBudget(self.endpoint)
+                async with budget.stream(
+                    client,
                     "POST",
                     f"{self.base_url}/chat/completions",
-                    headers=headers,
-                    json=payload,
-                    timeout=120.0
+                    headers={**headers, **self._auth_headers(call.api_key)},
+                    json=payload
                 ) as response:
-                    response.raise_for_status()
+                    await raise_for_status(response)
                     
-                    async for line in response.aiter_lines():
-                        if line.startswith("data:"):
-                            json_str = line[5:].strip()
-                            if json_str == "[DONE]":
-                                break
-                            try:
-                                chunk_data = json.loads(json_str)
-                                choices = chunk_data.get("choices", [])
-                                if choices:
-                                    delta = choices[0].get("delta", {})
-                                    content = delta.get("content")
-                                    if content:
-                                        yield content
-                            except json.JSONDecodeError:
-                                continue
+                    async for event in budget.iter_sse(response):
+                        if event.raw == b"[DONE]":
+                            break
+                        try:
+                            chunk_data = event.json()
+                        except json.JSONDecodeError:
+                            continue
+                        if chunk_data.get("usage"):
+                            reported = chunk_data["usage"]
+                            record.report(
+                                reported.get("prompt_tokens"),
+                                reported.get("completion_tokens"),
+                                reported.get("total_tokens")
+                            )
+                        choices = chunk_data.get("choices", [])
+                        if choices:
+                            delta = choices[0].get("delta", {})
+                            content = delta.get("content")
+                            if content:
+                                call.mark_responsive()
+                                record.add_output(content)
+                                yield content
         except httpx.HTTPError as e:
-            raise ExternalAPIError(f"部署指南生成失败: {str(e)}")
+            raise ExternalAPIError(f"{self.label}调用失败: {describe_http_error(e)}", upstream_status(e))
+        finally:
+            record.finish()
+
+
+class AlibabaAPIClient(OpenAICompatibleProvider):
+    """阿里云API客户端（DashScope兼容模式），负责部署指南生成"""
+    
+    def __init__(self):
+        super().__init__(
+            "dashscope",
+            "DashScope",
+            settings.alibaba_base_url,
+            key_pools["dashscope"],
+            BREAKER_DASHSCOPE,
+            settings.alibaba_model
+        )
+    
+    def deployment_guide_params(self) -> Dict[str, Any]:
+        """影响部署指南结果的参数（用于结果缓存键）"""
+        return {**get_provider(settings.chat_provider).params(), **compaction_params()}
+    
+    def generate_deployment_guide(
+        self,
+        requirement_doc: str,
+        bom_data: str,
+        user_id: str,
+        route_info: Optional[Dict[str, Any]] = None,
+        usage: Optional[UsageMeter] = None
+    ) -> AsyncIterator[str]:
+        """生成部署指南（使用配置的对话提供方），首个分块过慢时对冲到备用提供方的备用模型"""
+        prompt = f"""【部署指南生成提示】
+基于以下需求文档：
+{requirement_doc}
+
+以及BOM数据：
+{bom_data}
+
+请生成500字左右的详细部署指南，说明部署步骤、环境要求及注意事项，并尽量优化部署方案和提示细节。"""
+        
+        provider = get_provider(settings.chat_provider)
+        inputs = {"requirement_document": requirement_doc, "bom_list": bom_data}
+        fallback = None
+        if settings.hedge_enabled and settings.alibaba_fallback_model:
+            fallback = lambda: get_provider(settings.fallback_provider).stream_chat(
+                prompt, settings.alibaba_fallback_model, usage, user_id=user_id, inputs=inputs
+            )
+        
+        return hedge_routers["deployment_guide"].stream(
+            lambda: provider.stream_chat(prompt, usage=usage, user_id=user_id, inputs=inputs),
+            fallback,
+            route_info,
+            latency_tracker.hedge_delay(provider.endpoint, settings.hedge_delay_seconds)
+        )
 
 
 # 全局API客户端实例
 dify_client = DifyAPIClient()
 alibaba_client = AlibabaAPIClient()
+
+# 大模型提供方注册表（按配置的名称选择，本地服务配置地址后启用）
+providers: Dict[str, LLMProvider] = {
+    dify_client.name: dify_client,
+    alibaba_client.name: alibaba_client
+}
+if settings.local_llm_base_url:
+    providers["local"] = OpenAICompatibleProvider(
+        "local",
+        "本地模型",
+        settings.local_llm_base_url,
+        key_pools["local"],
+        BREAKER_LOCAL_LLM,
+        settings.local_llm_model
+    )
+
+
+def get_provider(name: str) -> LLMProvider:
+    """按名称获取大模型提供方"""
+    provider = providers.get(name)
+    if provider is None:
+        raise ExternalAPIError(f"未配置的大模型提供方: {name}（可用: {', '.join(providers)}）")
+    return provider
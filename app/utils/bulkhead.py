@@ -0,0 +1,85 @@
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any
+from ..core.exceptions import UpstreamUnavailableError
+
+
+class Bulkhead:
+    """上游并发隔离舱：信号量限制并发，有界等待队列限制排队"""
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, max_queue_seconds: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queue_seconds = max_queue_seconds
+
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._active = 0
+        self._waiting = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._wait_times = deque(maxlen=500)
+        self._avg_hold_seconds = 0.0
+
+    def _retry_after(self) -> int:
+        """根据平均占用时长估算建议重试间隔"""
+        estimate = self._avg_hold_seconds * (self._waiting + 1) / self.max_concurrent
+        return min(60, max(1, math.ceil(estimate)))
+
+    def _reject(self, message: str):
+        self._rejected += 1
+        raise UpstreamUnavailableError(message, retry_after=self._retry_after())
+
+    def ensure_capacity(self):
+        """快速检查是否还能排队（打开SSE响应前调用）"""
+        if self._active + self._waiting >= self.max_concurrent + self.max_queue:
+            self._reject(f"上游服务 {self.name} 繁忙，请稍后重试")
+
+    @asynccontextmanager
+    async def slot(self):
+        """占用一个并发名额，排队超限或超时时快速失败"""
+        self.ensure_capacity()
+
+        self._waiting += 1
+        started_at = time.monotonic()
+        try:
+            # 在当前任务中等待：超时取消时Semaphore.acquire会归还已分配的名额（wait_for在超时与获取同时发生时可能泄漏名额）
+            async with asyncio.timeout(self.max_queue_seconds):
+                await self._semaphore.acquire()
+        except TimeoutError:
+            self._timed_out += 1
+            self._reject(f"上游服务 {self.name} 排队超时，请稍后重试")
+        finally:
+            self._waiting -= 1
+
+        acquired_at = time.monotonic()
+        self._wait_times.append(acquired_at - started_at)
+        self._admitted += 1
+        self._active += 1
+        try:
+            yield
+        finally:
+            self._active -= 1
+            self._semaphore.release()
+            hold = time.monotonic() - acquired_at
+            self._avg_hold_seconds = 0.8 * self._avg_hold_seconds + 0.2 * hold if self._avg_hold_seconds else hold
+
+    def stats(self) -> Dict[str, Any]:
+        """并发与排队统计"""
+        waits = sorted(self._wait_times)
+        return {
+            "active": self._active,
+            "queue_depth": self._waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "admitted": self._admitted,
+            "rejected": self._rejected,
+            "queue_timeouts": self._timed_out,
+            "avg_wait_seconds": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            "p95_wait_seconds": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0.0,
+            "max_wait_seconds": round(waits[-1], 3) if waits else 0.0
+        }
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import math
+import time
+import httpx
+from collections import deque
+from typing import Dict, Any, Optional
+from ..config import settings
+from ..core.exceptions import ExternalAPIError, UpstreamUnavailableError
+
+logger = logging.getLogger(__name__)
+
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    """判断异常是否应计入上游失败（客户端错误不计入）"""
+    if isinstance(exc, UpstreamUnavailableError):
+        return False
+    if isinstance(exc, httpx.HTTPStatusError):
+        status_code = exc.response.status_code
+        return status_code >= 500 or status_code == 429
+    return isinstance(exc, (httpx.HTTPError, ExternalAPIError, asyncio.TimeoutError))
+
+
+class BreakerCall:
+    """一次受熔断器保护的调用"""
+
+    def __init__(self, breaker: "CircuitBreaker", probe: bool):
+        self.breaker = breaker
+        self.probe = probe
+        self.started_at = time.monotonic()
+        self.latency: Optional[float] = None
+        # 本次调用使用的API密钥（由upstream_call从密钥池中选择后填写）
+        self.api_key: Optional[str] = None
+
+    def mark_responsive(self):
+        """记录上游首次响应耗时（流式调用收到首个事件时调用）"""
+        if self.latency is None:
+            self.latency = time.monotonic() - self.started_at
+
+    def __enter__(self) -> "BreakerCall":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        latency = self.latency if self.latency is not None else time.monotonic() - self.started_at
+        if exc is None:
+            self.breaker.record(False, latency, self.probe)
+        elif is_upstream_failure(exc):
+            self.breaker.record(True, latency, self.probe)
+        else:
+            # 客户端断开、业务错误等不代表上游健康状况
+            self.breaker.release(self.probe)
+        return False
+
+
+class CircuitBreaker:
+    """基于滑动时间窗口失败率/慢调用率的熔断器"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate_threshold: float = 0.5,
+        slow_call_seconds: float = 30.0,
+        slow_call_rate_threshold: float = 0.8,
+        window_seconds: int = 60,
+        minimum_calls: int = 5,
+        open_seconds: int = 30,
+        half_open_probes: int = 2
+    ):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.window_seconds = window_seconds
+        self.minimum_calls = minimum_calls
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        self._state = self.CLOSED
+        self._calls = deque()  # (时间戳, 是否失败, 是否慢调用)
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._rejected = 0
+        self._open_count = 0
+
+    @property
+    def state(self) -> str:
+        """当前状态（打开超时后自动进入半开）"""
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._transition(self.HALF_OPEN)
+        return self._state
+
+    def _retry_after(self) -> int:
+        remaining = self.open_seconds - (time.monotonic() - self._opened_at)
+        return max(1, math.ceil(remaining))
+
+    def _transition(self, state: str):
+        if state == self._state:
+            return
+        logger.warning(f"熔断器 {self.name}: {self._state} -> {state}")
+        self._state = state
+        if state == self.OPEN:
+            self._opened_at = time.monotonic()
+            self._open_count += 1
+        elif state == self.HALF_OPEN:
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+        elif state == self.CLOSED:
+            self._calls.clear()
+
+    def ensure_available(self):
+        """快速检查熔断器是否放行（不占用半开探测名额）"""
+        if self.state == self.OPEN:
+            self._rejected += 1
+            raise UpstreamUnavailableError(
+                f"上游服务 {self.name} 暂不可用（熔断中），请稍后重试",
+                retry_after=self._retry_after()
+            )
+
+    def guard(self) -> BreakerCall:
+        """开始一次受保护的调用，熔断打开时快速失败"""
+        self.ensure_available()
+        probe = False
+        if self._state == self.HALF_OPEN:
+            if self._probes_in_flight >= self.half_open_probes:
+                self._rejected += 1
+                raise UpstreamUnavailableError(
+                    f"上游服务 {self.name} 正在恢复探测中，请稍后重试",
+                    retry_after=1
+                )
+            self._probes_in_flight += 1
+            probe = True
+        return BreakerCall(self, probe)
+
+    def release(self, probe: bool):
+        """释放调用但不计入统计"""
+        if probe and self._state == self.HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def record(self, failed: bool, latency: float, probe: bool = False):
+        """记录调用结果并评估状态"""
+        slow = latency >= self.slow_call_seconds
+
+        if probe:
+            self.release(probe)
+            if self._state != self.HALF_OPEN:
+                return
+            if failed or slow:
+                self._transition(self.OPEN)
+            else:
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    self._transition(self.CLOSED)
+            return
+
+        now = time.monotonic()
+        self._calls.append((now, failed, slow))
+        while self._calls and now - self._calls[0][0] > self.window_seconds:
+            self._calls.popleft()
+
+        if self._state != self.CLOSED or len(self._calls) < self.minimum_calls:
+            return
+
+        total = len(self._calls)
+        failure_rate = sum(1 for _, f, _ in self._calls if f) / total
+        slow_rate = sum(1 for _, _, s in self._calls if s) / total
+        if failure_rate >= self.failure_rate_threshold or slow_rate >= self.slow_call_rate_threshold:
+            self._transition(self.OPEN)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """熔断器状态快照"""
+        state = self.state
+        total = len(self._calls)
+        return {
+            "state": state,
+            "calls_in_window": total,
+            "failure_rate": round(sum(1 for _, f, _ in self._calls if f) / total, 3) if total else 0.0,
+            "slow_call_rate": round(sum(1 for _, _, s in self._calls if s) / total, 3) if total else 0.0,
+            "rejected": self._rejected,
+            "open_count": self._open_count,
+            "retry_after": self._retry_after() if state == self.OPEN else 0
+        }
+
+
+def create_breaker(name: str) -> CircuitBreaker:
+    """按全局配置创建熔断器"""
+    return CircuitBreaker(
+        name,
+        failure_rate_threshold=settings.breaker_failure_rate_threshold,
+        slow_call_seconds=settings.breaker_slow_call_seconds,
+        slow_call_rate_threshold=settings.breaker_slow_call_rate_threshold,
+        window_seconds=settings.breaker_window_seconds,
+        minimum_calls=settings.breaker_minimum_calls,
+        open_seconds=settings.breaker_open_seconds,
+        half_open_probes=settings.breaker_half_open_probes
+    )
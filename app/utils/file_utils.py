@@ -1,7 +1,9 @@
 import os
 import uuid
+import asyncio
+import hashlib
 import aiofiles
-from typing import Optional
+from typing import Optional, AsyncIterator, Awaitable, Callable, Any, NamedTuple, Tuple
 from fastapi import UploadFile
 from pathlib import Path
 from datetime import datetime
@@ -9,6 +11,10 @@ from ..config import settings
 from ..core.exceptions import FileUploadError
 
 
+# 上传文件流式读取的分块大小
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+
 def generate_unique_filename(original_filename: str) -> str:
     """生成唯一的文件名"""
     file_extension = Path(original_filename).suffix
@@ -30,42 +36,159 @@ def get_conversation_upload_dir(user_id: int, conversation_id: int) -> Path:
     return conv_dir
 
 
+class SavedUpload(NamedTuple):
+    """已保存的上传文件元数据（由调用方持久化）"""
+    file_path: str
+    filename: str
+    sha256: str
+    size: int
+
+
+def size_limit_error() -> FileUploadError:
+    return FileUploadError(f"文件大小超过限制 ({settings.max_file_size} bytes)")
+
+
+def _upload_target(upload_file: UploadFile, user_id: int, conversation_id: Optional[int]) -> Tuple[Path, str]:
+    """确定保存路径与生成的文件名"""
+    if conversation_id:
+        save_dir = get_conversation_upload_dir(user_id, conversation_id)
+    else:
+        save_dir = get_user_upload_dir(user_id)
+    unique_filename = generate_unique_filename(upload_file.filename)
+    return save_dir / unique_filename, unique_filename
+
+
+def _partial_path(file_path: Path) -> Path:
+    """写入中的临时文件（同目录，完成后原子重命名）"""
+    return file_path.with_name(f".{file_path.name}.part")
+
+
+async def _write_upload(
+    upload_file: UploadFile,
+    file_path: Path,
+    filename: str,
+    sha256: Optional[str] = None,
+    on_chunk: Optional[Callable[[bytes], Awaitable[Any]]] = None
+) -> SavedUpload:
+    """
+    分块流式写入上传文件：边读边写临时文件并计算sha256与大小，
+    超过大小限制时立即中止，完成后原子重命名为最终文件（内存占用固定为一个分块）
+    sha256 已知（如校验时已计算）时不再重复计算；on_chunk 在写盘的同时接收每个分块（如放入上传队列）
+    """
+    partial_path = _partial_path(file_path)
+    digest = hashlib.sha256() if sha256 is None else None
+    size = 0
+    
+    try:
+        await upload_file.seek(0)
+        async with aiofiles.open(partial_path, 'wb') as f:
+            while True:
+                chunk = await upload_file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > settings.max_file_size:
+                    raise size_limit_error()
+                if digest is not None:
+                    digest.update(chunk)
+                if on_chunk is None:
+                    await f.write(chunk)
+                else:
+                    await asyncio.gather(f.write(chunk), on_chunk(chunk))
+        os.replace(partial_path, file_path)
+    except (FileUploadError, asyncio.CancelledError):
+        # 清理未完成的临时文件（包括请求被取消的情况）
+        if partial_path.exists():
+            partial_path.unlink()
+        raise
+    except Exception as e:
+        if partial_path.exists():
+            partial_path.unlink()
+        raise FileUploadError(f"文件保存失败: {str(e)}")
+    
+    return SavedUpload(str(file_path), filename, sha256 or digest.hexdigest(), size)
+
+
+def _check_declared_size(upload_file: UploadFile):
+    """客户端给出大小时提前拒绝，未给出时在写入过程中检查"""
+    if upload_file.size and upload_file.size > settings.max_file_size:
+        raise size_limit_error()
+
+
 async def save_upload_file(
     upload_file: UploadFile,
     user_id: int,
-    conversation_id: Optional[int] = None
-) -> tuple[str, str]:
+    conversation_id: Optional[int] = None,
+    sha256: Optional[str] = None
+) -> SavedUpload:
+    """分块流式保存上传的文件，返回路径、文件名、sha256与大小"""
+    _check_declared_size(upload_file)
+    file_path, unique_filename = _upload_target(upload_file, user_id, conversation_id)
+    return await _write_upload(upload_file, file_path, unique_filename, sha256)
+
+
+# 上传分块消费者：接收 (分块迭代器, 文件名)，返回上传结果
+UploadSink = Callable[[AsyncIterator[bytes], str], Awaitable[Any]]
+
+
+async def tee_upload_file(
+    upload_file: UploadFile,
+    user_id: int,
+    conversation_id: Optional[int] = None,
+    sink: Optional[UploadSink] = None,
+    sha256: Optional[str] = None
+) -> Tuple[SavedUpload, Any]:
     """
-    保存上传的文件
-    返回 (文件路径, 生成的文件名)
+    单次读取上传文件，分块同时写入磁盘、计算sha256（已知时不再计算）并交给sink（如流式上传到Dify）
+    返回 (已保存文件的元数据, sink返回值)；未提供sink时只写磁盘
     """
-    # 检查文件大小
-    if upload_file.size and upload_file.size > settings.max_file_size:
-        raise FileUploadError(f"文件大小超过限制 ({settings.max_file_size} bytes)")
+    if sink is None:
+        return await save_upload_file(upload_file, user_id, conversation_id, sha256), None
     
-    # 确定保存目录
-    if conversation_id:
-        save_dir = get_conversation_upload_dir(user_id, conversation_id)
-    else:
-        save_dir = get_user_upload_dir(user_id)
+    _check_declared_size(upload_file)
+    file_path, unique_filename = _upload_target(upload_file, user_id, conversation_id)
+    # 有界队列提供背压：上游较慢时暂停读取，内存占用保持在几个分块以内
+    queue: asyncio.Queue = asyncio.Queue(maxsize=4)
     
-    # 生成唯一文件名
-    unique_filename = generate_unique_filename(upload_file.filename)
-    file_path = save_dir / unique_filename
+    async def produce() -> SavedUpload:
+        saved = await _write_upload(upload_file, file_path, unique_filename, sha256, queue.put)
+        await queue.put(None)
+        return saved
+    
+    async def chunks() -> AsyncIterator[bytes]:
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                return
+            yield chunk
+    
+    tasks = [
+        asyncio.create_task(produce()),
+        asyncio.create_task(sink(chunks(), unique_filename))
+    ]
     
     try:
-        # 异步保存文件
-        async with aiofiles.open(file_path, 'wb') as f:
-            content = await upload_file.read()
-            await f.write(content)
-        
-        return str(file_path), unique_filename
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    except asyncio.CancelledError:
+        delete_file(str(file_path))
+        raise
+    finally:
+        # 任一方失败（或请求被取消）时停止另一方：写盘失败或超过大小限制则中止上传，上传失败则停止读取
+        # 写入方被取消时由 _write_upload 清理临时文件
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
     
-    except Exception as e:
-        # 清理可能已创建的文件
-        if file_path.exists():
-            file_path.unlink()
-        raise FileUploadError(f"文件保存失败: {str(e)}")
+    producer, uploader = tasks
+    if not uploader.cancelled() and uploader.exception():
+        delete_file(str(file_path))
+        # 上传方的异常（如ExternalAPIError）原样抛出，由调用方处理
+        raise uploader.exception()
+    if not producer.cancelled() and producer.exception():
+        raise producer.exception()
+    
+    return producer.result(), uploader.result()
 
 
 def delete_file(file_path: str) -> bool:
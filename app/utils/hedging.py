@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Dict, Any, AsyncIterator, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# 路由名称
+ROUTE_PRIMARY = "primary"
+ROUTE_FALLBACK = "fallback"
+
+
+async def _discard(stream: AsyncIterator[Any], pending: Optional[asyncio.Task]):
+    """取消未完成的读取并关闭流（关闭上游HTTP连接）"""
+    if pending is not None and not pending.done():
+        pending.cancel()
+        try:
+            await pending
+        except BaseException:
+            pass
+    elif pending is not None and not pending.cancelled():
+        pending.exception()
+    try:
+        await stream.aclose()
+    except Exception:
+        pass
+
+
+class HedgedRouter:
+    """对冲请求路由：主路由在截止时间内未产生首个分块时，向备用路由发出第二个请求
+
+    先产生首个分块的流胜出，另一个立即取消；对冲次数按滑动窗口内请求数的比例封顶。
+    """
+
+    def __init__(self, name: str, delay_seconds: float, max_ratio: float, window_seconds: float):
+        self.name = name
+        self.delay_seconds = delay_seconds
+        self.max_ratio = max_ratio
+        self.window_seconds = window_seconds
+
+        self._last_delay = delay_seconds
+        self._requests = deque()
+        self._hedges = deque()
+        self._stats = {
+            "requests": 0,
+            "hedged": 0,
+            "hedge_capped": 0,
+            # 仅统计发出对冲的请求中哪一路先产生首个分块
+            "primary_wins": 0,
+            "fallback_wins": 0
+        }
+
+    def _trim(self, now: float):
+        for window in (self._requests, self._hedges):
+            while window and now - window[0] > self.window_seconds:
+                window.popleft()
+
+    def _allow_hedge(self) -> bool:
+        """窗口内对冲数不超过请求数×比例（比例大于0时至少允许一次，为0时不发出对冲）"""
+        now = time.monotonic()
+        self._trim(now)
+        limit = len(self._requests) * self.max_ratio
+        if self.max_ratio > 0:
+            limit = max(1.0, limit)
+        if len(self._hedges) >= limit:
+            self._stats["hedge_capped"] += 1
+            return False
+        self._hedges.append(now)
+        self._stats["hedged"] += 1
+        return True
+
+    async def stream(
+        self,
+        primary: Callable[[], AsyncIterator[Any]],
+        fallback: Optional[Callable[[], AsyncIterator[Any]]] = None,
+        route_info: Optional[Dict[str, Any]] = None,
+        delay_seconds: Optional[float] = None
+    ) -> AsyncIterator[Any]:
+        """按对冲策略读取流，route_info 中记录胜出路由与是否发出对冲
+
+        delay_seconds 为本次的对冲截止时间（如由主路由延迟分布推导），默认使用构造时的配置
+        """
+        delay = self.delay_seconds if delay_seconds is None else delay_seconds
+        self._last_delay = delay
+        route_info = route_info if route_info is not None else {}
+        route_info.update({"route": ROUTE_PRIMARY, "hedged": False})
+        self._requests.append(time.monotonic())
+        self._stats["requests"] += 1
+
+        streams = {ROUTE_PRIMARY: primary()}
+        reads = {ROUTE_PRIMARY: asyncio.ensure_future(streams[ROUTE_PRIMARY].__anext__())}
+        winner = None
+        first_chunk = None
+        empty = False
+        try:
+            # 等待首个分块，超过截止时间后（在比例允许时）发出对冲请求
+            while winner is None:
+                timeout = None
+                if fallback is not None and ROUTE_FALLBACK not in streams and delay > 0:
+                    timeout = delay
+                done, _ = await asyncio.wait(reads.values(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    if self._allow_hedge():
+                        logger.info(f"{self.name} 首个分块超过{delay:g}秒，发出对冲请求")
+                        route_info["hedged"] = True
+                        streams[ROUTE_FALLBACK] = fallback()
+                        reads[ROUTE_FALLBACK] = asyncio.ensure_future(streams[ROUTE_FALLBACK].__anext__())
+                    else:
+                        fallback = None
+                    continue
+
+                for route in (ROUTE_PRIMARY, ROUTE_FALLBACK):
+                    read = reads.get(route)
+                    if read is None or read not in done:
+                        continue
+                    error = read.exception()
+                    if error is None or isinstance(error, StopAsyncIteration):
+                        winner = route
+                        first_chunk = read.result() if error is None else None
+                        empty = error is not None
+                        break
+                    # 一路失败时继续等待另一路（不再对冲），全部失败则抛出最后的错误
+                    reads.pop(route)
+                    stream = streams.pop(route)
+                    fallback = None
+                    if not reads:
+                        raise error
+                    await _discard(stream, None)
+        finally:
+            # 取消落败的一路（含异常退出时的全部在途请求）
+            for route in list(reads):
+                if route != winner:
+                    await _discard(streams[route], reads.pop(route))
+
+        route_info["route"] = winner
+        if route_info["hedged"]:
+            self._stats[f"{winner}_wins"] += 1
+        stream = streams[winner]
+        if empty:
+            return
+        try:
+            yield first_chunk
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        """对冲统计"""
+        requests = self._stats["requests"]
+        hedged = self._stats["hedged"]
+        return {
+            **self._stats,
+            "delay_seconds": self.delay_seconds,
+            "last_delay_seconds": round(self._last_delay, 3),
+            "max_ratio": self.max_ratio,
+            "hedge_rate": round(hedged / requests, 3) if requests else 0.0,
+            "fallback_win_ratio": round(self._stats["fallback_wins"] / hedged, 3) if hedged else 0.0
+        }
@@ -0,0 +1,111 @@
+import logging
+import httpx
+from typing import Dict, Any, Iterable
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+# 上游名称：Dify（工作流/文件上传/对话）、阿里云DashScope与OpenAI兼容的本地服务
+UPSTREAM_DIFY = "dify"
+UPSTREAM_DASHSCOPE = "dashscope"
+UPSTREAM_LOCAL = "local"
+
+
+class UpstreamClientPool:
+    """上游HTTP连接池，每个上游共享一个长连接的AsyncClient"""
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self._http2 = None
+
+    def _use_http2(self) -> bool:
+        """判断是否启用HTTP/2（需要安装h2）"""
+        if self._http2 is None:
+            self._http2 = False
+            if settings.http2_enabled:
+                try:
+                    import h2  # noqa: F401
+                    self._http2 = True
+                except ImportError:
+                    logger.warning("未安装h2，上游连接回退到HTTP/1.1")
+        return self._http2
+
+    def _create_client(self, name: str) -> httpx.AsyncClient:
+        """创建上游客户端"""
+        counters = self._counters.setdefault(name, {
+            "requests": 0,
+            "responses": 0,
+            "http2_responses": 0,
+            "server_errors": 0
+        })
+
+        async def on_request(request: httpx.Request):
+            counters["requests"] += 1
+
+        async def on_response(response: httpx.Response):
+            counters["responses"] += 1
+            if response.http_version == "HTTP/2":
+                counters["http2_responses"] += 1
+            if response.status_code >= 500:
+                counters["server_errors"] += 1
+
+        limits = httpx.Limits(
+            max_connections=settings.http_max_connections,
+            max_keepalive_connections=settings.http_max_keepalive_connections,
+            keepalive_expiry=settings.http_keepalive_expiry
+        )
+
+        return httpx.AsyncClient(
+            http2=self._use_http2(),
+            limits=limits,
+            event_hooks={"request": [on_request], "response": [on_response]}
+        )
+
+    async def startup(self, names: Iterable[str] = (UPSTREAM_DIFY, UPSTREAM_DASHSCOPE)):
+        """应用启动时创建所有上游客户端"""
+        for name in names:
+            self.get(name)
+        logger.info(f"上游连接池已创建: {', '.join(self._clients)} (HTTP/2: {self._use_http2()})")
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """获取上游共享客户端（未初始化时懒创建）"""
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._create_client(name)
+            self._clients[name] = client
+        return client
+
+    async def aclose(self):
+        """应用关闭时释放所有连接"""
+        for name, client in list(self._clients.items()):
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"关闭上游连接池 {name} 失败: {str(e)}")
+        self._clients.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """连接池统计信息"""
+        result = {}
+        for name, client in self._clients.items():
+            connections = []
+            # httpcore连接池未提供公开统计接口，尽力读取
+            pool = getattr(getattr(client, "_transport", None), "_pool", None)
+            if pool is not None:
+                connections = list(getattr(pool, "connections", []))
+
+            result[name] = {
+                "http2": self._use_http2(),
+                "closed": client.is_closed,
+                "connections": len(connections),
+                "idle_connections": sum(1 for c in connections if c.is_idle()),
+                "max_connections": settings.http_max_connections,
+                "max_keepalive_connections": settings.http_max_keepalive_connections,
+                **self._counters.get(name, {})
+            }
+        return result
+
+
+# 全局上游连接池实例
+upstream_pool = UpstreamClientPool()
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import time
+from pathlib import Path
+from typing import Dict, Any, Tuple
+from PIL import Image, ImageOps
+from ..config import settings
+
+# EXIF方向标签
+_EXIF_ORIENTATION = 0x0112
+
+# 有损编码的照片格式重新压缩为JPEG，其余（PNG原理图、GIF、BMP、TIFF等线稿类）保持无损PNG
+_LOSSY_FORMATS = {"JPEG", "MPO"}
+
+# 预处理线程并发上限（解码大图占用CPU与内存，避免挤占其他请求）
+_semaphore = asyncio.Semaphore(max(1, settings.image_preprocess_max_concurrent))
+
+
+def _to_jpeg_mode(image: Image.Image) -> Image.Image:
+    """转换为JPEG可编码的模式，透明背景填充为白色"""
+    if image.mode in ("RGB", "L"):
+        return image
+    if image.mode in ("RGBA", "LA", "P", "PA") or "transparency" in image.info:
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def _to_png_mode(image: Image.Image) -> Image.Image:
+    """转换为可平滑缩放的PNG模式（调色板图缩放只能用最近邻，先展开为RGB/RGBA）"""
+    if image.mode in ("RGB", "RGBA", "L", "LA"):
+        return image
+    if image.mode in ("P", "PA") and ("transparency" in image.info or image.mode == "PA"):
+        return image.convert("RGBA")
+    if image.mode == "1":
+        return image.convert("L")
+    return image.convert("RGB")
+
+
+def _preprocess(src_path: str, max_edge: int, quality: int) -> Tuple[str, Dict[str, Any]]:
+    """在工作线程中执行：校正方向、缩小并重新压缩，结果不比原图小且无需旋转缩放时沿用原图"""
+    started = time.perf_counter()
+    original_bytes = os.path.getsize(src_path)
+
+    with Image.open(src_path) as image:
+        original_size = image.size
+        lossy = image.format in _LOSSY_FORMATS
+        if image.format == "JPEG":
+            # JPEG按DCT缩放解码，只解出不小于目标尺寸的像素，大幅降低解码耗时与内存
+            image.draft("RGB", (max_edge, max_edge))
+        orientation = image.getexif().get(_EXIF_ORIENTATION, 1)
+        transposed = orientation != 1
+
+        processed = ImageOps.exif_transpose(image)
+        processed = _to_jpeg_mode(processed) if lossy else _to_png_mode(processed)
+        resized = max(processed.size) > max_edge
+        if resized:
+            processed.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        if lossy:
+            dst_path = str(Path(src_path).with_suffix("")) + ".dify.jpg"
+            processed.save(dst_path, "JPEG", quality=quality, optimize=True)
+        else:
+            # 线稿、原理图保持无损，避免JPEG在细线与文字周围产生伪影
+            dst_path = str(Path(src_path).with_suffix("")) + ".dify.png"
+            processed.save(dst_path, "PNG", optimize=True)
+        processed_size = processed.size
+
+    processed_bytes = os.path.getsize(dst_path)
+    applied = transposed or resized or processed_bytes < original_bytes
+    if not applied:
+        os.remove(dst_path)
+
+    return (dst_path if applied else src_path), {
+        "applied": applied,
+        "format": ("JPEG" if lossy else "PNG") if applied else None,
+        "original_bytes": original_bytes,
+        "processed_bytes": processed_bytes if applied else original_bytes,
+        "original_size": list(original_size),
+        "processed_size": list(processed_size) if applied else list(original_size),
+        "transposed": transposed,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 2)
+    }
+
+
+async def preprocess_image(src_path: str) -> Tuple[str, Dict[str, Any]]:
+    """上传前预处理图片（在线程池中执行，不阻塞事件循环）
+
+    返回 (实际上传的文件路径, 预处理前后的字节数、尺寸与耗时)；未开启或处理失败时返回原图。
+    生成的文件只用于上传，调用方上传后应通过 discard_preprocessed 删除。
+    """
+    if not settings.image_preprocess_enabled:
+        return src_path, {"applied": False, "enabled": False}
+
+    async with _semaphore:
+        try:
+            return await asyncio.to_thread(
+                _preprocess, src_path, settings.image_max_edge, settings.image_jpeg_quality
+            )
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            # 预处理失败不影响分析，按原图上传
+            return src_path, {"applied": False, "error": str(e)}
+
+
+def discard_preprocessed(upload_path: str, src_path: str):
+    """删除预处理生成的上传文件（沿用原图时不做处理）"""
+    if upload_path != src_path and os.path.exists(upload_path):
+        os.remove(upload_path)
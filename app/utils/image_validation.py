@@ -0,0 +1,106 @@
+import asyncio
+import hashlib
+import warnings
+from typing import Dict, Any, BinaryIO, Optional
+from PIL import Image
+from ..config import settings
+from ..core.exceptions import FileUploadError
+from .file_utils import UPLOAD_CHUNK_SIZE, size_limit_error
+from .perceptual_hash import dhash_file
+
+# 文件头魔数 → Pillow格式名
+_MAGIC_NUMBERS = (
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+    (b"BM", "BMP"),
+    (b"II*\x00", "TIFF"),
+    (b"MM\x00*", "TIFF"),
+)
+
+# 哈希、深度校验与感知哈希线程并发上限
+_semaphore = asyncio.Semaphore(max(1, settings.image_verify_max_concurrent))
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """按文件头魔数识别图片格式"""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    for magic, image_format in _MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return image_format
+    return None
+
+
+def read_header(file_obj: BinaryIO) -> Dict[str, Any]:
+    """只读取文件头：识别格式、尺寸并检查像素上限（Pillow的open是惰性的，不解码像素数据）"""
+    file_obj.seek(0)
+    image_format = sniff_format(file_obj.read(16))
+    file_obj.seek(0)
+    if image_format is None:
+        raise FileUploadError("无效的图片文件: 不支持的图片格式")
+
+    try:
+        with warnings.catch_warnings():
+            # 像素上限由下方按配置检查，这里不需要Pillow的解压炸弹警告
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            with Image.open(file_obj, formats=[image_format]) as image:
+                width, height = image.size
+    except Image.DecompressionBombError:
+        raise FileUploadError("无效的图片文件: 图片像素过多")
+    except Exception as e:
+        raise FileUploadError(f"无效的图片文件: {str(e)}")
+    finally:
+        file_obj.seek(0)
+
+    if width <= 0 or height <= 0:
+        raise FileUploadError("无效的图片文件: 图片尺寸无效")
+    if width * height > settings.image_max_pixels:
+        raise FileUploadError(f"无效的图片文件: 图片像素过多（{width}x{height}）")
+    return {"format": image_format, "width": width, "height": height}
+
+
+def _inspect(file_obj: BinaryIO, deep_verify: bool, with_dhash: bool) -> Dict[str, Any]:
+    """在工作线程中分块计算sha256与大小，完整性校验与感知哈希直接读取文件对象（不复制整个上传）"""
+    digest = hashlib.sha256()
+    size = 0
+    file_obj.seek(0)
+    try:
+        while chunk := file_obj.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > settings.max_file_size:
+                raise size_limit_error()
+            digest.update(chunk)
+    finally:
+        file_obj.seek(0)
+
+    info = {"sha256": digest.hexdigest(), "size": size}
+    if deep_verify:
+        # Pillow完整性校验（PNG会校验全部数据块CRC，耗时与文件大小相关）
+        try:
+            with Image.open(file_obj) as image:
+                image.verify()
+        except Exception as e:
+            raise FileUploadError(f"无效的图片文件: {str(e)}")
+        finally:
+            file_obj.seek(0)
+    if with_dhash:
+        info["dhash"] = dhash_file(file_obj)
+    return info
+
+
+async def validate_image_upload(upload_file, with_dhash: bool = False) -> Dict[str, Any]:
+    """校验上传图片：先在事件循环中嗅探文件头，再在线程池中分块读取校验（有并发上限）
+
+    返回格式、尺寸、sha256与大小，with_dhash 为True时同时返回感知哈希（dhash，无法解码时为None），
+    后续保存上传文件时复用其中的sha256，不再重复读取计算
+    """
+    if not (upload_file.content_type or "").startswith("image/"):
+        raise FileUploadError("请上传图片文件")
+
+    header = read_header(upload_file.file)
+
+    async with _semaphore:
+        info = await asyncio.to_thread(_inspect, upload_file.file, settings.image_deep_verify, with_dhash)
+    return {**header, **info}
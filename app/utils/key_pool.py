@@ -0,0 +1,158 @@
+import itertools
+import logging
+import math
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional
+import httpx
+from ..config import settings
+from ..core.exceptions import ExternalAPIError, UpstreamUnavailableError
+from .rate_limiter import key_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# 密钥选择策略
+SELECT_LEAST_LOADED = "least_loaded"
+SELECT_ROUND_ROBIN = "round_robin"
+
+
+def parse_keys(value: str) -> List[str]:
+    """解析逗号分隔的密钥列表（去除空白与重复项，保持顺序）"""
+    keys = []
+    for key in (value or "").split(","):
+        key = key.strip()
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+def _status_of(exc: BaseException) -> Optional[int]:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code
+    if isinstance(exc, ExternalAPIError):
+        return exc.upstream_status
+    return None
+
+
+def _retry_after_of(exc: BaseException) -> Optional[float]:
+    if isinstance(exc, httpx.HTTPStatusError):
+        try:
+            return float(exc.response.headers.get("Retry-After", ""))
+        except ValueError:
+            return None
+    return None
+
+
+class ApiKeyState:
+    """单个密钥的负载、错误与隔离状态"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.fingerprint = key_fingerprint(key)
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.auth_errors = 0
+        self.quota_errors = 0
+        self.quarantined_until = 0.0
+        self.last_error: Optional[str] = None
+
+    def available(self, now: float) -> bool:
+        return now >= self.quarantined_until
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {
+            "key": self.fingerprint,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "auth_errors": self.auth_errors,
+            "quota_errors": self.quota_errors,
+            "quarantined_seconds": max(0, math.ceil(self.quarantined_until - now)),
+            "last_error": self.last_error
+        }
+
+
+class ApiKeyPool:
+    """同一上游应用的多个API密钥：按负载或轮询选择，401/403与429的密钥自动隔离
+
+    同一密钥池中的密钥应属于同一上游应用（如同一Dify应用），上传文件等资源可跨密钥复用。
+    """
+
+    def __init__(self, name: str, keys: List[str], strategy: str = SELECT_LEAST_LOADED):
+        self.name = name
+        self.strategy = strategy
+        self._keys = [ApiKeyState(key) for key in keys]
+        self._cursor = itertools.count()
+
+    @property
+    def fingerprint(self) -> str:
+        """应用标识（取首个密钥的指纹，用于缓存键与上传复用）"""
+        return self._keys[0].fingerprint
+
+    def _select(self) -> ApiKeyState:
+        now = time.monotonic()
+        candidates = [state for state in self._keys if state.available(now)]
+        if not candidates:
+            retry_after = min(state.quarantined_until for state in self._keys) - now
+            raise UpstreamUnavailableError(
+                f"上游服务 {self.name} 的API密钥均已被暂时隔离，请稍后重试",
+                retry_after=max(1, math.ceil(retry_after))
+            )
+
+        # 轮询起点保证负载相同时依次使用各个密钥
+        start = next(self._cursor) % len(candidates)
+        ordered = candidates[start:] + candidates[:start]
+        if self.strategy == SELECT_ROUND_ROBIN:
+            return ordered[0]
+        return min(ordered, key=lambda state: state.in_flight)
+
+    def _quarantine(self, state: ApiKeyState, seconds: float, reason: str):
+        state.quarantined_until = max(state.quarantined_until, time.monotonic() + seconds)
+        logger.warning(f"{self.name} 密钥 {state.fingerprint} {reason}，隔离{seconds:g}秒")
+
+    def _record_failure(self, state: ApiKeyState, exc: BaseException):
+        status_code = _status_of(exc)
+        if status_code is None and not isinstance(exc, (httpx.HTTPError, ExternalAPIError)):
+            # 客户端断开、业务错误等与密钥无关
+            return
+        state.errors += 1
+        state.last_error = f"{status_code or type(exc).__name__}"
+        if status_code in (401, 403):
+            state.auth_errors += 1
+            self._quarantine(state, settings.api_key_auth_quarantine_seconds, f"认证失败({status_code})")
+        elif status_code == 429:
+            state.quota_errors += 1
+            seconds = _retry_after_of(exc) or settings.api_key_quota_quarantine_seconds
+            self._quarantine(state, seconds, "触发配额限制(429)")
+
+    @contextmanager
+    def lease(self) -> Iterator[str]:
+        """选择一个可用密钥用于本次调用，调用结束时记录结果"""
+        state = self._select()
+        state.in_flight += 1
+        state.requests += 1
+        try:
+            yield state.key
+        except UpstreamUnavailableError:
+            raise
+        except BaseException as e:
+            self._record_failure(state, e)
+            raise
+        finally:
+            state.in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """各密钥负载与错误统计（以指纹标识，不暴露明文）"""
+        now = time.monotonic()
+        return {
+            "strategy": self.strategy,
+            "available": sum(1 for state in self._keys if state.available(now)),
+            "keys": [state.stats(now) for state in self._keys]
+        }
+
+
+def create_key_pool(name: str, keys: str) -> ApiKeyPool:
+    """按配置创建密钥池"""
+    # 未配置密钥时保留一个空密钥，与单密钥时的行为一致（由上游返回认证错误）
+    return ApiKeyPool(name, parse_keys(keys) or [""], settings.api_key_selection)
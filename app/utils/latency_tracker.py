@@ -0,0 +1,152 @@
+import math
+from collections import deque
+from typing import Dict, Any, Optional, Tuple
+from ..config import settings
+
+# 延迟指标
+METRIC_FIRST_EVENT = "first_event"
+METRIC_TOTAL = "total"
+METRIC_NODE = "node"
+
+# 直方图分桶上界（秒），最后一桶为无穷大
+_BUCKET_BOUNDS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250)
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 3) if value is not None else None
+
+
+class RollingLatency:
+    """最近N个延迟样本的滚动分布"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._samples = deque(maxlen=size)
+        # 累计记录的样本数与超时（删失）次数，超时的调用不计入分布
+        self.recorded = 0
+        self.censored = 0
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+        self.recorded += 1
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """最近邻法计算百分位（无样本时返回None）"""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+        return ordered[min(index, len(ordered) - 1)]
+
+    def histogram(self) -> Dict[str, int]:
+        counts = {f"le_{bound:g}": 0 for bound in _BUCKET_BOUNDS}
+        counts["le_inf"] = 0
+        for sample in self._samples:
+            bound = next((b for b in _BUCKET_BOUNDS if sample <= b), None)
+            counts[f"le_{bound:g}" if bound is not None else "le_inf"] += 1
+        return counts
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "samples": len(self._samples),
+            "censored": self.censored,
+            **{f"p{p:g}": _round(self.percentile(p)) for p in (50, 90, 95, 99)},
+            "max": _round(max(self._samples)) if self._samples else None,
+            "histogram": self.histogram()
+        }
+
+
+class LatencyTracker:
+    """按上游端点与工作流节点记录延迟分布，并据此推导超时与对冲截止时间
+
+    样本不足时返回None，由调用方使用配置的默认值。
+    """
+
+    def __init__(self):
+        self._series: Dict[Tuple[str, str, str], RollingLatency] = {}
+        # 推导超时的增长基准：(基准值, 设定基准时的累计样本数, 最近一次推导值)
+        self._growth: Dict[Tuple[str, str, str], Tuple[float, int, float]] = {}
+
+    def _get_series(self, key: Tuple[str, str, str]) -> RollingLatency:
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = RollingLatency(settings.latency_window_size)
+        return series
+
+    def record(self, endpoint: str, metric: str, seconds: float, name: str = ""):
+        self._get_series((endpoint, metric, name)).record(seconds)
+
+    def record_censored(self, endpoint: str, metric: str, name: str = ""):
+        """记录一次超时的调用：只计数，不把截止时间作为样本（否则推导超时会随超时不断抬高）"""
+        self._get_series((endpoint, metric, name)).censored += 1
+
+    def percentile(self, endpoint: str, metric: str, p: float, name: str = "") -> Optional[float]:
+        """样本数达到下限时返回百分位，否则返回None"""
+        series = self._series.get((endpoint, metric, name))
+        if series is None or len(series) < settings.adaptive_timeout_min_samples:
+            return None
+        return series.percentile(p)
+
+    def timeout(self, endpoint: str, metric: str, name: str = "", reference: Optional[float] = None) -> Optional[float]:
+        """按配置百分位×倍数推导的超时，限制在 [最小超时, 最大超时] 内
+
+        推导值可以低于配置的固定超时；每个样本窗口内最多增长到基准（首次为reference）的配置倍数，
+        上游持续变慢时超时逐窗口放宽，而不是一次跳到上限
+        """
+        if not settings.adaptive_timeouts_enabled:
+            return None
+        key = (endpoint, metric, name)
+        value = self.percentile(endpoint, metric, settings.adaptive_timeout_percentile, name)
+        if value is None:
+            return None
+        target = min(
+            max(value * settings.adaptive_timeout_multiplier, settings.adaptive_timeout_min_seconds),
+            settings.adaptive_timeout_max_seconds
+        )
+        series = self._series[key]
+        growth = self._growth.get(key)
+        if growth is None:
+            base = reference if reference is not None else target
+            growth = (base, series.recorded, base)
+        elif series.recorded - growth[1] >= series.size:
+            # 经过一个完整样本窗口后，以最近的推导值作为新的增长基准
+            growth = (growth[2], series.recorded, growth[2])
+        limit = min(target, growth[0] * settings.adaptive_timeout_max_growth)
+        self._growth[key] = (growth[0], growth[1], limit)
+        return limit
+
+    def hedge_delay(self, endpoint: str, default: float) -> float:
+        """对冲截止时间：主路由首个事件延迟的配置百分位（样本不足时使用默认值）"""
+        if not settings.adaptive_timeouts_enabled:
+            return default
+        value = self.percentile(endpoint, METRIC_FIRST_EVENT, settings.adaptive_hedge_percentile)
+        if value is None:
+            return default
+        return min(max(value, settings.adaptive_hedge_min_seconds), settings.upstream_first_event_timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        """各端点、各工作流节点的延迟分布与推导出的超时"""
+        endpoints: Dict[str, Any] = {}
+        for (endpoint, metric, name), series in sorted(self._series.items()):
+            entry = endpoints.setdefault(endpoint, {"metrics": {}, "nodes": {}})
+            # 最近一次实际使用的推导超时（查询统计不推进增长基准）
+            growth = self._growth.get((endpoint, metric, name))
+            derived = growth[2] if growth else None
+            target = entry["nodes"] if metric == METRIC_NODE else entry["metrics"]
+            target[name or metric] = {**series.stats(), "derived_timeout": _round(derived)}
+        return {
+            "enabled": settings.adaptive_timeouts_enabled,
+            "percentile": settings.adaptive_timeout_percentile,
+            "multiplier": settings.adaptive_timeout_multiplier,
+            "hedge_percentile": settings.adaptive_hedge_percentile,
+            "min_samples": settings.adaptive_timeout_min_samples,
+            "max_growth": settings.adaptive_timeout_max_growth,
+            "endpoints": endpoints
+        }
+
+
+# 全局延迟统计实例
+latency_tracker = LatencyTracker()
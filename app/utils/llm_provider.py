@@ -0,0 +1,96 @@
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Any, Optional, AsyncGenerator, AsyncIterator
+from .token_utils import estimate_tokens
+from .usage_meter import UsageMeter
+
+
+class LLMProvider(ABC):
+    """大模型上游提供方接口：所有提供方都支持流式对话，工作流与文件上传见 WorkflowProvider
+
+    endpoint 为熔断、限流、超时与延迟统计使用的端点名称。
+    """
+
+    name = ""
+    endpoint = ""
+
+    @abstractmethod
+    def params(self) -> Dict[str, Any]:
+        """影响生成结果的参数（用于结果缓存键）"""
+
+    @abstractmethod
+    def stream_chat(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        usage: Optional[UsageMeter] = None,
+        *,
+        user_id: str,
+        inputs: Optional[Dict[str, str]] = None
+    ) -> AsyncIterator[str]:
+        """单轮对话补全（流式响应），model为空时使用默认模型，usage 中记录用量
+
+        user_id 为发起调用的用户标识；inputs 为提示词引用的结构化输入（如需求文档与BOM），
+        Dify对话应用作为应用变量发送，其他提供方的提示词中已包含这些内容
+        """
+
+
+class WorkflowProvider(LLMProvider):
+    """支持工作流运行与文件上传的提供方"""
+
+    @abstractmethod
+    def process_workflow(
+        self,
+        inputs: Dict[str, Any],
+        user_id: str,
+        usage: Optional[UsageMeter] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """运行工作流（流式返回事件），usage 中记录用量"""
+
+    @abstractmethod
+    async def upload_file_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        filename: str,
+        content_type: Optional[str],
+        user_id: str,
+        size: Optional[int] = None
+    ) -> Optional[str]:
+        """流式上传文件，返回上游文件ID"""
+
+
+async def measure_stream(chunks: AsyncIterator[str]) -> Dict[str, Any]:
+    """消费一次流式输出，统计首字延迟与生成速度（token数按估算值计）"""
+    started = time.perf_counter()
+    first_token = None
+    tokens = 0
+    async for chunk in chunks:
+        if first_token is None:
+            first_token = time.perf_counter() - started
+        tokens += estimate_tokens(chunk)
+    total = time.perf_counter() - started
+
+    generation = total - first_token if first_token is not None else 0.0
+    return {
+        "ttft_seconds": first_token,
+        "total_seconds": total,
+        "tokens": tokens,
+        "tokens_per_second": tokens / generation if generation > 0 else None
+    }
+
+
+async def benchmark_provider(
+    provider: LLMProvider,
+    prompt: str,
+    rounds: int = 3,
+    model: Optional[str] = None,
+    *,
+    user_id: str
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """依次执行多轮对话补全并返回每轮的测量结果（失败的轮次记录错误）"""
+    for index in range(rounds):
+        try:
+            result = await measure_stream(provider.stream_chat(prompt, model, user_id=user_id))
+        except Exception as e:
+            result = {"error": str(e)}
+        yield {"provider": provider.name, "round": index + 1, **result}
@@ -0,0 +1,95 @@
+from typing import Any, BinaryIO, Generic, List, Optional, Tuple, TypeVar
+from PIL import Image, ImageOps
+
+T = TypeVar("T")
+
+# dHash边长：8 → 64位哈希
+HASH_SIZE = 8
+
+
+def _dhash(file_obj: BinaryIO, hash_size: int = HASH_SIZE) -> int:
+    """差值哈希：缩小为灰度 (hash_size+1)×hash_size 后比较相邻像素亮度"""
+    file_obj.seek(0)
+    try:
+        with Image.open(file_obj) as image:
+            if image.format == "JPEG":
+                # 只需极小的缩略图，按DCT缩放解码即可
+                image.draft("L", (hash_size * 8, hash_size * 8))
+            image = ImageOps.exif_transpose(image)
+            pixels = list(
+                image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS).getdata()
+            )
+    finally:
+        file_obj.seek(0)
+
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def dhash_file(file_obj: BinaryIO) -> Optional[int]:
+    """直接从文件对象计算感知哈希，不复制整个文件（无法解码时返回None，在工作线程中调用）"""
+    try:
+        return _dhash(file_obj)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+def hamming(a: int, b: int) -> int:
+    """两个哈希的汉明距离"""
+    return (a ^ b).bit_count()
+
+
+def hash_to_hex(value: int) -> str:
+    return f"{value:016x}"
+
+
+def hex_to_hash(value: str) -> int:
+    return int(value, 16)
+
+
+class BKTree(Generic[T]):
+    """汉明距离上的BK树：查询半径r内的所有哈希只需访问距离在 [d-r, d+r] 内的子树"""
+
+    def __init__(self):
+        # 节点: (哈希, 值, {到子节点的距离: 子节点})
+        self._root: Optional[Tuple[int, T, dict]] = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, value_hash: int, value: T):
+        self._size += 1
+        if self._root is None:
+            self._root = (value_hash, value, {})
+            return
+        node = self._root
+        while True:
+            distance = hamming(value_hash, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value_hash, value, {})
+                return
+            node = child
+
+    def search(self, value_hash: int, max_distance: int) -> List[Tuple[int, T]]:
+        """返回距离不超过max_distance的 (距离, 值)，按距离升序"""
+        if self._root is None:
+            return []
+        found: List[Tuple[int, Any]] = []
+        stack = [self._root]
+        while stack:
+            node_hash, node_value, children = stack.pop()
+            distance = hamming(value_hash, node_hash)
+            if distance <= max_distance:
+                found.append((distance, node_value))
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        found.sort(key=lambda item: item[0])
+        return found
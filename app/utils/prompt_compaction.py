@@ -0,0 +1,219 @@
+import csv
+import io
+import math
+import re
+import time
+from typing import Dict, Any, List, Optional
+from ..config import settings
+from .token_utils import estimate_tokens
+
+# BOM中的数量列（重复行合并时累加）
+_QUANTITY_COLUMNS = ("数量", "quantity", "qty")
+
+_FENCE_PATTERN = re.compile(r"^\s*```[\w-]*\s*$")
+_CSV_BLOCK_PATTERN = re.compile(r"```csv\s*\n(.*?)```", re.S)
+_TABLE_SEPARATOR_PATTERN = re.compile(r"^\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?$")
+
+# 截断时附加的说明（确定性，便于结果缓存命中）
+_TRUNCATED_ROWS_NOTE = "# 已省略{count}行"
+_TRUNCATED_TEXT_NOTE = "（以下内容因长度限制省略）"
+
+# 压缩后需求文档至少保留的预算比例，其余优先留给BOM
+_REQUIREMENT_MIN_SHARE = 0.5
+
+
+def compact_text(text: str) -> str:
+    """去除代码围栏、行尾空白、重复行与多余空行"""
+    lines = []
+    seen = set()
+    for line in (text or "").splitlines():
+        if _FENCE_PATTERN.match(line):
+            continue
+        line = re.sub(r"[ \t]+", " ", line).strip()
+        if line:
+            # 重复的非空行只保留第一次出现
+            if line in seen:
+                continue
+            seen.add(line)
+        elif not lines or not lines[-1]:
+            continue
+        lines.append(line)
+    while lines and not lines[-1]:
+        lines.pop()
+    return "\n".join(lines)
+
+
+def _extract_rows(content: str) -> Optional[List[List[str]]]:
+    """从```csv代码块或Markdown表格中提取行（首行为表头）"""
+    match = _CSV_BLOCK_PATTERN.search(content)
+    if match:
+        rows = [row for row in csv.reader(io.StringIO(match.group(1).strip())) if any(cell.strip() for cell in row)]
+        return rows or None
+
+    rows = []
+    for line in content.splitlines():
+        line = line.strip()
+        if not line.startswith("|"):
+            if rows:
+                break
+            continue
+        if _TABLE_SEPARATOR_PATTERN.match(line):
+            continue
+        rows.append([cell.strip() for cell in line.strip("|").split("|")])
+    return rows if len(rows) > 1 else None
+
+
+def _parse_quantity(value: str) -> Optional[float]:
+    """解析数量（空值按0计），不是有限数字时返回None"""
+    try:
+        quantity = float(value or 0)
+    except ValueError:
+        return None
+    return quantity if math.isfinite(quantity) else None
+
+
+def compact_bom(content: str) -> str:
+    """将BOM规范化为最小CSV：去除空列与说明文字，合并重复行（累加数量）
+
+    无法识别表格时退回通用文本压缩。
+    """
+    rows = _extract_rows(content or "")
+    if not rows:
+        return compact_text(content)
+
+    header = [re.sub(r"\s+", " ", cell).strip() for cell in rows[0]]
+    width = len(header)
+    body = [[re.sub(r"\s+", " ", cell).strip() for cell in (row + [""] * width)[:width]] for row in rows[1:]]
+
+    # 去除整列为空的列
+    keep = [i for i in range(width) if header[i] or any(row[i] for row in body)]
+    header = [header[i] for i in keep]
+    body = [[row[i] for i in keep] for row in body]
+
+    quantity_index = next(
+        (i for i, name in enumerate(header) if name.lower() in _QUANTITY_COLUMNS),
+        None
+    )
+
+    # 合并重复行：除数量外完全相同的行累加数量，保持首次出现的顺序
+    # 数量不是数字（如"若干"、"按需"）的行无法累加，原样保留
+    merged: List[List[str]] = []
+    seen: Dict[tuple, List[str]] = {}
+    for row in body:
+        if quantity_index is not None and _parse_quantity(row[quantity_index]) is None:
+            merged.append(row)
+            continue
+        key = tuple(cell for i, cell in enumerate(row) if i != quantity_index)
+        existing = seen.get(key)
+        if existing is None:
+            seen[key] = row
+            merged.append(row)
+        elif quantity_index is not None:
+            total = _parse_quantity(existing[quantity_index]) + _parse_quantity(row[quantity_index])
+            existing[quantity_index] = str(int(total)) if total.is_integer() else str(total)
+
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+    writer.writerow(header)
+    writer.writerows(merged)
+    return output.getvalue().rstrip("\n")
+
+
+def _cut_to_tokens(line: str, budget: int) -> str:
+    """截取行首不超过budget个token的部分"""
+    low, high = 0, len(line)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(line[:middle]) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return line[:low]
+
+
+def truncate_lines(
+    text: str,
+    budget: int,
+    note: str = _TRUNCATED_TEXT_NOTE,
+    keep_head: int = 0,
+    split_lines: bool = True
+) -> str:
+    """按行从尾部截断到token预算内
+
+    前keep_head行始终保留（如CSV表头）；split_lines为True时超出预算的那一行按字符截取，
+    否则整行省略（用于BOM，避免残缺的行）。
+    """
+    if estimate_tokens(text) <= budget:
+        return text
+    lines = text.split("\n")
+    kept = lines[:keep_head]
+    used = estimate_tokens("\n".join(kept + [note.format(count=len(lines))]))
+    for line in lines[keep_head:]:
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            partial = _cut_to_tokens(line, budget - used - 1) if split_lines else ""
+            if partial:
+                kept.append(partial)
+            break
+        kept.append(line)
+        used += cost
+    omitted = len(lines) - len(kept)
+    return "\n".join(kept + [note.format(count=omitted)])
+
+
+class CompactedPrompt:
+    """压缩后的需求文档与BOM，以及压缩统计"""
+
+    def __init__(self, requirement: str, bom: str, stats: Dict[str, Any]):
+        self.requirement = requirement
+        self.bom = bom
+        self.stats = stats
+
+
+def compact_prompt_inputs(requirement: str, bom: str, budget: Optional[int] = None) -> CompactedPrompt:
+    """压缩需求文档与BOM并执行token预算
+
+    超出预算时按确定性规则截断：需求文档至少保留一半预算，BOM使用其余部分
+    （保留表头、从尾部按行省略），BOM未用完的预算再补给需求文档。
+    """
+    budget = settings.prompt_token_budget if budget is None else budget
+    started = time.perf_counter()
+    tokens_before = estimate_tokens(requirement) + estimate_tokens(bom)
+
+    if not settings.prompt_compaction_enabled:
+        return CompactedPrompt(requirement, bom, {
+            "compacted": False,
+            "tokens_before": tokens_before,
+            "tokens_after": tokens_before,
+            "tokens_saved": 0
+        })
+
+    requirement = compact_text(requirement)
+    bom = compact_bom(bom)
+    truncated = False
+
+    if budget > 0 and estimate_tokens(requirement) + estimate_tokens(bom) > budget:
+        truncated = True
+        requirement_tokens = estimate_tokens(requirement)
+        bom_budget = budget - min(requirement_tokens, int(budget * _REQUIREMENT_MIN_SHARE))
+        bom = truncate_lines(bom, bom_budget, _TRUNCATED_ROWS_NOTE, keep_head=1, split_lines=False)
+        requirement = truncate_lines(requirement, budget - estimate_tokens(bom))
+
+    tokens_after = estimate_tokens(requirement) + estimate_tokens(bom)
+    return CompactedPrompt(requirement, bom, {
+        "compacted": True,
+        "truncated": truncated,
+        "token_budget": budget,
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": tokens_before - tokens_after,
+        "compaction_ms": round((time.perf_counter() - started) * 1000, 2)
+    })
+
+
+def compaction_params() -> Dict[str, Any]:
+    """影响压缩结果的配置（用于结果缓存键）"""
+    return {
+        "prompt_compaction": settings.prompt_compaction_enabled,
+        "prompt_token_budget": settings.prompt_token_budget
+    }
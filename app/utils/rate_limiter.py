@@ -0,0 +1,237 @@
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import time
+from typing import Dict, Any, List, Tuple
+from ..config import settings
+from ..core.exceptions import UpstreamUnavailableError
+
+logger = logging.getLogger(__name__)
+
+# 单次申请涉及的令牌桶：(桶名, 容量, 每秒补充量, 消耗量)
+BucketSpec = Tuple[str, float, float, float]
+
+# Redis原子令牌桶脚本：所有桶都足够时才一起扣减，否则返回需要等待的秒数
+_REDIS_SCRIPT = """
+local now = tonumber(ARGV[1])
+local wait = 0
+local states = {}
+for i, key in ipairs(KEYS) do
+    local base = 1 + (i - 1) * 3
+    local capacity = tonumber(ARGV[base + 1])
+    local rate = tonumber(ARGV[base + 2])
+    local cost = tonumber(ARGV[base + 3])
+    local state = redis.call('HMGET', key, 'tokens', 'updated')
+    local tokens = tonumber(state[1]) or capacity
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+    states[i] = {tokens, cost, capacity, rate}
+    if tokens < cost then
+        wait = math.max(wait, (cost - tokens) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local s = states[i]
+    redis.call('HSET', key, 'tokens', s[1] - s[2], 'updated', now)
+    redis.call('EXPIRE', key, math.ceil(s[3] / s[4]) + 60)
+end
+return '0'
+"""
+
+
+def _compute_wait(states: List[Tuple[float, float, float, float]]) -> float:
+    """根据各桶(当前令牌, 消耗, 容量, 速率)计算需要等待的秒数"""
+    wait = 0.0
+    for tokens, cost, _, rate in states:
+        if tokens < cost:
+            wait = max(wait, (cost - tokens) / rate)
+    return wait
+
+
+class SQLiteBucketStore:
+    """本地SQLite令牌桶存储（同机多worker共享，无需Redis）"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS token_buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+
+    def _take(self, buckets: List[BucketSpec], now: float) -> float:
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE 获取写锁，保证跨进程原子性
+            conn.execute("BEGIN IMMEDIATE")
+            states = []
+            for key, capacity, rate, cost in buckets:
+                row = conn.execute(
+                    "SELECT tokens, updated FROM token_buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens, updated = row if row else (capacity, now)
+                tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+                states.append((tokens, cost, capacity, rate))
+
+            wait = _compute_wait(states)
+            if wait <= 0:
+                for (key, _, _, _), (tokens, cost, _, _) in zip(buckets, states):
+                    conn.execute(
+                        "INSERT OR REPLACE INTO token_buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                        (key, tokens - cost, now)
+                    )
+            conn.execute("COMMIT")
+            return wait
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    async def take(self, buckets: List[BucketSpec]) -> float:
+        return await asyncio.to_thread(self._take, buckets, time.time())
+
+
+class RedisBucketStore:
+    """Redis令牌桶存储（跨主机多worker共享）"""
+
+    name = "redis"
+
+    def __init__(self, url: str):
+        import redis.asyncio as aioredis
+        self._redis = aioredis.from_url(url)
+        self._script = self._redis.register_script(_REDIS_SCRIPT)
+
+    async def take(self, buckets: List[BucketSpec]) -> float:
+        keys = [f"pcbtool:ratelimit:{key}" for key, _, _, _ in buckets]
+        args: List[Any] = [time.time()]
+        for _, capacity, rate, cost in buckets:
+            args.extend([capacity, rate, cost])
+        result = await self._script(keys=keys, args=args)
+        return float(result)
+
+
+def parse_rate_limit_rules(rules: str) -> Dict[str, Tuple[int, int]]:
+    """解析限流规则 "类别:每分钟请求数:每分钟token数,..."（0表示不限制）"""
+    parsed = {}
+    for rule in rules.split(","):
+        parts = [p.strip() for p in rule.split(":")]
+        if len(parts) != 3 or not parts[0]:
+            continue
+        parsed[parts[0]] = (int(parts[1]), int(parts[2]))
+    return parsed
+
+
+def key_fingerprint(api_key: str) -> str:
+    """API密钥指纹（避免明文密钥出现在存储和统计中）"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+class UpstreamRateLimiter:
+    """上游API密钥令牌桶限流器，按 密钥 x 请求类别 分桶"""
+
+    def __init__(self):
+        self.rules = parse_rate_limit_rules(settings.rate_limit_rules)
+        self._store = None
+        self._fallback = None
+        # Redis失败后在此时间点之前直接使用本地存储，避免每次调用都重新连接并打印警告
+        self._redis_retry_at = 0.0
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def _local_store(self) -> SQLiteBucketStore:
+        if self._fallback is None:
+            self._fallback = SQLiteBucketStore(settings.rate_limit_store_path)
+        return self._fallback
+
+    def _get_store(self):
+        if self._store is None:
+            if settings.redis_url:
+                try:
+                    self._store = RedisBucketStore(settings.redis_url)
+                except Exception as e:
+                    logger.warning(f"Redis限流存储不可用，回退到本地存储: {str(e)}")
+            if self._store is None:
+                self._store = self._local_store()
+        return self._store
+
+    def _buckets(self, api_key: str, request_class: str, tokens: int) -> List[BucketSpec]:
+        rpm, tpm = self.rules.get(request_class, (0, 0))
+        prefix = f"{key_fingerprint(api_key)}:{request_class}"
+        buckets = []
+        if rpm > 0:
+            buckets.append((f"{prefix}:rpm", float(rpm), rpm / 60.0, 1.0))
+        if tpm > 0 and tokens > 0:
+            # 单次请求超过桶容量时按容量扣减，避免永远无法获取
+            buckets.append((f"{prefix}:tpm", float(tpm), tpm / 60.0, float(min(tokens, tpm))))
+        return buckets
+
+    async def _take(self, buckets: List[BucketSpec]) -> float:
+        store = self._get_store()
+        if store is self._fallback or time.monotonic() < self._redis_retry_at:
+            return await self._local_store().take(buckets)
+        try:
+            return await store.take(buckets)
+        except Exception as e:
+            self._redis_retry_at = time.monotonic() + settings.rate_limit_redis_retry_seconds
+            logger.warning(
+                f"Redis限流失败，{settings.rate_limit_redis_retry_seconds:g}秒内使用本地存储: {str(e)}"
+            )
+            return await self._local_store().take(buckets)
+
+    async def acquire(self, api_key: str, request_class: str, tokens: int = 0):
+        """申请调用配额，超过最长等待时间则快速失败"""
+        if not settings.rate_limit_enabled:
+            return
+        buckets = self._buckets(api_key, request_class, tokens)
+        if not buckets:
+            return
+
+        stats = self._stats.setdefault(request_class, {
+            "acquired": 0, "throttled": 0, "rejected": 0, "wait_seconds": 0.0
+        })
+        deadline = time.monotonic() + settings.rate_limit_max_wait_seconds
+        throttled = False
+        while True:
+            wait = await self._take(buckets)
+            if wait <= 0:
+                stats["acquired"] += 1
+                return
+            if not throttled:
+                throttled = True
+                stats["throttled"] += 1
+            remaining = deadline - time.monotonic()
+            if wait > remaining:
+                stats["rejected"] += 1
+                raise UpstreamUnavailableError(
+                    f"上游调用配额已用尽（{request_class}），请稍后重试",
+                    retry_after=max(1, int(wait + 0.999))
+                )
+            stats["wait_seconds"] += wait
+            await asyncio.sleep(wait)
+
+    def stats(self) -> Dict[str, Any]:
+        """限流统计"""
+        return {
+            "enabled": settings.rate_limit_enabled,
+            "backend": self._store.name if self._store else None,
+            "redis_fallback": time.monotonic() < self._redis_retry_at,
+            "rules": {k: {"rpm": v[0], "tpm": v[1]} for k, v in self.rules.items()},
+            "classes": self._stats
+        }
+
+
+# 全局限流器实例
+rate_limiter = UpstreamRateLimiter()
@@ -0,0 +1,63 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Any, Awaitable, Callable, Hashable
+from ..config import settings
+from .circuit_breaker import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+
+class StaleRevalidator:
+    """返回过期结果后的后台刷新：等待熔断器放行后执行刷新，同一键同时只刷新一次"""
+
+    def __init__(self):
+        self._pending: Dict[Hashable, asyncio.Task] = {}
+        self._stats = {"scheduled": 0, "refreshed": 0, "failed": 0, "gave_up": 0}
+
+    def schedule(
+        self,
+        key: Hashable,
+        breaker: CircuitBreaker,
+        refresh: Callable[[], Awaitable[Any]]
+    ) -> bool:
+        """安排后台刷新（该键已在刷新中时返回False）"""
+        if key in self._pending:
+            return False
+        self._stats["scheduled"] += 1
+        self._pending[key] = asyncio.create_task(self._run(key, breaker, refresh))
+        return True
+
+    async def _run(self, key: Hashable, breaker: CircuitBreaker, refresh: Callable[[], Awaitable[Any]]):
+        try:
+            # 先等待一个轮询间隔（刚失败时立即重试没有意义），之后直到熔断器放行
+            deadline = time.monotonic() + settings.stale_refresh_max_wait_seconds
+            while True:
+                await asyncio.sleep(settings.stale_refresh_poll_seconds)
+                if breaker.state != CircuitBreaker.OPEN:
+                    break
+                if time.monotonic() >= deadline:
+                    self._stats["gave_up"] += 1
+                    logger.info(f"上游 {breaker.name} 长时间不可用，放弃后台刷新")
+                    return
+            await refresh()
+            self._stats["refreshed"] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._stats["failed"] += 1
+            logger.warning(f"后台刷新失败: {str(e)}")
+        finally:
+            self._pending.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """后台刷新统计"""
+        return {
+            "enabled": settings.stale_while_revalidate_enabled,
+            "pending": len(self._pending),
+            **self._stats
+        }
+
+
+# 全局后台刷新实例
+revalidator = StaleRevalidator()
@@ -0,0 +1,106 @@
+import asyncio
+from typing import Dict, Any, AsyncIterator, Callable, Hashable, List, Optional, Tuple
+from ..core.exceptions import TaskCancelledError
+
+
+class Flight:
+    """一次进行中的生成，保留已产生的分块供后加入的订阅者回放"""
+
+    def __init__(self, key: Hashable):
+        self.key = key
+        self.chunks: List[Any] = []
+        self.done = False
+        self.cancelling = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        # 生产者填写的附加信息（如任务ID、是否命中缓存）
+        self.info: Dict[str, Any] = {}
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def cancel(self):
+        """取消生成（上游流随生产任务取消而关闭）"""
+        if not self.done and self.task:
+            self.cancelling = True
+            self.task.cancel()
+    
+    async def subscribe(self) -> AsyncIterator[Any]:
+        """先回放已产生的分块，再跟随实时分块直到生成结束"""
+        self.subscribers += 1
+        try:
+            index = 0
+            while True:
+                while index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+                if self.done:
+                    if self.error:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            # 最后一个订阅者断开时没有人需要结果，取消上游生成
+            if self.subscribers == 0:
+                self.cancel()
+
+
+class SingleFlight:
+    """合并相同键的并发生成：首个调用方启动生成，后续调用方作为订阅者共享输出"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[Hashable, Flight] = {}
+        self._stats = {"started": 0, "coalesced": 0, "cancelled": 0}
+
+    def join(
+        self,
+        key: Hashable,
+        factory: Callable[[Flight], AsyncIterator[Any]]
+    ) -> Tuple[Flight, bool]:
+        """加入进行中的生成，不存在时用factory启动，返回 (Flight, 是否为发起方)"""
+        flight = self._flights.get(key)
+        if flight and not flight.done and not flight.cancelling:
+            self._stats["coalesced"] += 1
+            return flight, False
+
+        flight = Flight(key)
+        self._flights[key] = flight
+        self._stats["started"] += 1
+        # 生成在独立任务中运行，发起方断开不影响其他订阅者
+        flight.task = asyncio.create_task(self._produce(flight, factory(flight)))
+        return flight, True
+
+    def start(self, factory: Callable[[Flight], AsyncIterator[Any]]) -> Flight:
+        """启动不参与合并的独立生成（同样可订阅与取消）"""
+        flight, _ = self.join(object(), factory)
+        return flight
+
+    async def _produce(self, flight: Flight, source: AsyncIterator[Any]):
+        try:
+            async for chunk in source:
+                flight.chunks.append(chunk)
+                flight._notify()
+        except asyncio.CancelledError:
+            flight.error = TaskCancelledError()
+            self._stats["cancelled"] += 1
+            raise
+        except BaseException as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            flight._notify()
+
+    def stats(self) -> Dict[str, Any]:
+        """单飞合并统计"""
+        return {
+            **self._stats,
+            "in_flight": len(self._flights),
+            "subscribers": sum(flight.subscribers for flight in self._flights.values())
+        }
@@ -0,0 +1,139 @@
+import json
+from typing import Any, List, Optional
+
+try:
+    import orjson
+
+    def json_loads(data) -> Any:
+        """快速JSON解码（orjson可直接解析bytes）"""
+        return orjson.loads(data)
+except ImportError:  # orjson为可选依赖
+    _json_decode = json.JSONDecoder().decode
+
+    def json_loads(data) -> Any:
+        """JSON解码（未安装orjson时回退到标准库，先解码可跳过编码探测）"""
+        return _json_decode(data.decode("utf-8") if isinstance(data, bytes) else data)
+
+
+class SSEEvent:
+    """一条SSE事件，data保留原始字节，按需解码"""
+
+    __slots__ = ("event", "raw", "id", "retry")
+
+    def __init__(self, event: str, raw: bytes, id: Optional[str] = None, retry: Optional[int] = None):
+        self.event = event
+        self.raw = raw
+        self.id = id
+        self.retry = retry
+
+    @property
+    def data(self) -> str:
+        return self.raw.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        """将data解析为JSON，失败时抛出json.JSONDecodeError"""
+        return json_loads(self.raw)
+
+    def __repr__(self) -> str:
+        return f"SSEEvent(event={self.event!r}, data={self.raw[:60]!r}, id={self.id!r})"
+
+
+class SSEDecoder:
+    """增量字节级SSE解码器
+
+    按 text/event-stream 规范处理 CRLF/LF/CR 换行、多行data、event/id/retry
+    字段与注释行；数据在字节层面拼接，只在调用方需要时才解码。
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._data_lines: List[bytes] = []
+        self._event: Optional[str] = None
+        self._last_id: Optional[str] = None
+        self._retry: Optional[int] = None
+        self._seen_cr = False
+        self.comments = 0
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        """输入一段字节，返回其中已完整的事件"""
+        buf = self._buffer
+        buf += chunk
+        if b"\n" not in chunk and b"\r" not in chunk:
+            return []
+
+        data = bytes(buf)
+        hold = b""
+        if self._seen_cr or b"\r" in chunk:
+            self._seen_cr = True
+            if data.endswith(b"\r"):
+                # 末尾的\r可能是被拆开的\r\n，留到下次处理
+                hold = b"\r"
+                data = data[:-1]
+            data = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+        # 按行整体切分（C层实现），最后一段是未完成的行
+        lines = data.split(b"\n")
+        buf[:] = lines.pop() + hold
+
+        events: List[SSEEvent] = []
+        data_lines = self._data_lines
+        for line in lines:
+            if not line:
+                # 空行：派发事件（热路径内联以减少函数调用）
+                if data_lines:
+                    raw = data_lines[0] if len(data_lines) == 1 else b"\n".join(data_lines)
+                    events.append(SSEEvent(self._event or "message", raw, self._last_id, self._retry))
+                    data_lines = self._data_lines = []
+                self._event = None
+            elif line.startswith(b"data:"):
+                data_lines.append(line[6:] if line[5:6] == b" " else line[5:])
+            else:
+                self._process_line(line, events)
+        return events
+
+    def flush(self) -> List[SSEEvent]:
+        """流结束时处理残留数据（容忍缺少结尾空行的上游）"""
+        events: List[SSEEvent] = []
+        if self._buffer:
+            line = bytes(self._buffer).rstrip(b"\r")
+            self._buffer.clear()
+            self._process_line(line, events)
+        self._dispatch(events)
+        return events
+
+    def _dispatch(self, events: List[SSEEvent]):
+        if self._data_lines:
+            lines = self._data_lines
+            raw = lines[0] if len(lines) == 1 else b"\n".join(lines)
+            events.append(SSEEvent(self._event or "message", raw, self._last_id, self._retry))
+            self._data_lines = []
+        self._event = None
+
+    def _process_line(self, line: bytes, events: List[SSEEvent]):
+        if not line:
+            self._dispatch(events)
+            return
+        if line[0] == 0x3A:  # ":" 开头为注释（如 ": ping"）
+            self.comments += 1
+            return
+
+        colon = line.find(b":")
+        if colon == -1:
+            field, value = line, b""
+        else:
+            field = line[:colon]
+            value = line[colon + 1:]
+            if value[:1] == b" ":
+                value = value[1:]
+
+        if field == b"data":
+            self._data_lines.append(value)
+        elif field == b"event":
+            self._event = value.decode("utf-8", errors="replace")
+        elif field == b"id":
+            if b"\0" not in value:
+                self._last_id = value.decode("utf-8", errors="replace")
+        elif field == b"retry":
+            if value.isdigit():
+                self._retry = int(value)
+
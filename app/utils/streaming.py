@@ -0,0 +1,18 @@
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+
+class CancellableStreamingResponse(StreamingResponse):
+    """客户端断开后立即关闭响应生成器
+
+    Starlette检测到断开时只取消发送任务，停在yield处的生成器要等垃圾回收才会关闭；
+    这里显式aclose，使内层服务生成器与上游HTTP流随之立即关闭。
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            aclose = getattr(self.body_iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+from typing import Callable, Dict, Any, List, Optional
+from sqlalchemy.orm import Session
+from ..config import settings
+from ..database import SessionLocal
+from ..models.task import Task
+
+logger = logging.getLogger(__name__)
+
+
+class TaskCancelRegistry:
+    """本进程内运行中任务的取消回调登记
+
+    取消接口先把数据库中的任务状态置为 cancelled，再调用本进程的回调；
+    其他worker通过后台轮询发现被取消的任务后调用各自的回调。
+    """
+
+    def __init__(self):
+        self._callbacks: Dict[int, Callable[[], None]] = {}
+        self._poller: Optional[asyncio.Task] = None
+        self._stats = {"cancelled_local": 0, "cancelled_remote": 0}
+
+    def register(self, task_id: int, callback: Callable[[], None]):
+        """登记任务的取消回调"""
+        self._callbacks[task_id] = callback
+
+    def unregister(self, task_id: int):
+        self._callbacks.pop(task_id, None)
+
+    def cancel(self, task_id: int, remote: bool = False) -> bool:
+        """取消本进程内运行的任务，任务不在本进程时返回False"""
+        callback = self._callbacks.pop(task_id, None)
+        if callback is None:
+            return False
+        self._stats["cancelled_remote" if remote else "cancelled_local"] += 1
+        callback()
+        return True
+
+    def _find_cancelled(self, task_ids: List[int]) -> List[int]:
+        db = SessionLocal()
+        try:
+            rows = db.query(Task.id).filter(
+                Task.id.in_(task_ids),
+                Task.status == "cancelled"
+            ).all()
+            return [row[0] for row in rows]
+        finally:
+            db.close()
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(settings.task_cancel_poll_seconds)
+            if not self._callbacks:
+                continue
+            try:
+                cancelled = await asyncio.to_thread(self._find_cancelled, list(self._callbacks))
+            except Exception as e:
+                logger.warning(f"查询已取消任务失败: {str(e)}")
+                continue
+            for task_id in cancelled:
+                self.cancel(task_id, remote=True)
+
+    def start(self):
+        """启动跨worker取消轮询"""
+        if self._poller is None and settings.task_cancel_poll_seconds > 0:
+            self._poller = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if self._poller:
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+            self._poller = None
+
+    def stats(self) -> Dict[str, Any]:
+        """取消统计"""
+        return {"running": len(self._callbacks), **self._stats}
+
+
+def finish_task(db: Session, task: Task, **values) -> bool:
+    """写入任务的最终状态（UPDATE ... WHERE status='running'），返回是否写入
+
+    取消接口可能已先把状态置为 cancelled（任务在其他worker时要到下次轮询才会中止），
+    此时不再覆盖为 completed / failed。
+    """
+    updated = db.query(Task).filter(
+        Task.id == task.id,
+        Task.status == "running"
+    ).update(values, synchronize_session=False)
+    db.commit()
+    db.refresh(task)
+    return updated > 0
+
+
+# 全局任务取消登记实例
+task_registry = TaskCancelRegistry()
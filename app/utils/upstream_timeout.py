@@ -0,0 +1,213 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Any, AsyncIterator, Optional, Tuple
+import httpx
+from ..config import settings
+from ..core.exceptions import UpstreamTimeoutError
+from .sse import SSEDecoder, SSEEvent
+from .latency_tracker import latency_tracker, METRIC_FIRST_EVENT, METRIC_TOTAL, METRIC_NODE
+
+# 超时阶段
+PHASE_CONNECT = "connect"
+PHASE_FIRST_EVENT = "first_event"
+PHASE_IDLE = "idle"
+PHASE_TOTAL = "total"
+PHASE_NODE = "node"
+
+PHASE_LABELS = {
+    PHASE_CONNECT: "建立连接",
+    PHASE_FIRST_EVENT: "等待首个事件",
+    PHASE_IDLE: "事件间隔",
+    PHASE_TOTAL: "总时长",
+    PHASE_NODE: "工作流节点运行"
+}
+
+# 进程内超时统计（按端点、阶段）
+_timeout_stats: Dict[str, Dict[str, int]] = {}
+
+# 单个端点的预算：(建连, 首个事件, 空闲, 总时长)，None表示使用默认值
+TimeoutSpec = Tuple[Optional[float], Optional[float], Optional[float], Optional[float]]
+
+
+def parse_timeout_overrides(overrides: str) -> Dict[str, TimeoutSpec]:
+    """解析按端点覆盖的超时 "端点:建连:首个事件:空闲:总时长,..."（留空使用默认值）"""
+    parsed = {}
+    for rule in overrides.split(","):
+        parts = [p.strip() for p in rule.split(":")]
+        if len(parts) != 5 or not parts[0]:
+            continue
+        parsed[parts[0]] = tuple(float(p) if p else None for p in parts[1:])
+    return parsed
+
+
+_overrides = parse_timeout_overrides(settings.upstream_timeout_overrides)
+
+
+class TimeoutBudget:
+    """一次上游调用的分阶段超时预算
+
+    建连超时交给httpx；首个事件与总时长从请求发出开始计算（绝对截止时间），
+    空闲超时在每收到一段字节后重新计时（上游ping也视为存活）。
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        connect: Optional[float] = None,
+        first_event: Optional[float] = None,
+        idle: Optional[float] = None,
+        total: Optional[float] = None
+    ):
+        override = _overrides.get(endpoint, (None, None, None, None))
+        self.endpoint = endpoint
+        self.connect = connect or override[0] or settings.upstream_connect_timeout
+        # 显式参数 > 由最近延迟分布推导（以配置值为增长基准）> 按端点覆盖 > 默认值
+        configured_first_event = override[1] or settings.upstream_first_event_timeout
+        self.first_event = (
+            first_event
+            or latency_tracker.timeout(endpoint, METRIC_FIRST_EVENT, reference=configured_first_event)
+            or configured_first_event
+        )
+        self.idle = idle or override[2] or settings.upstream_idle_timeout
+        configured_total = override[3] or settings.upstream_total_timeout
+        self.total = (
+            total
+            or latency_tracker.timeout(endpoint, METRIC_TOTAL, reference=configured_total)
+            or configured_total
+        )
+        self.started: Optional[float] = None
+        self.first_event_at: Optional[float] = None
+        self.node_name = ""
+        self.node_limit: Optional[float] = None
+        self.node_deadline: Optional[float] = None
+
+    def expect(self, seconds: Optional[float], name: str = ""):
+        """为当前运行的工作流节点设置完成截止时间（上游ping不会延长），None表示取消"""
+        self.node_name = name
+        self.node_limit = seconds
+        self.node_deadline = time.monotonic() + seconds if seconds else None
+
+    def _record_censored(self, phase: str):
+        """超时的调用只计数不计入分布：按截止时间记为样本会让推导超时逐轮翻倍，挂起的上游长期占用资源"""
+        if phase == PHASE_NODE:
+            latency_tracker.record_censored(self.endpoint, METRIC_NODE, self.node_name)
+            return
+        if phase in (PHASE_FIRST_EVENT, PHASE_TOTAL) and self.first_event_at is None:
+            latency_tracker.record_censored(self.endpoint, METRIC_FIRST_EVENT)
+        if phase == PHASE_TOTAL:
+            latency_tracker.record_censored(self.endpoint, METRIC_TOTAL)
+
+    def httpx_timeout(self) -> httpx.Timeout:
+        """httpx层超时：建连与写入由httpx控制，读取由预算按阶段控制"""
+        return httpx.Timeout(connect=self.connect, read=None, write=self.idle, pool=self.connect)
+
+    def _remaining(self) -> Tuple[float, str]:
+        """当前阶段剩余时间与阶段名（总时长先耗尽时按总时长计）"""
+        now = time.monotonic()
+        total_left = self.started + self.total - now
+        if self.first_event_at is None:
+            phase_left, phase = self.started + self.first_event - now, PHASE_FIRST_EVENT
+        else:
+            phase_left, phase = self.idle, PHASE_IDLE
+        if self.node_deadline is not None and self.node_deadline - now < min(total_left, phase_left):
+            return self.node_deadline - now, PHASE_NODE
+        if total_left <= phase_left:
+            return total_left, PHASE_TOTAL
+        return phase_left, phase
+
+    def expired(self, phase: str) -> UpstreamTimeoutError:
+        """构造超时异常并计数"""
+        stats = _timeout_stats.setdefault(self.endpoint, {name: 0 for name in PHASE_LABELS})
+        stats[phase] += 1
+        limit = {
+            PHASE_CONNECT: self.connect,
+            PHASE_FIRST_EVENT: self.first_event,
+            PHASE_IDLE: self.idle,
+            PHASE_TOTAL: self.total,
+            PHASE_NODE: self.node_limit
+        }[phase]
+        return UpstreamTimeoutError(
+            f"上游响应超时（{self.endpoint}，{PHASE_LABELS[phase]}超过{limit:g}秒）", phase
+        )
+
+    def classify(self, e: httpx.TimeoutException) -> UpstreamTimeoutError:
+        """将httpx超时归类到对应阶段"""
+        if isinstance(e, (httpx.ConnectTimeout, httpx.PoolTimeout)):
+            return self.expired(PHASE_CONNECT)
+        return self.expired(PHASE_IDLE)
+
+    async def wait(self, awaitable):
+        """在当前阶段剩余时间内等待
+
+        直接在当前任务中等待并由 asyncio.timeout 设置截止时间，不像 wait_for 那样为每次读取创建Task；
+        每次读取单独设置上下文，流可能先后在不同任务中读取（如对冲路由先在独立任务中等待首个分块）
+        """
+        timeout, phase = self._remaining()
+        try:
+            async with asyncio.timeout(max(0.0, timeout)):
+                return await awaitable
+        except TimeoutError:
+            self._record_censored(phase)
+            raise self.expired(phase) from None
+        except httpx.TimeoutException as e:
+            raise self.classify(e) from e
+
+    async def request(self, client: httpx.AsyncClient, method: str, url: str, **kwargs) -> httpx.Response:
+        """非流式请求（如文件上传），仅受建连与总时长约束"""
+        self.started = time.monotonic()
+        request = client.build_request(method, url, timeout=self.httpx_timeout(), **kwargs)
+        try:
+            async with asyncio.timeout(self.total):
+                return await client.send(request)
+        except TimeoutError:
+            raise self.expired(PHASE_TOTAL) from None
+        except httpx.TimeoutException as e:
+            raise self.classify(e) from e
+
+    @asynccontextmanager
+    async def stream(self, client: httpx.AsyncClient, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """流式请求，用法同 client.stream()，等待响应头计入首个事件阶段"""
+        self.started = time.monotonic()
+        request = client.build_request(method, url, timeout=self.httpx_timeout(), **kwargs)
+        response = await self.wait(client.send(request, stream=True))
+        try:
+            yield response
+        finally:
+            await response.aclose()
+        if self.first_event_at is not None:
+            latency_tracker.record(self.endpoint, METRIC_TOTAL, time.monotonic() - self.started)
+
+    async def iter_sse(self, response: httpx.Response) -> AsyncIterator[SSEEvent]:
+        """逐个读取SSE事件，每次读取都受当前阶段预算约束"""
+        decoder = SSEDecoder()
+        chunks = response.aiter_bytes()
+        while True:
+            try:
+                chunk = await self.wait(chunks.__anext__())
+            except StopAsyncIteration:
+                break
+            for event in decoder.feed(chunk):
+                if self.first_event_at is None:
+                    self.first_event_at = time.monotonic()
+                    latency_tracker.record(self.endpoint, METRIC_FIRST_EVENT, self.first_event_at - self.started)
+                yield event
+        for event in decoder.flush():
+            yield event
+
+
+def timeout_stats() -> Dict[str, Any]:
+    """超时统计"""
+    return {
+        "defaults": {
+            PHASE_CONNECT: settings.upstream_connect_timeout,
+            PHASE_FIRST_EVENT: settings.upstream_first_event_timeout,
+            PHASE_IDLE: settings.upstream_idle_timeout,
+            PHASE_TOTAL: settings.upstream_total_timeout
+        },
+        "overrides": {
+            endpoint: dict(zip((PHASE_CONNECT, PHASE_FIRST_EVENT, PHASE_IDLE, PHASE_TOTAL), spec))
+            for endpoint, spec in _overrides.items()
+        },
+        "timeouts": _timeout_stats
+    }
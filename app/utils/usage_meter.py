@@ -0,0 +1,138 @@
+import time
+from typing import Dict, Any, List, Optional, Tuple
+from ..config import settings
+from .token_utils import estimate_tokens
+
+
+def parse_model_prices(prices: str) -> Dict[str, Tuple[float, float]]:
+    """解析模型单价 "模型或端点:输入每千token:输出每千token,..."（无效项忽略）"""
+    parsed = {}
+    for rule in prices.split(","):
+        parts = [p.strip() for p in rule.split(":")]
+        if len(parts) != 3 or not parts[0]:
+            continue
+        try:
+            parsed[parts[0]] = (float(parts[1]), float(parts[2]))
+        except ValueError:
+            continue
+    return parsed
+
+
+_prices = parse_model_prices(settings.model_prices)
+
+
+def _ms(seconds: Optional[float]) -> Optional[int]:
+    return round(seconds * 1000) if seconds is not None else None
+
+
+class UpstreamUsage:
+    """一次上游调用的token用量与耗时
+
+    上游在结束事件中给出用量时以上游为准，否则按输入与输出文本估算（estimated为True）。
+    """
+
+    def __init__(self, endpoint: str, model: Optional[str], prompt_estimate: int):
+        self.endpoint = endpoint
+        self.model = model
+        self.started_at = time.monotonic()
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        self.total_tokens: Optional[int] = None
+        self._prompt_estimate = prompt_estimate
+        self._completion_estimate = 0
+
+    def add_output(self, text: str):
+        """记录一段输出（首段输出的时间即首字延迟）"""
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+        self._completion_estimate += estimate_tokens(text)
+
+    def report(
+        self,
+        prompt_tokens: Optional[int] = None,
+        completion_tokens: Optional[int] = None,
+        total_tokens: Optional[int] = None
+    ):
+        """记录上游返回的用量"""
+        self.prompt_tokens = prompt_tokens if prompt_tokens is not None else self.prompt_tokens
+        self.completion_tokens = completion_tokens if completion_tokens is not None else self.completion_tokens
+        self.total_tokens = total_tokens if total_tokens is not None else self.total_tokens
+
+    def finish(self):
+        if self.finished_at is None:
+            self.finished_at = time.monotonic()
+
+    @property
+    def estimated(self) -> bool:
+        return self.prompt_tokens is None and self.total_tokens is None
+
+    def tokens(self) -> Tuple[int, int, int]:
+        """(输入, 输出, 合计)，上游只给出合计时全部计入合计"""
+        if not self.estimated:
+            prompt = self.prompt_tokens or 0
+            completion = self.completion_tokens or 0
+            return prompt, completion, self.total_tokens or prompt + completion
+        return self._prompt_estimate, self._completion_estimate, self._prompt_estimate + self._completion_estimate
+
+    def cost(self) -> float:
+        """按模型（未配置时按端点）单价估算费用"""
+        price = _prices.get(self.model or "") or _prices.get(self.endpoint)
+        if not price:
+            return 0.0
+        prompt, completion, total = self.tokens()
+        if not prompt and not completion:
+            # 只有合计用量时按输入单价计
+            return total * price[0] / 1000
+        return (prompt * price[0] + completion * price[1]) / 1000
+
+    def ttft(self) -> Optional[float]:
+        return self.first_token_at - self.started_at if self.first_token_at is not None else None
+
+    def duration(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        prompt, completion, total = self.tokens()
+        return {
+            "endpoint": self.endpoint,
+            "model": self.model,
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "total_tokens": total,
+            "ttft_ms": _ms(self.ttft()),
+            "duration_ms": _ms(self.duration()),
+            "cost": round(self.cost(), 6),
+            "estimated": self.estimated
+        }
+
+
+class UsageMeter:
+    """一个任务内所有上游调用（含对冲请求）的用量记录"""
+
+    def __init__(self):
+        self.calls: List[UpstreamUsage] = []
+
+    def start(self, endpoint: str, model: Optional[str] = None, prompt_estimate: int = 0) -> UpstreamUsage:
+        """开始记录一次上游调用"""
+        usage = UpstreamUsage(endpoint, model, prompt_estimate)
+        self.calls.append(usage)
+        return usage
+
+    def summary(self) -> Dict[str, Any]:
+        """任务级汇总：token与费用累加，首字延迟取最早到达的一路，总耗时为首次调用开始到最后结束"""
+        totals = [call.tokens() for call in self.calls]
+        first_tokens = [call.first_token_at for call in self.calls if call.first_token_at is not None]
+        started = min((call.started_at for call in self.calls), default=None)
+        finished = max((call.finished_at or time.monotonic() for call in self.calls), default=None)
+        return {
+            "prompt_tokens": sum(t[0] for t in totals),
+            "completion_tokens": sum(t[1] for t in totals),
+            "total_tokens": sum(t[2] for t in totals),
+            "ttft_ms": _ms(min(first_tokens) - started) if first_tokens else None,
+            "duration_ms": _ms(finished - started) if started is not None else 0,
+            "cost": round(sum(call.cost() for call in self.calls), 6),
+            "calls": len(self.calls),
+            "estimated": any(call.estimated for call in self.calls)
+        }
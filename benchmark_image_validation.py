@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+图片校验事件循环延迟基准测试
+对比原实现（在事件循环中直接 Image.open().verify()）与文件头嗅探 + 线程池深度校验，
+校验期间另一协程每1ms醒来一次，统计其被推迟的时间（即同一worker中其他SSE流被阻塞的时间）
+"""
+
+import asyncio
+import io
+import os
+import random
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+# 添加项目路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image
+from app.utils.image_validation import validate_image_upload
+
+TICK_SECONDS = 0.001
+
+
+def build_image(image_format: str, width: int = 4000, height: int = 3000) -> bytes:
+    """构造近似手机照片大小的图片（随机噪声，压缩率低）"""
+    random.seed(42)
+    image = Image.frombytes("RGB", (width, height), random.randbytes(width * height * 3))
+    buffer = io.BytesIO()
+    if image_format == "JPEG":
+        image.save(buffer, image_format, quality=90)
+    else:
+        image.save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def make_upload(data: bytes, content_type: str) -> SimpleNamespace:
+    """模拟UploadFile（只用到file与content_type）"""
+    return SimpleNamespace(file=io.BytesIO(data), content_type=content_type, filename="board")
+
+
+def validate_legacy(upload) -> bool:
+    """原实现：在事件循环中同步完整校验"""
+    image = Image.open(upload.file)
+    image.verify()
+    upload.file.seek(0)
+    return True
+
+
+async def measure_lag(workload) -> dict:
+    """运行workload期间统计定时协程的延迟"""
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            expected = time.perf_counter() + TICK_SECONDS
+            await asyncio.sleep(TICK_SECONDS)
+            lags.append(max(0.0, time.perf_counter() - expected))
+
+    tick_task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    started = time.perf_counter()
+    await workload()
+    elapsed = time.perf_counter() - started
+    done.set()
+    await tick_task
+
+    ordered = sorted(lags)
+    return {
+        "elapsed": elapsed,
+        "max_lag": ordered[-1] if ordered else 0.0,
+        "p99_lag": ordered[int(len(ordered) * 0.99) - 1] if len(ordered) >= 100 else (ordered[-1] if ordered else 0.0),
+        "mean_lag": statistics.mean(ordered) if ordered else 0.0
+    }
+
+
+def report(name: str, result: dict):
+    print(
+        f"  {name:<10} 总耗时: {result['elapsed'] * 1000:8.1f} ms  "
+        f"循环延迟 最大: {result['max_lag'] * 1000:7.1f} ms  "
+        f"p99: {result['p99_lag'] * 1000:7.1f} ms  平均: {result['mean_lag'] * 1000:6.2f} ms"
+    )
+
+
+async def run(concurrency: int = 4):
+    for image_format, content_type in (("PNG", "image/png"), ("JPEG", "image/jpeg")):
+        data = build_image(image_format)
+        print(f"📊 {image_format} 4000x3000，{len(data) / 1024 / 1024:.1f} MB，并发 {concurrency} 个上传")
+
+        async def legacy():
+            for _ in range(concurrency):
+                validate_legacy(make_upload(data, content_type))
+
+        async def offloaded():
+            await asyncio.gather(*(
+                validate_image_upload(make_upload(data, content_type)) for _ in range(concurrency)
+            ))
+
+        report("原实现", await measure_lag(legacy))
+        report("新实现", await measure_lag(offloaded))
+        print()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
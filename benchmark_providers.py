@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+大模型提供方对比基准测试
+对已配置的提供方（dify / dashscope / local）依次执行相同的对话补全，对比首字延迟与生成速度
+
+用法: python benchmark_providers.py [提供方 ...] [--rounds N] [--prompt 文本] [--model 模型] [--user 用户标识]
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import os
+
+# 添加项目路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.utils.api_client import providers, get_provider
+from app.utils.http_pool import upstream_pool
+from app.utils.llm_provider import benchmark_provider
+
+DEFAULT_PROMPT = "请用300字左右介绍STM32F103的GPIO配置步骤，并给出点亮LED的示例代码。"
+
+
+def summarize(name: str, results: list):
+    ok = [r for r in results if "error" not in r and r["ttft_seconds"] is not None]
+    failed = len(results) - len(ok)
+    if not ok:
+        print(f"  {name:<10} 全部失败（{failed} 轮）")
+        return
+    ttft = statistics.median(r["ttft_seconds"] for r in ok)
+    total = statistics.median(r["total_seconds"] for r in ok)
+    speeds = [r["tokens_per_second"] for r in ok if r["tokens_per_second"]]
+    speed = f"{statistics.median(speeds):8.1f}" if speeds else "       -"
+    print(
+        f"  {name:<10} 首字延迟: {ttft * 1000:8.0f} ms  总耗时: {total:6.2f} s  "
+        f"生成速度: {speed} token/s  成功: {len(ok)}/{len(results)}"
+    )
+
+
+async def run(names: list, rounds: int, prompt: str, model: str = None, user_id: str = "benchmark"):
+    summaries = {}
+    try:
+        for name in names:
+            provider = get_provider(name)
+            print(f"📊 {name}（端点 {provider.endpoint}）")
+            results = []
+            async for result in benchmark_provider(provider, prompt, rounds, model, user_id=user_id):
+                results.append(result)
+                if "error" in result:
+                    print(f"  第{result['round']}轮 ❌ {result['error']}")
+                else:
+                    ttft = result["ttft_seconds"]
+                    ttft_text = f"{ttft * 1000:.0f} ms" if ttft is not None else "-"
+                    print(f"  第{result['round']}轮 首字 {ttft_text}，{result['tokens']} token，共 {result['total_seconds']:.2f} s")
+            summaries[name] = results
+    finally:
+        await upstream_pool.aclose()
+
+    print("\n📈 中位数对比")
+    for name, results in summaries.items():
+        summarize(name, results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="大模型提供方对比基准测试")
+    parser.add_argument("providers", nargs="*", help=f"提供方名称（默认全部: {', '.join(providers)}）")
+    parser.add_argument("--rounds", type=int, default=3, help="每个提供方的测试轮数")
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT, help="测试使用的提示词")
+    parser.add_argument("--model", default=None, help="覆盖提供方的默认模型")
+    parser.add_argument("--user", default="benchmark", help="发送给上游的用户标识")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.providers or list(providers), args.rounds, args.prompt, args.model, args.user))
+
+
+if __name__ == "__main__":
+    main()
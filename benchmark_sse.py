@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+SSE解析微基准测试
+对比原 aiter_lines + 字符串切片 + json.loads 的解析方式与新的字节级增量解码器
+"""
+
+import json
+import random
+import sys
+import os
+import time
+
+# 添加项目路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from httpx._decoders import LineDecoder, TextDecoder
+from app.utils.sse import SSEDecoder
+
+
+def build_stream(num_events: int = 20000, chunk_size: int = 512) -> list:
+    """构造模拟Dify对话流：大量小message事件，穿插ping注释，按固定大小切块"""
+    random.seed(42)
+    parts = []
+    for i in range(num_events):
+        if i % 50 == 0:
+            parts.append(b": ping\n\n")
+        answer = "".join(random.choice("电路代码int main(){}GPIO ") for _ in range(random.randint(2, 12)))
+        event = {
+            "event": "message",
+            "conversation_id": "c0ffee00-0000-0000-0000-000000000000",
+            "message_id": "m0000000-0000-0000-0000-000000000000",
+            "answer": answer,
+            "created_at": 1700000000 + i
+        }
+        parts.append(b"data: " + json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n\n")
+    parts.append(b'data: {"event": "message_end"}\n\n')
+
+    payload = b"".join(parts)
+    return [payload[i:i + chunk_size] for i in range(0, len(payload), chunk_size)]
+
+
+def parse_legacy(chunks: list) -> int:
+    """原实现：httpx按行解码后字符串切片再json.loads"""
+    text_decoder = TextDecoder()
+    line_decoder = LineDecoder()
+    count = 0
+
+    def handle(line: str):
+        nonlocal count
+        if line and line.startswith("data:"):
+            json_str = line[5:].strip()
+            try:
+                json.loads(json_str)
+                count += 1
+            except json.JSONDecodeError:
+                pass
+
+    for chunk in chunks:
+        for line in line_decoder.decode(text_decoder.decode(chunk)):
+            handle(line)
+    for line in line_decoder.decode(text_decoder.flush()):
+        handle(line)
+    for line in line_decoder.flush():
+        handle(line)
+    return count
+
+
+def parse_incremental(chunks: list) -> int:
+    """新实现：字节级增量SSE解码 + 按需JSON解码"""
+    decoder = SSEDecoder()
+    count = 0
+    for chunk in chunks:
+        for event in decoder.feed(chunk):
+            event.json()
+            count += 1
+    for event in decoder.flush():
+        event.json()
+        count += 1
+    return count
+
+
+def bench(name: str, func, chunks: list, rounds: int = 5) -> float:
+    best = float("inf")
+    count = 0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        count = func(chunks)
+        best = min(best, time.perf_counter() - start)
+    print(f"  {name:<12} 事件数: {count:>6}  最佳耗时: {best * 1000:8.2f} ms  ({count / best:,.0f} 事件/秒)")
+    return best
+
+
+def main():
+    for chunk_size in (64, 512, 4096):
+        chunks = build_stream(chunk_size=chunk_size)
+        total_bytes = sum(len(c) for c in chunks)
+        print(f"📊 数据块大小 {chunk_size} 字节，共 {len(chunks)} 块 / {total_bytes / 1024:.0f} KB")
+        legacy = bench("原实现", parse_legacy, chunks)
+        incremental = bench("增量解码器", parse_incremental, chunks)
+        print(f"  🚀 加速比: {legacy / incremental:.2f}x\n")
+
+
+if __name__ == "__main__":
+    main()
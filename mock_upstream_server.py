@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+"""
+本地模拟上游服务（Dify + 阿里云DashScope）
+用于离线压测与基准测试，避免消耗真实API配额
+
+实现的接口:
+  POST /v1/files/upload        Dify文件上传
+  POST /v1/workflows/run       Dify工作流（流式 node_started / node_finished / workflow_finished）
+  POST /v1/chat-messages       Dify对话（流式 message / message_end）
+  POST /v1/chat/completions    DashScope兼容模式（OpenAI流式格式，以 [DONE] 结束）
+  GET  /mock/stats             请求统计
+  GET/POST /mock/config        查看/在线修改模拟参数
+
+使用方式:
+  python mock_upstream_server.py --port 8001 --latency-ms 300 --token-rate 50
+
+然后将主服务的上游地址指向本服务:
+  API_URL_DIFY=http://localhost:8001/v1/workflows/run
+  UPLOAD_URL_DIFY=http://localhost:8001/v1/files/upload
+  CODE_API_URL_DIFY=http://localhost:8001/v1/chat-messages
+  ALIBABA_BASE_URL=http://localhost:8001/v1
+
+所有参数也可通过 MOCK_* 环境变量设置（如 MOCK_LATENCY_MS=300）
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+import uuid
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request, UploadFile, File, Form
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 生成文本使用的词表（中文需求文档、BOM与代码片段混合，接近真实输出）
+VOCABULARY = [
+    "电路", "模块", "电源", "稳压", "传感器", "单片机", "引脚", "接口", "电阻", "电容",
+    "需求", "设计", "功能", "温度", "湿度", "显示", "通信", "串口", "采集", "控制",
+    "int ", "void ", "main", "(", ")", "{", "}", ";", "\n", "GPIO", "_init", "delay",
+    "HAL_", "uint8_t ", "return ", "if ", "for ", " = ", "0x", "FF", "//", "# ", "步骤", "：",
+]
+
+BOM_PARTS = [
+    ("STM32F103C8T6", "主控单片机"), ("AMS1117-3.3", "LDO稳压器"), ("DHT22", "温湿度传感器"),
+    ("SSD1306", "OLED显示屏"), ("CH340G", "USB转串口"), ("10kΩ", "上拉电阻"),
+    ("100nF", "去耦电容"), ("8MHz", "晶振"), ("LED-0603", "指示灯"), ("TYPE-C", "USB接口"),
+]
+
+
+class MockConfig:
+    """模拟参数（环境变量 MOCK_* 或命令行参数设置，运行中可通过 /mock/config 修改）"""
+
+    # 首字节延迟（毫秒）及随机抖动
+    latency_ms: float = 200.0
+    latency_jitter_ms: float = 50.0
+    # 流式输出速度（token/秒）与每个事件携带的token数
+    token_rate: float = 50.0
+    tokens_per_event: int = 2
+    # 输出规模：对话/部署指南token数、工作流节点数、需求文档token数、BOM行数
+    response_tokens: int = 400
+    workflow_nodes: int = 4
+    document_tokens: int = 300
+    bom_rows: int = 10
+    # 每张输入图片计入的token数（用量统计中的输入token）
+    image_tokens: int = 800
+    # 错误注入：请求直接失败的概率与状态码、流中断开/卡顿的概率
+    error_rate: float = 0.0
+    error_statuses: str = "500,502,503,429"
+    disconnect_rate: float = 0.0
+    stall_rate: float = 0.0
+    stall_seconds: float = 30.0
+    # Dify对话的ping事件间隔（秒）
+    ping_interval: float = 10.0
+    # 工作流引用未上传过的文件ID时返回400（用于验证文件ID失效重传）
+    strict_files: bool = True
+    # 随机种子：相同输入生成相同输出，保证结果可复现
+    seed: int = 42
+
+    def __init__(self):
+        for name, default in self.fields().items():
+            value = os.getenv(f"MOCK_{name.upper()}")
+            if value is not None:
+                setattr(self, name, self.coerce(name, value))
+
+    @classmethod
+    def fields(cls) -> Dict[str, Any]:
+        return {
+            name: value for name, value in vars(cls).items()
+            if not name.startswith("_") and not callable(value) and not isinstance(value, classmethod)
+        }
+
+    @classmethod
+    def coerce(cls, name: str, value: Any) -> Any:
+        default = cls.fields()[name]
+        if isinstance(default, bool):
+            return value if isinstance(value, bool) else str(value).lower() in ("1", "true", "yes")
+        return type(default)(value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.fields()}
+
+
+config = MockConfig()
+stats: Dict[str, Dict[str, int]] = {}
+uploaded_files: Dict[str, Dict[str, Any]] = {}
+
+app = FastAPI(title="Mock Upstream", description="Dify / DashScope 本地模拟服务")
+
+
+def count(endpoint: str, field: str):
+    endpoint_stats = stats.setdefault(endpoint, {
+        "requests": 0, "completed": 0, "errors": 0, "disconnects": 0, "stalls": 0, "bytes_in": 0
+    })
+    endpoint_stats[field] += 1
+
+
+def request_rng(body: Any) -> random.Random:
+    """按请求内容与种子派生随机数生成器，相同输入得到相同输出"""
+    digest = hashlib.sha256(
+        f"{config.seed}:{json.dumps(body, sort_keys=True, ensure_ascii=False, default=str)}".encode("utf-8")
+    ).hexdigest()
+    return random.Random(int(digest[:16], 16))
+
+
+def generate_tokens(rng: random.Random, count_tokens: int) -> List[str]:
+    return [rng.choice(VOCABULARY) for _ in range(count_tokens)]
+
+
+def generate_bom(rng: random.Random, rows: int) -> str:
+    lines = ["序号,型号,描述,数量"]
+    for i in range(rows):
+        part, desc = BOM_PARTS[rng.randrange(len(BOM_PARTS))]
+        lines.append(f"{i + 1},{part},{desc},{rng.randint(1, 10)}")
+    return "\n".join(lines)
+
+
+def prompt_tokens(value: Any) -> int:
+    """按请求内容估算输入token数（中文按字计，其余按4字符1token计），图片输入按固定token数计"""
+    if isinstance(value, dict):
+        if value.get("type") == "image" or "upload_file_id" in value:
+            return config.image_tokens
+        return sum(prompt_tokens(v) for v in value.values())
+    if isinstance(value, list):
+        return sum(prompt_tokens(v) for v in value)
+    if not isinstance(value, str):
+        return 0
+    cjk = sum(1 for ch in value if "\u4e00" <= ch <= "\u9fff")
+    return cjk + (len(value) - cjk + 3) // 4
+
+
+def usage(prompt: int, completion: int) -> Dict[str, int]:
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+
+def sse(data: Any, event: Optional[str] = None) -> str:
+    payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {payload}\n\n"
+
+
+async def first_byte_delay():
+    jitter = random.uniform(-config.latency_jitter_ms, config.latency_jitter_ms)
+    await asyncio.sleep(max(0.0, config.latency_ms + jitter) / 1000)
+
+
+def injected_error(endpoint: str) -> Optional[JSONResponse]:
+    """按错误注入概率返回上游错误响应"""
+    if config.error_rate <= 0 or random.random() >= config.error_rate:
+        return None
+    count(endpoint, "errors")
+    statuses = [int(s) for s in config.error_statuses.split(",") if s.strip()] or [500]
+    status = random.choice(statuses)
+    headers = {"Retry-After": "1"} if status == 429 else None
+    return JSONResponse(
+        status_code=status,
+        content={"code": "mock_injected_error", "message": f"模拟上游错误 {status}", "status": status},
+        headers=headers
+    )
+
+
+def unauthorized(request: Request) -> Optional[JSONResponse]:
+    if not request.headers.get("authorization", "").startswith("Bearer "):
+        return JSONResponse(status_code=401, content={"code": "unauthorized", "message": "缺少API密钥"})
+    return None
+
+
+async def paced(endpoint: str, events: AsyncGenerator[str, None]) -> AsyncGenerator[str, None]:
+    """对事件流注入断开/卡顿故障并统计完成数"""
+    disconnect = random.random() < config.disconnect_rate
+    stall = random.random() < config.stall_rate
+    emitted = 0
+    async for event in events:
+        yield event
+        emitted += 1
+        if emitted == 3:
+            if stall:
+                count(endpoint, "stalls")
+                await asyncio.sleep(config.stall_seconds)
+            if disconnect:
+                count(endpoint, "disconnects")
+                # 抛出异常使服务器直接断开连接，模拟上游中途掉线
+                raise ConnectionResetError("模拟上游连接中断")
+    count(endpoint, "completed")
+
+
+async def stream_tokens(tokens: List[str]) -> AsyncGenerator[str, None]:
+    """按配置速率分批输出token"""
+    step = max(1, config.tokens_per_event)
+    interval = step / config.token_rate if config.token_rate > 0 else 0
+    for i in range(0, len(tokens), step):
+        if interval:
+            await asyncio.sleep(interval)
+        yield "".join(tokens[i:i + step])
+
+
+@app.post("/v1/files/upload")
+async def upload_file(request: Request, file: UploadFile = File(...), user: str = Form(...)):
+    count("files_upload", "requests")
+    if (error := unauthorized(request) or injected_error("files_upload")):
+        return error
+
+    size = 0
+    digest = hashlib.sha256()
+    while chunk := await file.read(256 * 1024):
+        size += len(chunk)
+        digest.update(chunk)
+    stats["files_upload"]["bytes_in"] += size
+    await first_byte_delay()
+
+    file_id = str(uuid.uuid4())
+    uploaded_files[file_id] = {"user": user, "size": size, "sha256": digest.hexdigest()}
+    count("files_upload", "completed")
+    return JSONResponse(status_code=201, content={
+        "id": file_id,
+        "name": file.filename,
+        "size": size,
+        "extension": os.path.splitext(file.filename or "")[1].lstrip("."),
+        "mime_type": file.content_type,
+        "created_by": user,
+        "created_at": int(time.time())
+    })
+
+
+@app.post("/v1/workflows/run")
+async def workflows_run(request: Request):
+    count("workflows_run", "requests")
+    if (error := unauthorized(request) or injected_error("workflows_run")):
+        return error
+
+    body = await request.json()
+    image = (body.get("inputs") or {}).get("image") or {}
+    file_id = image.get("upload_file_id")
+    if config.strict_files and file_id and file_id not in uploaded_files:
+        count("workflows_run", "errors")
+        return JSONResponse(status_code=400, content={
+            "code": "invalid_param", "message": f"File {file_id} not found", "status": 400
+        })
+    await first_byte_delay()
+
+    rng = request_rng(body)
+    run_id = str(uuid.uuid4())
+    nodes = max(1, config.workflow_nodes)
+    document = "".join(generate_tokens(rng, config.document_tokens))
+    bom = generate_bom(rng, config.bom_rows)
+    usage_total = usage(prompt_tokens(body.get("inputs")), config.document_tokens + prompt_tokens(bom))["total_tokens"]
+    # 按token速率估算总耗时，平均分配到各节点
+    node_seconds = config.document_tokens / config.token_rate / nodes if config.token_rate > 0 else 0
+
+    async def events() -> AsyncGenerator[str, None]:
+        started = time.time()
+        yield sse({"event": "workflow_started", "workflow_run_id": run_id, "data": {"id": run_id}})
+        for i in range(nodes):
+            title = ["开始", "图片识别", "需求分析", "BOM生成", "结束"][i] if nodes <= 5 else f"节点{i + 1}"
+            node_id = str(uuid.uuid4())
+            yield sse({"event": "node_started", "workflow_run_id": run_id,
+                       "data": {"id": node_id, "title": title, "index": i + 1}})
+            await asyncio.sleep(node_seconds)
+            yield sse({"event": "node_finished", "workflow_run_id": run_id,
+                       "data": {"id": node_id, "title": title, "status": "succeeded", "elapsed_time": node_seconds}})
+        yield sse({"event": "workflow_finished", "workflow_run_id": run_id, "data": {
+            "id": run_id,
+            "status": "succeeded",
+            "outputs": {"BOM文件": bom, "需求文档": document},
+            "elapsed_time": time.time() - started,
+            # 与Dify一致：工作流只返回合计token数
+            "total_tokens": usage_total,
+            "total_steps": nodes
+        }})
+
+    return StreamingResponse(paced("workflows_run", events()), media_type="text/event-stream")
+
+
+@app.post("/v1/chat-messages")
+async def chat_messages(request: Request):
+    count("chat_messages", "requests")
+    if (error := unauthorized(request) or injected_error("chat_messages")):
+        return error
+
+    body = await request.json()
+    await first_byte_delay()
+
+    rng = request_rng({"inputs": body.get("inputs"), "query": body.get("query")})
+    conversation_id = body.get("conversation_id") or str(uuid.uuid4())
+    message_id = str(uuid.uuid4())
+    tokens = generate_tokens(rng, config.response_tokens)
+
+    async def events() -> AsyncGenerator[str, None]:
+        last_ping = time.monotonic()
+        async for answer in stream_tokens(tokens):
+            if config.ping_interval > 0 and time.monotonic() - last_ping >= config.ping_interval:
+                last_ping = time.monotonic()
+                yield "event: ping\n\n"
+            yield sse({
+                "event": "message",
+                "conversation_id": conversation_id,
+                "message_id": message_id,
+                "answer": answer,
+                "created_at": int(time.time())
+            })
+        yield sse({
+            "event": "message_end",
+            "conversation_id": conversation_id,
+            "message_id": message_id,
+            "metadata": {"usage": usage(prompt_tokens([body.get("inputs"), body.get("query")]), len(tokens))}
+        })
+
+    return StreamingResponse(paced("chat_messages", events()), media_type="text/event-stream")
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    count("chat_completions", "requests")
+    if (error := unauthorized(request) or injected_error("chat_completions")):
+        return error
+
+    body = await request.json()
+    await first_byte_delay()
+
+    rng = request_rng({"messages": body.get("messages"), "model": body.get("model")})
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    model = body.get("model", "qwen-max")
+    limit = body.get("max_tokens") or config.response_tokens
+    tokens = generate_tokens(rng, min(config.response_tokens, limit))
+    call_usage = usage(prompt_tokens(body.get("messages")), len(tokens))
+    include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+    def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+        data = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+        if include_usage:
+            data["usage"] = None
+        return sse(data)
+
+    async def events() -> AsyncGenerator[str, None]:
+        yield chunk({"role": "assistant", "content": ""})
+        async for content in stream_tokens(tokens):
+            yield chunk({"content": content})
+        yield chunk({}, "stop")
+        if include_usage:
+            # stream_options.include_usage：最后一个分块choices为空，携带本次请求的用量
+            yield sse({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [],
+                "usage": call_usage
+            })
+        yield sse("[DONE]")
+
+    if not body.get("stream"):
+        await asyncio.sleep(len(tokens) / config.token_rate if config.token_rate > 0 else 0)
+        count("chat_completions", "completed")
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+            "usage": call_usage
+        }
+
+    return StreamingResponse(paced("chat_completions", events()), media_type="text/event-stream")
+
+
+@app.get("/mock/stats")
+async def get_stats():
+    return {"stats": stats, "uploaded_files": len(uploaded_files)}
+
+
+@app.get("/mock/config")
+async def get_config():
+    return config.to_dict()
+
+
+@app.post("/mock/config")
+async def update_config(updates: Dict[str, Any]):
+    """在线修改模拟参数（如压测过程中切换错误注入比例）"""
+    fields = MockConfig.fields()
+    for name, value in updates.items():
+        if name in fields:
+            setattr(config, name, MockConfig.coerce(name, value))
+    return config.to_dict()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dify / DashScope 本地模拟上游服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    for name, default in MockConfig.fields().items():
+        parser.add_argument(f"--{name.replace('_', '-')}", dest=name, default=None,
+                            help=f"默认 {getattr(config, name)}")
+    args = parser.parse_args()
+
+    for name in MockConfig.fields():
+        value = getattr(args, name)
+        if value is not None:
+            setattr(config, name, MockConfig.coerce(name, value))
+
+    print(f"🧪 模拟上游服务启动: http://{args.host}:{args.port}/v1")
+    print(f"   参数: {json.dumps(config.to_dict(), ensure_ascii=False)}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import asyncio
+import pytest
+from app.core.exceptions import UpstreamUnavailableError, create_http_exception
+from app.utils.bulkhead import Bulkhead
+
+
+async def hold(bulkhead: Bulkhead, release: asyncio.Event, entered: asyncio.Event = None):
+    async with bulkhead.slot():
+        if entered:
+            entered.set()
+        await release.wait()
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_full_queue_rejects_with_503_and_retry_after():
+    bulkhead = Bulkhead("test", max_concurrent=1, max_queue=1, max_queue_seconds=5)
+    release = asyncio.Event()
+    holders = [asyncio.create_task(hold(bulkhead, release)) for _ in range(2)]
+    await settle()
+    assert bulkhead.stats()["active"] == 1
+    assert bulkhead.stats()["queue_depth"] == 1
+
+    with pytest.raises(UpstreamUnavailableError) as exc_info:
+        bulkhead.ensure_capacity()
+    http_error = create_http_exception(exc_info.value)
+    assert http_error.status_code == 503
+    assert int(http_error.headers["Retry-After"]) >= 1
+    with pytest.raises(UpstreamUnavailableError):
+        async with bulkhead.slot():
+            pass
+    assert bulkhead.stats()["rejected"] == 2
+
+    release.set()
+    await asyncio.gather(*holders)
+    assert bulkhead.stats()["admitted"] == 2
+
+
+@pytest.mark.asyncio
+async def test_queue_wait_times_out():
+    bulkhead = Bulkhead("test", max_concurrent=1, max_queue=2, max_queue_seconds=0.05)
+    release = asyncio.Event()
+    holder = asyncio.create_task(hold(bulkhead, release))
+    await settle()
+
+    with pytest.raises(UpstreamUnavailableError) as exc_info:
+        async with bulkhead.slot():
+            pass
+    assert "排队超时" in exc_info.value.message
+    stats = bulkhead.stats()
+    assert stats["queue_timeouts"] == 1
+    assert stats["queue_depth"] == 0
+
+    release.set()
+    await holder
+    # 超时的等待者没有占用名额
+    async with bulkhead.slot():
+        assert bulkhead.stats()["active"] == 1
+
+
+@pytest.mark.asyncio
+async def test_cancel_releases_slot_and_queue_position():
+    bulkhead = Bulkhead("test", max_concurrent=1, max_queue=1, max_queue_seconds=5)
+    release, entered = asyncio.Event(), asyncio.Event()
+    holder = asyncio.create_task(hold(bulkhead, release, entered))
+    await entered.wait()
+    waiter = asyncio.create_task(hold(bulkhead, asyncio.Event()))
+    await settle()
+    assert bulkhead.stats()["queue_depth"] == 1
+
+    # 取消排队中的请求：让出队列位置
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    assert bulkhead.stats()["queue_depth"] == 0
+
+    # 取消持有名额的请求：名额归还
+    holder.cancel()
+    await asyncio.gather(holder, return_exceptions=True)
+    assert bulkhead.stats()["active"] == 0
+    async with asyncio.timeout(1):
+        async with bulkhead.slot():
+            pass
+
+
+@pytest.mark.asyncio
+async def test_concurrent_timeouts_and_cancels_do_not_leak_permits():
+    bulkhead = Bulkhead("test", max_concurrent=2, max_queue=50, max_queue_seconds=0.01)
+
+    async def short_job():
+        async with bulkhead.slot():
+            await asyncio.sleep(0.005)
+
+    jobs = [asyncio.create_task(short_job()) for _ in range(40)]
+    await asyncio.sleep(0.003)
+    for job in jobs[::3]:
+        job.cancel()
+    await asyncio.gather(*jobs, return_exceptions=True)
+
+    stats = bulkhead.stats()
+    assert stats["active"] == 0 and stats["queue_depth"] == 0
+    # 两个名额都能重新占用
+    async with asyncio.timeout(1):
+        async with bulkhead.slot(), bulkhead.slot():
+            assert bulkhead.stats()["active"] == 2
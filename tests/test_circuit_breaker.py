@@ -0,0 +1,106 @@
+import httpx
+import pytest
+from app.core.exceptions import ExternalAPIError, UpstreamUnavailableError
+from app.utils import circuit_breaker as breaker_module
+from app.utils.circuit_breaker import CircuitBreaker, is_upstream_failure
+
+
+@pytest.fixture
+def breaker(clock, monkeypatch):
+    monkeypatch.setattr(breaker_module, "time", clock)
+    return CircuitBreaker(
+        "test",
+        failure_rate_threshold=0.5,
+        slow_call_seconds=10,
+        slow_call_rate_threshold=0.8,
+        window_seconds=60,
+        minimum_calls=4,
+        open_seconds=30,
+        half_open_probes=2
+    )
+
+
+def fail(breaker: CircuitBreaker, times: int = 1):
+    for _ in range(times):
+        breaker.record(True, 0.1)
+
+
+def succeed(breaker: CircuitBreaker, times: int = 1):
+    for _ in range(times):
+        breaker.record(False, 0.1)
+
+
+def open_breaker(breaker: CircuitBreaker):
+    succeed(breaker, 2)
+    fail(breaker, 2)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_stays_closed_below_minimum_calls(breaker):
+    fail(breaker, 3)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_opens_at_failure_rate_threshold(breaker):
+    open_breaker(breaker)
+    with pytest.raises(UpstreamUnavailableError) as exc_info:
+        breaker.guard()
+    assert exc_info.value.retry_after == 30
+
+
+def test_opens_on_slow_call_rate(breaker):
+    for _ in range(4):
+        breaker.record(False, 12.0)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_failures_outside_window_are_forgotten(breaker, clock):
+    fail(breaker, 2)
+    clock.advance(61)
+    succeed(breaker, 2)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_after_open_seconds_and_closes_on_probe_successes(breaker, clock):
+    open_breaker(breaker)
+    clock.advance(30)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    with breaker.guard(), breaker.guard():
+        # 探测名额用尽时其余调用快速失败
+        with pytest.raises(UpstreamUnavailableError):
+            breaker.guard()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.snapshot()["calls_in_window"] == 0
+
+
+def test_failed_probe_reopens(breaker, clock):
+    open_breaker(breaker)
+    clock.advance(30)
+    with pytest.raises(httpx.ConnectError):
+        with breaker.guard():
+            raise httpx.ConnectError("down")
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.snapshot()["open_count"] == 2
+
+
+def test_client_errors_release_probe_without_counting(breaker, clock):
+    open_breaker(breaker)
+    clock.advance(30)
+    with pytest.raises(ValueError):
+        with breaker.guard():
+            raise ValueError("bad input")
+    # 名额已归还，仍可发出两个探测
+    with breaker.guard(), breaker.guard():
+        pass
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_is_upstream_failure_classification():
+    request = httpx.Request("POST", "http://upstream")
+    assert is_upstream_failure(httpx.HTTPStatusError("", request=request, response=httpx.Response(503)))
+    assert is_upstream_failure(httpx.HTTPStatusError("", request=request, response=httpx.Response(429)))
+    assert not is_upstream_failure(httpx.HTTPStatusError("", request=request, response=httpx.Response(400)))
+    assert is_upstream_failure(ExternalAPIError("boom"))
+    assert not is_upstream_failure(UpstreamUnavailableError("open"))
+    assert not is_upstream_failure(ValueError())
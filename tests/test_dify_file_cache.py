@@ -0,0 +1,66 @@
+import time
+
+import pytest
+from app.config import settings
+from app.models.dify_file import DifyFileUpload
+from app.services.image_service import ImageService
+from app.utils.api_client import dify_client
+from app.utils.key_pool import ApiKeyPool
+
+DIGEST = "a" * 64
+
+
+@pytest.fixture(autouse=True)
+def dedupe(monkeypatch):
+    monkeypatch.setattr(settings, "dify_upload_dedupe", True)
+
+
+def use_app(monkeypatch, key: str) -> str:
+    pool = ApiKeyPool("dify", [key])
+    monkeypatch.setattr(dify_client, "api_keys", pool)
+    return pool.fingerprint
+
+
+def test_find_returns_only_current_app_upload(db, monkeypatch):
+    use_app(monkeypatch, "app-one")
+    ImageService(db)._remember_dify_file(DIGEST, "user_1", "file-one")
+    use_app(monkeypatch, "app-two")
+
+    assert ImageService(db)._find_dify_file(DIGEST, "user_1") is None
+
+
+def test_find_skips_expired_upload(db, monkeypatch):
+    app_key = use_app(monkeypatch, "app-one")
+    db.add(DifyFileUpload(
+        sha256=DIGEST, dify_user="user_1", app_key=app_key,
+        upload_file_id="file-old", expires_at=time.time() - 1
+    ))
+    db.commit()
+
+    assert ImageService(db)._find_dify_file(DIGEST, "user_1") is None
+
+
+def test_forget_keeps_other_app_uploads(db, monkeypatch):
+    use_app(monkeypatch, "app-one")
+    ImageService(db)._remember_dify_file(DIGEST, "user_1", "file-one")
+    use_app(monkeypatch, "app-two")
+    service = ImageService(db)
+    service._remember_dify_file(DIGEST, "user_1", "file-two")
+
+    service._forget_dify_file(DIGEST, "user_1")
+
+    assert service._find_dify_file(DIGEST, "user_1") is None
+    use_app(monkeypatch, "app-one")
+    assert ImageService(db)._find_dify_file(DIGEST, "user_1") == "file-one"
+
+
+def test_forget_is_scoped_to_user(db, monkeypatch):
+    use_app(monkeypatch, "app-one")
+    service = ImageService(db)
+    service._remember_dify_file(DIGEST, "user_1", "file-one")
+    service._remember_dify_file(DIGEST, "user_2", "file-two")
+
+    service._forget_dify_file(DIGEST, "user_1")
+
+    assert service._find_dify_file(DIGEST, "user_1") is None
+    assert service._find_dify_file(DIGEST, "user_2") == "file-two"
@@ -0,0 +1,105 @@
+import asyncio
+import hashlib
+import io
+import pytest
+from fastapi import UploadFile
+from app.config import settings
+from app.core.exceptions import ExternalAPIError, FileUploadError
+from app.utils import file_utils
+from app.utils.file_utils import save_upload_file, tee_upload_file
+
+
+@pytest.fixture(autouse=True)
+def upload_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "upload_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "max_file_size", 64)
+    monkeypatch.setattr(file_utils, "UPLOAD_CHUNK_SIZE", 8)
+    return tmp_path
+
+
+def upload(data: bytes, size=None) -> UploadFile:
+    return UploadFile(io.BytesIO(data), filename="board.png", size=size)
+
+
+def stored_files(root) -> list:
+    return sorted(path.name for path in root.rglob("*") if path.is_file())
+
+
+def collecting_sink(received: list):
+    async def sink(chunks, filename):
+        async for chunk in chunks:
+            received.append(chunk)
+        return f"file-{filename}"
+    return sink
+
+
+@pytest.mark.asyncio
+async def test_save_streams_to_final_file(upload_dir):
+    data = bytes(range(50))
+    saved = await save_upload_file(upload(data), user_id=1, conversation_id=2)
+    assert saved.size == 50
+    assert saved.sha256 == hashlib.sha256(data).hexdigest()
+    with open(saved.file_path, "rb") as f:
+        assert f.read() == data
+    assert stored_files(upload_dir) == [saved.filename]
+
+
+@pytest.mark.asyncio
+async def test_known_sha256_is_reused(upload_dir):
+    saved = await save_upload_file(upload(b"abc"), user_id=1, sha256="precomputed")
+    assert saved.sha256 == "precomputed"
+
+
+@pytest.mark.asyncio
+async def test_oversized_upload_aborts_and_removes_partial_file(upload_dir):
+    with pytest.raises(FileUploadError):
+        await save_upload_file(upload(b"x" * 65), user_id=1, conversation_id=2)
+    assert stored_files(upload_dir) == []
+
+
+@pytest.mark.asyncio
+async def test_declared_size_is_rejected_before_writing(upload_dir):
+    with pytest.raises(FileUploadError):
+        await tee_upload_file(upload(b"x", size=1000), user_id=1, sink=collecting_sink([]))
+    assert stored_files(upload_dir) == []
+
+
+@pytest.mark.asyncio
+async def test_tee_writes_and_streams_same_bytes(upload_dir):
+    data = bytes(range(60))
+    received = []
+    saved, result = await tee_upload_file(upload(data), user_id=1, conversation_id=2, sink=collecting_sink(received))
+    assert b"".join(received) == data
+    assert result == f"file-{saved.filename}"
+    assert saved.sha256 == hashlib.sha256(data).hexdigest()
+    assert stored_files(upload_dir) == [saved.filename]
+
+
+@pytest.mark.asyncio
+async def test_tee_size_limit_cancels_sink_and_cleans_up(upload_dir):
+    sink_cancelled = asyncio.Event()
+
+    async def sink(chunks, filename):
+        try:
+            async for _ in chunks:
+                pass
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            sink_cancelled.set()
+            raise
+
+    with pytest.raises(FileUploadError):
+        await tee_upload_file(upload(b"x" * 100), user_id=1, conversation_id=2, sink=sink)
+    assert sink_cancelled.is_set()
+    assert stored_files(upload_dir) == []
+
+
+@pytest.mark.asyncio
+async def test_tee_sink_failure_removes_saved_file(upload_dir):
+    async def sink(chunks, filename):
+        await chunks.__anext__()
+        raise ExternalAPIError("上传失败", 500)
+
+    with pytest.raises(ExternalAPIError):
+        await tee_upload_file(upload(b"y" * 40), user_id=1, conversation_id=2, sink=sink)
+    assert stored_files(upload_dir) == []
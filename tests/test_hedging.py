@@ -0,0 +1,112 @@
+import asyncio
+import pytest
+from app.utils.hedging import HedgedRouter, ROUTE_FALLBACK, ROUTE_PRIMARY
+
+
+class Route:
+    """可控的上游流：首个分块前等待指定时间，记录是否被关闭"""
+
+    def __init__(self, name: str, first_delay: float, chunks=("1", "2"), error: Exception = None):
+        self.name = name
+        self.first_delay = first_delay
+        self.chunks = chunks
+        self.error = error
+        self.started = False
+        self.closed = False
+
+    def __call__(self):
+        self.started = True
+        return self._generate()
+
+    async def _generate(self):
+        try:
+            await asyncio.sleep(self.first_delay)
+            if self.error:
+                raise self.error
+            for chunk in self.chunks:
+                yield f"{self.name}{chunk}"
+        finally:
+            self.closed = True
+
+
+def make_router(max_ratio: float = 1.0) -> HedgedRouter:
+    return HedgedRouter("test", delay_seconds=0.05, max_ratio=max_ratio, window_seconds=60)
+
+
+async def read(router: HedgedRouter, primary: Route, fallback: Route, route_info: dict):
+    return [chunk async for chunk in router.stream(primary, fallback, route_info)]
+
+
+@pytest.mark.asyncio
+async def test_fast_primary_is_not_hedged():
+    router, info = make_router(), {}
+    primary, fallback = Route("p", 0.0), Route("f", 0.0)
+    assert await read(router, primary, fallback, info) == ["p1", "p2"]
+    assert info == {"route": ROUTE_PRIMARY, "hedged": False}
+    assert not fallback.started
+    assert router.stats()["hedged"] == 0
+
+
+@pytest.mark.asyncio
+async def test_fallback_wins_after_delay_and_primary_is_closed():
+    router, info = make_router(), {}
+    primary, fallback = Route("p", 1.0), Route("f", 0.0)
+    assert await read(router, primary, fallback, info) == ["f1", "f2"]
+    assert info == {"route": ROUTE_FALLBACK, "hedged": True}
+    assert primary.closed
+    assert router.stats()["fallback_wins"] == 1
+
+
+@pytest.mark.asyncio
+async def test_primary_can_still_win_after_hedging():
+    router, info = make_router(), {}
+    primary, fallback = Route("p", 0.08), Route("f", 1.0)
+    assert await read(router, primary, fallback, info) == ["p1", "p2"]
+    assert info == {"route": ROUTE_PRIMARY, "hedged": True}
+    assert fallback.closed
+    assert router.stats()["primary_wins"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_primary_leaves_hedge_running():
+    router, info = make_router(), {}
+    primary = Route("p", 0.08, error=RuntimeError("down"))
+    fallback = Route("f", 0.1)
+    assert await read(router, primary, fallback, info) == ["f1", "f2"]
+    assert info["route"] == ROUTE_FALLBACK
+
+
+@pytest.mark.asyncio
+async def test_failure_before_hedge_is_raised():
+    router = make_router()
+    primary, fallback = Route("p", 0.0, error=RuntimeError("down")), Route("f", 0.0)
+    with pytest.raises(RuntimeError):
+        await read(router, primary, fallback, {})
+    assert not fallback.started
+
+
+@pytest.mark.asyncio
+async def test_hedges_are_capped_by_ratio():
+    # 比例0.5：窗口内第1个请求允许对冲（至少一次），第2个请求时 1 >= 2×0.5 被封顶
+    router = make_router(max_ratio=0.5)
+    await read(router, Route("p", 0.06), Route("f", 0.0), {})
+    info = {}
+    assert await read(router, Route("p", 0.06), Route("f", 0.0), info) == ["p1", "p2"]
+    assert info == {"route": ROUTE_PRIMARY, "hedged": False}
+    assert router.stats()["hedge_capped"] == 1
+
+
+@pytest.mark.asyncio
+async def test_zero_ratio_never_hedges():
+    router, info = make_router(max_ratio=0), {}
+    fallback = Route("f", 0.0)
+    assert await read(router, Route("p", 0.06), fallback, info) == ["p1", "p2"]
+    assert not fallback.started
+    assert info["hedged"] is False
+
+
+@pytest.mark.asyncio
+async def test_empty_winner_yields_nothing():
+    router, info = make_router(), {}
+    assert await read(router, Route("p", 0.0, chunks=()), Route("f", 0.0), info) == []
+    assert info["route"] == ROUTE_PRIMARY
@@ -0,0 +1,96 @@
+import io
+import pytest
+from fastapi import UploadFile
+from PIL import Image
+from starlette.datastructures import Headers
+from app.config import settings
+from app.core.exceptions import FileUploadError
+from app.utils.image_validation import read_header, sniff_format, validate_image_upload
+
+
+def encode(fmt: str, size=(32, 24)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, "green").save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def upload(data: bytes, content_type: str, filename: str = "board.png") -> UploadFile:
+    return UploadFile(
+        io.BytesIO(data), filename=filename, size=len(data),
+        headers=Headers({"content-type": content_type})
+    )
+
+
+@pytest.mark.parametrize("fmt", ["JPEG", "PNG", "GIF", "BMP", "TIFF", "WEBP"])
+def test_sniff_recognises_supported_formats(fmt):
+    assert sniff_format(encode(fmt)[:16]) == fmt
+
+
+def test_sniff_recognises_big_endian_tiff():
+    assert sniff_format(b"MM\x00*\x00\x00\x00\x08") == "TIFF"
+
+
+@pytest.mark.parametrize("head", [
+    b"",
+    b"%PDF-1.7\n",
+    b"<!DOCTYPE html>",
+    b"\x00\x00\x01\x00\x01\x00",  # ICO
+    b"RIFF\x00\x00\x00\x00WAVE",
+])
+def test_sniff_rejects_unknown_formats(head):
+    assert sniff_format(head) is None
+
+
+def test_read_header_reports_size_and_rewinds():
+    file_obj = io.BytesIO(encode("PNG", (40, 30)))
+    assert read_header(file_obj) == {"format": "PNG", "width": 40, "height": 30}
+    assert file_obj.tell() == 0
+
+
+@pytest.mark.parametrize("data", [
+    encode("PNG")[:8],
+    encode("PNG")[:20],
+    encode("JPEG")[:3],
+    b"GIF89a",
+])
+def test_read_header_rejects_truncated_headers(data):
+    with pytest.raises(FileUploadError):
+        read_header(io.BytesIO(data))
+
+
+def test_read_header_rejects_unknown_format():
+    with pytest.raises(FileUploadError, match="不支持的图片格式"):
+        read_header(io.BytesIO(b"%PDF-1.7\n" + b"0" * 100))
+
+
+def test_read_header_enforces_pixel_limit(monkeypatch):
+    monkeypatch.setattr(settings, "image_max_pixels", 100)
+    with pytest.raises(FileUploadError, match="像素过多"):
+        read_header(io.BytesIO(encode("PNG", (20, 20))))
+
+
+@pytest.mark.asyncio
+async def test_content_type_is_not_trusted_for_format():
+    # 声明为PNG、文件名为.png，实际内容为JPEG：按文件头识别
+    info = await validate_image_upload(upload(encode("JPEG"), "image/png"))
+    assert info["format"] == "JPEG"
+
+
+@pytest.mark.asyncio
+async def test_spoofed_image_content_type_is_rejected():
+    with pytest.raises(FileUploadError, match="不支持的图片格式"):
+        await validate_image_upload(upload(b"<html><script></script></html>", "image/png"))
+
+
+@pytest.mark.asyncio
+async def test_non_image_content_type_is_rejected():
+    with pytest.raises(FileUploadError, match="请上传图片文件"):
+        await validate_image_upload(upload(encode("PNG"), "application/octet-stream"))
+
+
+@pytest.mark.asyncio
+async def test_magic_with_corrupt_body_fails_deep_verify(monkeypatch):
+    monkeypatch.setattr(settings, "image_deep_verify", True)
+    data = encode("PNG", (64, 64))
+    with pytest.raises(FileUploadError):
+        await validate_image_upload(upload(data[:len(data) - 20], "image/png"))
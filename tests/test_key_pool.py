@@ -0,0 +1,107 @@
+import httpx
+import pytest
+from app.config import settings
+from app.core.exceptions import ExternalAPIError, TaskError, UpstreamUnavailableError
+from app.utils import key_pool as key_pool_module
+from app.utils.key_pool import ApiKeyPool, SELECT_LEAST_LOADED, SELECT_ROUND_ROBIN, parse_keys
+
+
+@pytest.fixture
+def pool(clock, monkeypatch):
+    monkeypatch.setattr(key_pool_module, "time", clock)
+    monkeypatch.setattr(settings, "api_key_auth_quarantine_seconds", 300.0)
+    monkeypatch.setattr(settings, "api_key_quota_quarantine_seconds", 60.0)
+    return ApiKeyPool("test", ["key-a", "key-b"], SELECT_ROUND_ROBIN)
+
+
+def status_error(status_code: int, headers=None) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://upstream.test")
+    response = httpx.Response(status_code, headers=headers, request=request)
+    return httpx.HTTPStatusError("error", request=request, response=response)
+
+
+def fail(pool: ApiKeyPool, exc: BaseException) -> str:
+    """借出一个密钥并以exc结束调用，返回借出的密钥"""
+    with pytest.raises(type(exc)):
+        with pool.lease() as key:
+            raise exc
+    return key
+
+
+def leased(pool: ApiKeyPool, times: int = 4) -> set:
+    keys = set()
+    for _ in range(times):
+        with pool.lease() as key:
+            keys.add(key)
+    return keys
+
+
+def test_parse_keys_strips_blanks_and_duplicates():
+    assert parse_keys(" a, b,,a ,c ") == ["a", "b", "c"]
+
+
+def test_round_robin_rotates_leases(pool):
+    assert leased(pool) == {"key-a", "key-b"}
+
+
+def test_least_loaded_prefers_idle_key():
+    pool = ApiKeyPool("test", ["key-a", "key-b"], SELECT_LEAST_LOADED)
+    with pool.lease() as busy:
+        for _ in range(3):
+            with pool.lease() as key:
+                assert key != busy
+
+
+@pytest.mark.parametrize("status_code, seconds", [(401, 300), (403, 300), (429, 60)])
+def test_auth_and_quota_errors_quarantine_key(pool, clock, status_code, seconds):
+    key = fail(pool, status_error(status_code))
+    assert leased(pool) == {"key-a", "key-b"} - {key}
+
+    clock.advance(seconds - 1)
+    assert key not in leased(pool)
+    # 隔离到期后重新参与选择
+    clock.advance(1)
+    assert key in leased(pool)
+
+
+def test_retry_after_overrides_quota_cooldown(pool, clock):
+    key = fail(pool, status_error(429, {"Retry-After": "5"}))
+    clock.advance(4)
+    assert key not in leased(pool)
+    clock.advance(1)
+    assert key in leased(pool)
+
+
+def test_upstream_status_on_api_error_is_recognised(pool):
+    key = fail(pool, ExternalAPIError("配额不足", 429))
+    assert key not in leased(pool)
+
+
+def test_other_failures_do_not_quarantine(pool):
+    fail(pool, status_error(500))
+    fail(pool, TaskError("业务错误"))
+    assert leased(pool) == {"key-a", "key-b"}
+    stats = pool.stats()
+    assert stats["available"] == 2
+    assert sum(key["errors"] for key in stats["keys"]) == 1
+
+
+def test_all_keys_quarantined_raises_with_retry_after(pool, clock):
+    fail(pool, status_error(401))
+    quota_key = fail(pool, status_error(429))
+    with pytest.raises(UpstreamUnavailableError) as exc_info:
+        with pool.lease():
+            pass
+    # 最早到期的隔离决定重试时间
+    assert exc_info.value.retry_after == 60
+    assert pool.stats()["available"] == 0
+
+    clock.advance(60)
+    assert leased(pool) == {quota_key}
+
+
+def test_lease_releases_in_flight_count(pool):
+    with pool.lease():
+        assert sum(key["in_flight"] for key in pool.stats()["keys"]) == 1
+    fail(pool, status_error(500))
+    assert sum(key["in_flight"] for key in pool.stats()["keys"]) == 0
@@ -0,0 +1,108 @@
+import pytest
+from app.config import settings
+from app.models.conversation import Conversation
+from app.models.task import Task
+from app.models.user import User
+from app.services import near_duplicate_service as service_module
+from app.services.near_duplicate_service import NearDuplicateService
+
+RESULTS = {"BOM文件": "R1 10k", "需求文档": "5V电源"}
+
+
+@pytest.fixture(autouse=True)
+def fresh_index(monkeypatch):
+    monkeypatch.setattr(settings, "near_duplicate_enabled", True)
+    monkeypatch.setattr(settings, "near_duplicate_max_distance", 6)
+    monkeypatch.setattr(service_module, "_trees", service_module.OrderedDict())
+
+
+def add_user(db, name: str) -> User:
+    user = User(username=name, email=f"{name}@example.com", hashed_password="x")
+    db.add(user)
+    db.commit()
+    return user
+
+
+def add_analysis(db, user: User, status: str = "completed", results=RESULTS):
+    conversation = Conversation(user_id=user.id, title=f"会话{user.id}", results=dict(results))
+    db.add(conversation)
+    db.commit()
+    task = Task(
+        user_id=user.id,
+        conversation_id=conversation.id,
+        task_type="image_analysis",
+        status=status,
+        result_data=dict(results)
+    )
+    db.add(task)
+    db.commit()
+    return conversation, task
+
+
+def test_match_returns_result_of_fingerprinted_task(db):
+    user = add_user(db, "alice")
+    conversation, task = add_analysis(db, user)
+    service = NearDuplicateService(db)
+    service.record(user.id, conversation.id, task.id, "sha-a", 0b1010, "prompt")
+
+    # 会话之后被编辑或重新生成，不影响相似匹配返回的结果
+    conversation.results = {"BOM文件": "已修改", "需求文档": "已修改"}
+    db.commit()
+
+    match = service.find(user.id, 0b1011, exclude_conversation_id=-1)
+    assert match["conversation_id"] == conversation.id
+    assert match["distance"] == 1
+    assert match["results"] == RESULTS
+
+
+def test_unfinished_tasks_and_own_conversation_are_not_matched(db):
+    user = add_user(db, "bob")
+    failed_conversation, failed_task = add_analysis(db, user, status="failed")
+    conversation, task = add_analysis(db, user)
+    service = NearDuplicateService(db)
+    service.record(user.id, failed_conversation.id, failed_task.id, "sha-a", 0, "prompt")
+    service.record(user.id, conversation.id, task.id, "sha-b", 0, "prompt")
+
+    assert service.find(user.id, 0, exclude_conversation_id=-1)["conversation_id"] == conversation.id
+    assert service.find(user.id, 0, exclude_conversation_id=conversation.id) is None
+    assert service.find(add_user(db, "carol").id, 0, exclude_conversation_id=-1) is None
+
+
+def test_record_is_idempotent_per_image_and_prompt(db):
+    user = add_user(db, "dave")
+    conversation, task = add_analysis(db, user)
+    service = NearDuplicateService(db)
+    for _ in range(2):
+        service.record(user.id, conversation.id, task.id, "sha-a", 0, "prompt")
+    service.record(user.id, conversation.id, task.id, "sha-a", 0, "other prompt")
+    service.find(user.id, 0, exclude_conversation_id=-1)
+    assert len(service_module._trees[user.id][0]) == 2
+
+
+def test_index_evicts_least_recently_queried_users(db, monkeypatch):
+    monkeypatch.setattr(settings, "near_duplicate_index_max_images", 3)
+    service = NearDuplicateService(db)
+    users = [add_user(db, name) for name in ("u1", "u2", "u3")]
+    for user in users:
+        conversation, task = add_analysis(db, user)
+        for index in range(2):
+            service.record(user.id, conversation.id, task.id, f"sha-{index}", index, "prompt")
+
+    for user in users:
+        service.find(user.id, 0, exclude_conversation_id=-1)
+    assert list(service_module._trees) == [users[2].id]
+    assert service_module.near_duplicate_stats()["evicted"] >= 2
+
+    # 被淘汰的用户再次查询时从数据库重新载入
+    assert service.find(users[0].id, 0, exclude_conversation_id=-1) is not None
+
+
+def test_single_user_index_keeps_latest_fingerprints(db, monkeypatch):
+    monkeypatch.setattr(settings, "near_duplicate_index_max_images", 2)
+    user = add_user(db, "erin")
+    conversation, task = add_analysis(db, user)
+    service = NearDuplicateService(db)
+    for index in range(5):
+        service.record(user.id, conversation.id, task.id, f"sha-{index}", index, "prompt")
+    service.find(user.id, 0, exclude_conversation_id=-1)
+    assert len(service_module._trees[user.id][0]) == 2
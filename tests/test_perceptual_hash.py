@@ -0,0 +1,70 @@
+import io
+import random
+from PIL import Image, ImageDraw
+from app.utils.perceptual_hash import BKTree, dhash_file, hamming, hash_to_hex, hex_to_hash
+
+
+def encode(image: Image.Image, fmt: str, **params) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **params)
+    return buffer.getvalue()
+
+
+def sample_image(size=(320, 240)) -> Image.Image:
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    for i in range(0, size[0], 40):
+        draw.rectangle((i, i // 2, i + 20, i // 2 + 60), fill=(i % 256, 80, 160))
+    return image
+
+
+def test_hamming_and_hex_round_trip():
+    assert hamming(0b1011, 0b0001) == 2
+    assert hamming(0, 2 ** 64 - 1) == 64
+    assert hash_to_hex(255) == "00000000000000ff"
+    assert hex_to_hash(hash_to_hex(0x1234abcd)) == 0x1234abcd
+
+
+def test_bk_tree_search_matches_linear_scan():
+    rng = random.Random(7)
+    hashes = [rng.getrandbits(64) for _ in range(300)]
+    tree: BKTree[int] = BKTree()
+    for index, value in enumerate(hashes):
+        tree.add(value, index)
+    assert len(tree) == 300
+
+    query = hashes[0] ^ 0b101
+    for radius in (0, 2, 10, 28):
+        expected = sorted(
+            (hamming(query, value), index) for index, value in enumerate(hashes)
+            if hamming(query, value) <= radius
+        )
+        found = tree.search(query, radius)
+        assert sorted(found) == expected
+        assert [distance for distance, _ in found] == sorted(distance for distance, _ in found)
+
+
+def test_bk_tree_keeps_duplicate_hashes():
+    tree: BKTree[str] = BKTree()
+    assert tree.search(1, 64) == []
+    tree.add(1, "a")
+    tree.add(1, "b")
+    assert sorted(tree.search(1, 0)) == [(0, "a"), (0, "b")]
+
+
+def test_dhash_is_stable_across_resize_and_recompression():
+    image = sample_image()
+    original = dhash_file(io.BytesIO(encode(image, "PNG")))
+    resized = dhash_file(io.BytesIO(encode(image.resize((160, 120)), "JPEG", quality=70)))
+    assert original is not None
+    assert hamming(original, resized) <= 6
+
+
+def test_dhash_separates_different_images():
+    flipped = sample_image().transpose(Image.FLIP_LEFT_RIGHT)
+    original = dhash_file(io.BytesIO(encode(sample_image(), "PNG")))
+    assert hamming(original, dhash_file(io.BytesIO(encode(flipped, "PNG")))) > 10
+
+
+def test_dhash_returns_none_for_undecodable_data():
+    assert dhash_file(io.BytesIO(b"not an image")) is None
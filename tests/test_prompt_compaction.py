@@ -0,0 +1,74 @@
+import pytest
+from app.config import settings
+from app.utils.prompt_compaction import compact_bom, compact_prompt_inputs, compact_text, truncate_lines
+from app.utils.token_utils import estimate_tokens
+
+
+def test_compact_text_drops_fences_duplicates_and_blank_runs():
+    text = "```markdown\n需求  一\n\n\n需求  一\n需求二   \n```\n\n"
+    assert compact_text(text) == "需求 一\n\n需求二"
+
+
+def test_bom_duplicates_are_merged_by_quantity():
+    bom = "```csv\n型号,描述,数量,\nR1,电阻,2,\nC1,电容,1,\nR1,电阻,3,\nR1,电阻,0.5,\n```"
+    # 整列为空（含表头）的列被去除，重复行累加数量并保持首次出现的顺序
+    assert compact_bom(bom) == "型号,描述,数量\nR1,电阻,5.5\nC1,电容,1"
+
+
+def test_bom_rows_with_non_numeric_quantity_are_kept():
+    bom = "型号,数量\nR1,若干\nR1,若干\nR1,2\nR1,若干\nR1,3"
+    rows = compact_bom(f"```csv\n{bom}\n```").split("\n")
+    assert rows == ["型号,数量", "R1,若干", "R1,若干", "R1,5", "R1,若干"]
+
+
+def test_bom_from_markdown_table_without_quantity_column():
+    table = "说明文字\n| 型号 | 描述 |\n|---|---|\n| U1 | 单片机 |\n| U1 | 单片机 |\n| U2 | LDO |\n其他说明"
+    assert compact_bom(table) == "型号,描述\nU1,单片机\nU2,LDO"
+
+
+def test_unrecognized_bom_falls_back_to_text_compaction():
+    assert compact_bom("无表格\n\n\n无表格\n内容") == "无表格\n\n内容"
+
+
+def test_truncate_lines_within_budget_is_unchanged():
+    assert truncate_lines("一\n二", 10) == "一\n二"
+
+
+def test_truncate_lines_keeps_header_whole_rows_and_marks_omitted():
+    text = "\n".join(["型号,数量"] + [f"零件{i},{i}" for i in range(50)])
+    result = truncate_lines(text, 40, "# 已省略{count}行", keep_head=1, split_lines=False)
+    lines = result.split("\n")
+    assert lines[0] == "型号,数量"
+    assert all(line in text.split("\n") for line in lines[:-1])
+    assert lines[-1] == f"# 已省略{51 - (len(lines) - 1)}行"
+    assert estimate_tokens(result) <= 40
+
+
+def test_truncate_lines_cuts_the_overflowing_line():
+    text = "短行\n" + "很长的一行" * 40
+    result = truncate_lines(text, 30)
+    lines = result.split("\n")
+    assert lines[0] == "短行"
+    assert lines[1] and ("很长的一行" * 40).startswith(lines[1])
+    assert lines[-1] == "（以下内容因长度限制省略）"
+    assert estimate_tokens(result) <= 30
+
+
+@pytest.mark.parametrize("budget", [60, 120, 400])
+def test_compact_prompt_inputs_respects_budget(monkeypatch, budget):
+    monkeypatch.setattr(settings, "prompt_compaction_enabled", True)
+    requirement = "\n".join(f"第{i}条需求：电源电压稳定" for i in range(40))
+    bom = "```csv\n型号,数量\n" + "\n".join(f"C{i},{i}" for i in range(80)) + "\n```"
+    prompt = compact_prompt_inputs(requirement, bom, budget)
+    assert prompt.stats["truncated"]
+    assert prompt.stats["tokens_after"] <= budget
+    assert prompt.bom.startswith("型号,数量\n")
+    # 需求文档至少保留一半预算
+    assert estimate_tokens(prompt.requirement) >= budget // 2 - 10
+
+
+def test_compaction_disabled_passes_inputs_through(monkeypatch):
+    monkeypatch.setattr(settings, "prompt_compaction_enabled", False)
+    prompt = compact_prompt_inputs("需求\n\n\n", "a,b", 1)
+    assert (prompt.requirement, prompt.bom) == ("需求\n\n\n", "a,b")
+    assert prompt.stats["compacted"] is False
@@ -0,0 +1,82 @@
+import pytest
+from app.config import settings
+from app.core.exceptions import UpstreamUnavailableError
+from app.utils.rate_limiter import SQLiteBucketStore, UpstreamRateLimiter, parse_rate_limit_rules
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteBucketStore(str(tmp_path / "buckets.db"))
+
+
+def test_bucket_starts_full_and_refills(store):
+    # 容量2、每秒补充1个
+    bucket = [("k:rpm", 2.0, 1.0, 1.0)]
+    assert store._take(bucket, 100.0) == 0
+    assert store._take(bucket, 100.0) == 0
+    assert store._take(bucket, 100.0) == pytest.approx(1.0)
+    assert store._take(bucket, 100.5) == pytest.approx(0.5)
+    assert store._take(bucket, 101.0) == 0
+
+
+def test_refill_is_capped_at_capacity(store):
+    bucket = [("k:rpm", 2.0, 1.0, 1.0)]
+    store._take(bucket, 100.0)
+    for _ in range(2):
+        assert store._take(bucket, 1000.0) == 0
+    assert store._take(bucket, 1000.0) > 0
+
+
+def test_all_buckets_must_have_tokens_before_any_is_charged(store):
+    rpm = ("k:rpm", 10.0, 1.0, 1.0)
+    tpm = ("k:tpm", 100.0, 10.0, 80.0)
+    assert store._take([rpm, tpm], 100.0) == 0
+    # token桶不足：等待时间按最缺的桶计算，请求桶不扣减
+    assert store._take([rpm, tpm], 100.0) == pytest.approx(6.0)
+    for _ in range(9):
+        assert store._take([rpm], 100.0) == 0
+    assert store._take([rpm], 100.0) > 0
+
+
+def test_parse_rules_skips_malformed_entries():
+    assert parse_rate_limit_rules("a:60:0, b:30:1000,bad,:1:2") == {"a": (60, 0), "b": (30, 1000)}
+
+
+@pytest.fixture
+def limiter(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_enabled", True)
+    monkeypatch.setattr(settings, "redis_url", None)
+    monkeypatch.setattr(settings, "rate_limit_store_path", str(tmp_path / "limiter.db"))
+    monkeypatch.setattr(settings, "rate_limit_rules", "upload:2:0,chat:600:100")
+    return UpstreamRateLimiter()
+
+
+@pytest.mark.asyncio
+async def test_limiter_rejects_when_wait_exceeds_budget(limiter, monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_max_wait_seconds", 1.0)
+    await limiter.acquire("key-a", "upload")
+    await limiter.acquire("key-a", "upload")
+    with pytest.raises(UpstreamUnavailableError) as exc_info:
+        await limiter.acquire("key-a", "upload")
+    assert exc_info.value.retry_after >= 1
+    # 不同密钥各自计算
+    await limiter.acquire("key-b", "upload")
+    assert limiter.stats()["classes"]["upload"]["rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_oversized_token_request_is_charged_at_capacity(limiter, monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_max_wait_seconds", 0.0)
+    # 单次请求超过桶容量时按容量扣减，不会永远等待
+    await limiter.acquire("key-a", "chat", tokens=500)
+    with pytest.raises(UpstreamUnavailableError):
+        await limiter.acquire("key-a", "chat", tokens=1)
+
+
+@pytest.mark.asyncio
+async def test_unknown_class_and_disabled_limiter_pass_through(limiter, monkeypatch):
+    for _ in range(5):
+        await limiter.acquire("key-a", "unlisted")
+    monkeypatch.setattr(settings, "rate_limit_enabled", False)
+    for _ in range(5):
+        await limiter.acquire("key-a", "upload")
@@ -0,0 +1,106 @@
+import asyncio
+import pytest
+from app.core.exceptions import TaskCancelledError
+from app.utils.single_flight import SingleFlight
+
+
+def gated_source(gate: asyncio.Event, chunks, calls: list):
+    """第一个分块后等待gate再继续的生成器工厂"""
+    def factory(flight):
+        calls.append(flight.key)
+
+        async def generate():
+            yield chunks[0]
+            await gate.wait()
+            for chunk in chunks[1:]:
+                yield chunk
+        return generate()
+    return factory
+
+
+async def collect(flight):
+    return [chunk async for chunk in flight.subscribe()]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_joins_share_one_generation():
+    group, gate, calls = SingleFlight("test"), asyncio.Event(), []
+    factory = gated_source(gate, ["a", "b", "c"], calls)
+    first, leader = group.join("key", factory)
+    first_reader = asyncio.create_task(collect(first))
+    await asyncio.sleep(0)
+    # 后加入者回放已产生的分块
+    second, second_leader = group.join("key", factory)
+    second_reader = asyncio.create_task(collect(second))
+    await asyncio.sleep(0)
+    gate.set()
+    assert leader and not second_leader and second is first
+    assert await first_reader == await second_reader == ["a", "b", "c"]
+    assert calls == ["key"]
+    assert group.stats()["coalesced"] == 1
+    assert group.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_finished_flight_is_not_reused():
+    group, gate, calls = SingleFlight("test"), asyncio.Event(), []
+    gate.set()
+    factory = gated_source(gate, ["a"], calls)
+    flight, _ = group.join("key", factory)
+    await collect(flight)
+    _, leader = group.join("key", factory)
+    assert leader
+    assert calls == ["key", "key"]
+
+
+@pytest.mark.asyncio
+async def test_generation_error_reaches_every_subscriber():
+    group = SingleFlight("test")
+
+    def factory(flight):
+        async def generate():
+            yield "a"
+            raise ValueError("boom")
+        return generate()
+
+    flight, _ = group.join("key", factory)
+    readers = [asyncio.create_task(collect(flight)) for _ in range(2)]
+    results = await asyncio.gather(*readers, return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_cancel_surfaces_task_cancelled_and_allows_restart():
+    group, gate, calls = SingleFlight("test"), asyncio.Event(), []
+    factory = gated_source(gate, ["a", "b"], calls)
+    flight, _ = group.join("key", factory)
+    reader = asyncio.create_task(collect(flight))
+    await asyncio.sleep(0)
+    flight.cancel()
+    with pytest.raises(TaskCancelledError):
+        await reader
+    assert group.stats()["cancelled"] == 1
+    # 取消中的生成不再接受合并
+    restarted, leader = group.join("key", factory)
+    assert leader and restarted is not flight
+    gate.set()
+    assert await collect(restarted) == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_last_subscriber_leaving_cancels_generation():
+    group, gate, calls = SingleFlight("test"), asyncio.Event(), []
+    flight, _ = group.join("key", gated_source(gate, ["a", "b"], calls))
+    readers = [asyncio.create_task(collect(flight)) for _ in range(2)]
+    await asyncio.sleep(0.01)
+    assert group.stats()["subscribers"] == 2
+
+    readers[0].cancel()
+    await asyncio.sleep(0.01)
+    assert not flight.task.done()
+
+    readers[1].cancel()
+    await asyncio.gather(*readers, return_exceptions=True)
+    await asyncio.sleep(0.01)
+    assert flight.task.cancelled()
+    assert isinstance(flight.error, TaskCancelledError)
@@ -0,0 +1,63 @@
+from app.utils.sse import SSEDecoder
+
+
+def decode(*chunks: bytes):
+    decoder = SSEDecoder()
+    events = []
+    for chunk in chunks:
+        events.extend(decoder.feed(chunk))
+    events.extend(decoder.flush())
+    return decoder, events
+
+
+def test_single_event_lf():
+    _, events = decode(b'data: {"a": 1}\n\n')
+    assert len(events) == 1
+    assert events[0].event == "message"
+    assert events[0].json() == {"a": 1}
+
+
+def test_crlf_split_across_chunks():
+    # \r 与 \n 分属两个分块时不能被当作两个换行（否则会提前派发空事件）
+    _, events = decode(b"data: first\r", b"\n\r", b"\ndata: second\r\n\r\n")
+    assert [e.data for e in events] == ["first", "second"]
+
+
+def test_cr_only_line_endings():
+    _, events = decode(b"data: a\r\rdata: b\r\r")
+    assert [e.data for e in events] == ["a", "b"]
+
+
+def test_multi_line_data_joined_with_newline():
+    _, events = decode(b"data: line1\ndata: line2\ndata:line3\n\n")
+    assert events[0].data == "line1\nline2\nline3"
+
+
+def test_event_id_retry_and_comments():
+    decoder, events = decode(b": ping\nevent: node_started\nid: 7\nretry: 3000\ndata: x\n\n: ping\n")
+    assert decoder.comments == 2
+    assert len(events) == 1
+    assert (events[0].event, events[0].id, events[0].retry, events[0].data) == ("node_started", "7", 3000, "x")
+
+
+def test_event_name_resets_after_dispatch():
+    _, events = decode(b"event: custom\ndata: 1\n\ndata: 2\n\n")
+    assert [e.event for e in events] == ["custom", "message"]
+
+
+def test_byte_by_byte_matches_whole_stream():
+    stream = b'event: message\r\ndata: {"text": "\xe4\xbd\xa0\xe5\xa5\xbd"}\r\n\r\ndata: a\r\ndata: b\r\n\r\n'
+    _, whole = decode(stream)
+    _, split = decode(*(stream[i:i + 1] for i in range(len(stream))))
+    assert [(e.event, e.raw) for e in split] == [(e.event, e.raw) for e in whole]
+    assert whole[0].json() == {"text": "你好"}
+
+
+def test_flush_dispatches_event_without_trailing_blank_line():
+    _, events = decode(b"data: tail")
+    assert [e.data for e in events] == ["tail"]
+
+
+def test_blank_lines_without_data_do_not_emit_events():
+    _, events = decode(b"\n\n: keepalive\n\n")
+    assert events == []
@@ -0,0 +1,141 @@
+import asyncio
+import pytest
+from app.config import settings
+from app.core.exceptions import UpstreamTimeoutError
+from app.utils import upstream_timeout as timeout_module
+from app.utils.latency_tracker import LatencyTracker, METRIC_FIRST_EVENT, METRIC_NODE, METRIC_TOTAL
+from app.utils.upstream_timeout import (
+    PHASE_FIRST_EVENT, PHASE_IDLE, PHASE_NODE, PHASE_TOTAL, TimeoutBudget, parse_timeout_overrides
+)
+
+
+@pytest.fixture
+def tracker(monkeypatch):
+    tracker = LatencyTracker()
+    monkeypatch.setattr(timeout_module, "latency_tracker", tracker)
+    monkeypatch.setattr(settings, "adaptive_timeouts_enabled", True)
+    monkeypatch.setattr(settings, "adaptive_timeout_min_samples", 3)
+    monkeypatch.setattr(settings, "adaptive_timeout_percentile", 90.0)
+    monkeypatch.setattr(settings, "adaptive_timeout_multiplier", 2.0)
+    monkeypatch.setattr(settings, "adaptive_timeout_max_seconds", 900.0)
+    return tracker
+
+
+@pytest.fixture
+def budget(clock, tracker, monkeypatch):
+    monkeypatch.setattr(timeout_module, "time", clock)
+    budget = TimeoutBudget("test", connect=1, first_event=10, idle=3, total=20)
+    budget.started = clock.monotonic()
+    return budget
+
+
+def test_parse_overrides_keeps_blank_fields_as_default():
+    assert parse_timeout_overrides("a:1::5:, b:1:2, :1:2:3:4") == {"a": (1.0, None, 5.0, None)}
+
+
+def test_remaining_moves_from_first_event_to_idle(budget, clock):
+    assert budget._remaining() == (10, PHASE_FIRST_EVENT)
+    clock.advance(4)
+    budget.first_event_at = clock.monotonic()
+    assert budget._remaining() == (3, PHASE_IDLE)
+
+
+def test_remaining_reports_total_when_it_runs_out_first(budget, clock):
+    budget.first_event_at = clock.monotonic()
+    clock.advance(18)
+    assert budget._remaining() == (2, PHASE_TOTAL)
+
+
+def test_node_deadline_wins_only_when_it_is_closest(budget, clock):
+    budget.expect(30, "slow node")
+    assert budget._remaining()[1] == PHASE_FIRST_EVENT
+    budget.expect(5, "fast node")
+    assert budget._remaining() == (5, PHASE_NODE)
+    budget.expect(None)
+    assert budget._remaining()[1] == PHASE_FIRST_EVENT
+
+
+def test_expired_names_the_phase_and_limit(budget):
+    error = budget.expired(PHASE_IDLE)
+    assert isinstance(error, UpstreamTimeoutError)
+    assert error.phase == PHASE_IDLE
+    assert "3秒" in error.message
+    assert timeout_module.timeout_stats()["timeouts"]["test"][PHASE_IDLE] >= 1
+
+
+@pytest.mark.asyncio
+async def test_wait_returns_result_within_budget(budget):
+    async def reply():
+        return "ok"
+    assert await budget.wait(reply()) == "ok"
+
+
+@pytest.mark.asyncio
+async def test_wait_raises_and_counts_censored_timeout(budget, clock, tracker):
+    clock.advance(9.95)
+    with pytest.raises(UpstreamTimeoutError) as exc_info:
+        await budget.wait(asyncio.sleep(1))
+    assert exc_info.value.phase == PHASE_FIRST_EVENT
+    # 超时只计数，不作为延迟样本
+    series = tracker._series[("test", METRIC_FIRST_EVENT, "")]
+    assert series.censored == 1
+    assert len(series) == 0
+
+
+@pytest.mark.asyncio
+async def test_node_timeout_is_counted_under_node_name(budget, tracker):
+    budget.expect(0.05, "layout")
+    with pytest.raises(UpstreamTimeoutError) as exc_info:
+        await budget.wait(asyncio.sleep(1))
+    assert exc_info.value.phase == PHASE_NODE
+    assert tracker._series[("test", METRIC_NODE, "layout")].censored == 1
+
+
+@pytest.mark.asyncio
+async def test_repeated_timeouts_do_not_raise_the_limit(tracker, monkeypatch):
+    monkeypatch.setattr(settings, "upstream_first_event_timeout", 0.02)
+    monkeypatch.setattr(settings, "adaptive_timeout_min_seconds", 0.01)
+    for _ in range(3):
+        tracker.record("hung", METRIC_FIRST_EVENT, 0.01)
+    limits = []
+    for _ in range(5):
+        budget = TimeoutBudget("hung")
+        budget.started = timeout_module.time.monotonic()
+        limits.append(budget.first_event)
+        with pytest.raises(UpstreamTimeoutError):
+            await budget.wait(asyncio.sleep(1))
+    assert limits == [0.02] * 5
+    assert tracker._series[("hung", METRIC_FIRST_EVENT, "")].censored == 5
+
+
+def test_derived_timeout_can_drop_below_configured_to_floor(tracker, monkeypatch):
+    monkeypatch.setattr(settings, "upstream_first_event_timeout", 60.0)
+    monkeypatch.setattr(settings, "upstream_total_timeout", 300.0)
+    monkeypatch.setattr(settings, "adaptive_timeout_min_seconds", 5.0)
+    for _ in range(3):
+        tracker.record("fast", METRIC_FIRST_EVENT, 1.0)
+        tracker.record("fast", METRIC_TOTAL, 20.0)
+    budget = TimeoutBudget("fast")
+    assert budget.first_event == 5.0
+    assert budget.total == 40.0
+
+
+def test_derived_timeout_growth_is_bounded_per_window(tracker, monkeypatch):
+    monkeypatch.setattr(settings, "upstream_first_event_timeout", 60.0)
+    monkeypatch.setattr(settings, "adaptive_timeout_max_growth", 1.5)
+    monkeypatch.setattr(settings, "adaptive_timeout_max_seconds", 200.0)
+    monkeypatch.setattr(settings, "latency_window_size", 3)
+    for _ in range(3):
+        tracker.record("slow", METRIC_FIRST_EVENT, 80.0)
+    # 目标160秒，本窗口最多放宽到 60×1.5
+    assert TimeoutBudget("slow").first_event == 90.0
+    assert TimeoutBudget("slow").first_event == 90.0
+    for _ in range(3):
+        tracker.record("slow", METRIC_FIRST_EVENT, 80.0)
+    assert TimeoutBudget("slow").first_event == 135.0
+    for _ in range(3):
+        tracker.record("slow", METRIC_FIRST_EVENT, 150.0)
+    # 不超过配置上限
+    assert TimeoutBudget("slow").first_event == 200.0
+    # 显式参数优先于推导值
+    assert TimeoutBudget("slow", first_event=5).first_event == 5